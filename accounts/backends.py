@@ -0,0 +1,66 @@
+"""
+Authentication backend that loads ``request.user`` from the cache.
+
+``AuthenticationMiddleware`` calls ``get_user`` on every request with the id
+stored in the session. ``CachedModelBackend`` keeps the loaded user in
+AUTH_USER_CACHE under ``auth:user:<id>:<version>``; the version lives in
+AUTH_USER_VERSION_CACHE and is bumped by the CustomUser post_save /
+post_delete receivers, so a saved role, password, ``is_active`` or
+``last_login`` is seen on the next request and a deleted user is logged out.
+Together with the cached_db session engine a warm authenticated request
+reaches the view without a database query.
+
+AUTH_USER_CACHE is per-process memory: the user, password hash included,
+never leaves the worker that loaded it. AUTH_USER_VERSION_CACHE holds only
+numbers and must be shared by all workers (and by any process that saves
+users). A missing version starts at the current time in nanoseconds, so an
+evicted version never maps back onto an old cached user.
+"""
+import time
+
+from django.conf import settings
+from django.contrib.auth.backends import ModelBackend
+from django.core.cache import caches
+from django.db import transaction
+
+
+def _cache():
+    return caches[settings.AUTH_USER_CACHE]
+
+
+def _version_cache():
+    return caches[settings.AUTH_USER_VERSION_CACHE]
+
+
+def _version_key(user_id):
+    return f'auth:user-version:{user_id}'
+
+
+def invalidate_cached_user(user_id):
+    """Drop ``user_id``'s cached user now and again when the current transaction commits
+    (a request in between may have cached the row as it was before the commit)."""
+    def bump():
+        try:
+            _version_cache().incr(_version_key(user_id))
+        except ValueError:
+            pass  # nothing cached yet
+    bump()
+    transaction.on_commit(bump)
+
+
+class CachedModelBackend(ModelBackend):
+    def get_user(self, user_id):
+        versions = _version_cache()
+        version_key = _version_key(user_id)
+        version = versions.get(version_key)
+        if version is None:
+            versions.add(version_key, time.time_ns(), None)
+            version = versions.get(version_key)  # another process may have added first
+        key = f'auth:user:{user_id}:{version}'
+        user = _cache().get(key)
+        if user is None:
+            user = super().get_user(user_id)
+            if user is None:
+                return None
+            _cache().set(key, user, settings.AUTH_USER_CACHE_TIMEOUT)
+        return user if self.user_can_authenticate(user) else None
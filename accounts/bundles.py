@@ -0,0 +1,89 @@
+"""
+Streamed ZIP bundles of patient files.
+
+``iter_zip`` writes the archive on the fly: each member is read from storage
+in SECURE_FILE_CHUNK_SIZE pieces and every piece of ZIP output is yielded as
+soon as ``zipfile`` produces it, so neither the archive nor a whole member is
+ever held in memory or written to disk. The output stream is not seekable,
+which makes ``zipfile`` put sizes and CRCs in data descriptors after each
+member; ZIP64 records are used for members (and archives) over 4 GiB.
+Already-compressed formats (BUNDLE_STORED_EXTENSIONS) are stored, the rest
+deflated.
+"""
+import os
+import zipfile
+
+from django.conf import settings
+from django.utils import timezone
+
+
+class _Sink:
+    """Unseekable file object collecting what ``zipfile`` writes until it is drained."""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        """Return (as a 0- or 1-item list) the bytes written since the last drain."""
+        data = b''.join(self.parts)
+        self.parts = []
+        return [data] if data else []
+
+
+def bundle_entries(files):
+    """``(archive name, fieldfile, size, uploaded_at)`` per file, with unique names."""
+    entries, seen = [], set()
+    for patient_file in files:
+        folder = _safe(f'{patient_file.patient_name} ({patient_file.patient_id})')
+        stem, ext = os.path.splitext(_safe(patient_file.display_name))
+        name, n = f'{folder}/{stem}{ext}', 1
+        while name.lower() in seen:
+            n += 1
+            name = f'{folder}/{stem} ({n}){ext}'
+        seen.add(name.lower())
+        fieldfile = patient_file.file
+        entries.append((name, fieldfile, fieldfile.storage.size(fieldfile.name), patient_file.uploaded_at))
+    return entries
+
+
+def _safe(name):
+    return name.replace('/', '_').replace('\\', '_').strip() or 'file'
+
+
+def _zip_info(name, size, uploaded_at):
+    moment = timezone.localtime(uploaded_at) if uploaded_at else timezone.localtime()
+    info = zipfile.ZipInfo(name, date_time=max(moment.timetuple()[:6], (1980, 1, 1, 0, 0, 0)))
+    info.file_size = size  # lets zipfile decide on ZIP64 before writing the header
+    stored = os.path.splitext(name)[1].lower() in settings.BUNDLE_STORED_EXTENSIONS
+    info.compress_type = zipfile.ZIP_STORED if stored else zipfile.ZIP_DEFLATED
+    info.external_attr = 0o640 << 16
+    return info
+
+
+def iter_zip(entries, chunk_size=None):
+    """Yield a ZIP archive of ``entries`` (see ``bundle_entries``) piece by piece."""
+    chunk_size = chunk_size or settings.SECURE_FILE_CHUNK_SIZE
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as archive:
+        for name, fieldfile, size, uploaded_at in entries:
+            with fieldfile.storage.open(fieldfile.name, 'rb') as source, \
+                    archive.open(_zip_info(name, size, uploaded_at), 'w') as member:
+                while True:
+                    data = source.read(chunk_size)
+                    if not data:
+                        break
+                    member.write(data)
+                    yield from sink.drain()
+            yield from sink.drain()  # data descriptor
+    yield from sink.drain()  # central directory
+
+
+def bundle_filename(bundle):
+    return f"patient_files_{timezone.localtime(bundle.created_at):%Y%m%d}_{str(bundle.pk)[:8]}.zip"
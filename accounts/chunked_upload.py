@@ -0,0 +1,161 @@
+"""
+Resumable chunked uploads for doctor patient files.
+
+Protocol (all JSON, CSRF token in the ``X-CSRFToken`` header):
+
+* ``POST /uploads/`` with the file metadata creates an ``UploadSession``.
+* ``PUT /uploads/<id>/`` with ``Content-Range: bytes <start>-<end>/<total>``
+  writes one chunk at ``start``; ``start`` must equal the acknowledged offset.
+* ``GET /uploads/<id>/`` returns the acknowledged offset to resume from.
+* ``POST /uploads/<id>/finalize/`` creates the ``PatientFile`` once every byte
+  has arrived.
+
+Chunks are copied from the request stream to a per-session temp file in small
+blocks, so memory per upload stays constant whatever the file size. The temp
+file is encrypted like stored files (accounts/streamcrypto.py): each PUT
+resumes the stream at the acknowledged offset, dropping whatever an
+interrupted PUT left past it and sealing its last, partial chunk again under a
+fresh nonce. A PUT claims the session before touching the temp file, so two
+PUTs for the same offset never write it at the same time.
+"""
+import os
+import re
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files import File
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import PatientFile, UploadSession
+from .streamcrypto import DecryptionError, EncryptedReader, EncryptedWriter
+
+_CONTENT_RANGE_RE = re.compile(r'^bytes (\d+)-(\d+)/(\d+)$')
+COPY_BLOCK_SIZE = 64 * 1024
+
+
+class UploadError(Exception):
+    def __init__(self, message, status=400):
+        super().__init__(message)
+        self.status = status
+
+
+def temp_path(session):
+    return os.path.join(settings.CHUNKED_UPLOAD_TEMP_DIR, f'{session.id}.part')
+
+
+def parse_content_range(header, session):
+    """Return ``(start, length)`` for a Content-Range header that fits ``session``."""
+    match = _CONTENT_RANGE_RE.match((header or '').strip())
+    if not match:
+        raise UploadError("Content-Range header 'bytes <start>-<end>/<total>' is required.")
+    start, end, total = (int(group) for group in match.groups())
+    if total != session.total_size or end < start or end >= total:
+        raise UploadError("Content-Range does not match this upload.", status=416)
+    length = end - start + 1
+    if length > settings.CHUNKED_UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError("Chunk is larger than CHUNKED_UPLOAD_MAX_CHUNK_SIZE.", status=413)
+    return start, length
+
+
+def write_chunk(session, stream, start, length):
+    """Encrypt ``length`` bytes from ``stream`` into the temp file after the first
+    ``start`` and acknowledge them. Returns the new offset."""
+    if start != session.received:
+        raise UploadError(f"Expected offset {session.received}.", status=409)
+
+    # Claim the session for this offset before writing: of two concurrent PUTs
+    # only the one whose UPDATE changes the row touches the temp file.
+    claimed_at = timezone.now()
+    idle = Q(writing_since__isnull=True) | Q(
+        writing_since__lt=claimed_at - timedelta(seconds=settings.CHUNKED_UPLOAD_LEASE_SECONDS),
+    )
+    if not UploadSession.objects.filter(idle, id=session.id, received=start).update(writing_since=claimed_at):
+        session.refresh_from_db(fields=['received'])
+        raise UploadError(f"Expected offset {session.received}; another chunk may still be in flight.", status=409)
+    claim = UploadSession.objects.filter(id=session.id, writing_since=claimed_at)
+    try:
+        _write(session, stream, start, length)
+    except BaseException:
+        claim.update(writing_since=None)
+        raise
+
+    new_offset = start + length
+    # Still ours unless this PUT outlived its lease and another one took over.
+    if not claim.update(received=new_offset, writing_since=None, updated_at=timezone.now()):
+        session.refresh_from_db(fields=['received'])
+        raise UploadError(f"Expected offset {session.received}.", status=409)
+    session.received = new_offset
+    return new_offset
+
+
+def _write(session, stream, start, length):
+    os.makedirs(settings.CHUNKED_UPLOAD_TEMP_DIR, exist_ok=True)
+    path = temp_path(session)
+    if start and not os.path.exists(path):
+        raise UploadError("Upload data is missing; start again.", status=410)
+    with open(path, 'r+b' if start else 'wb') as fh:
+        try:
+            # resume() truncates the file to the acknowledged offset first
+            writer = EncryptedWriter.resume(fh, start) if start else EncryptedWriter(fh)
+        except DecryptionError:
+            raise UploadError("Upload data is damaged; start again.", status=410)
+        with writer:
+            remaining = length
+            while remaining:
+                block = stream.read(min(COPY_BLOCK_SIZE, remaining))
+                if not block:
+                    raise UploadError("Request body is shorter than its Content-Range.")
+                writer.write(block)
+                remaining -= len(block)
+
+
+def finalize(session):
+    """Create the ``PatientFile`` from a complete upload and drop the session."""
+    if not session.is_complete:
+        raise UploadError(f"Upload incomplete: {session.received} of {session.total_size} bytes.", status=409)
+
+    path = temp_path(session)
+    try:
+        fh = EncryptedReader(open(path, 'rb'))
+    except (OSError, DecryptionError):
+        raise UploadError("Upload data is missing or damaged; start again.", status=410)
+    with fh, transaction.atomic():
+        patient_file = PatientFile(
+            doctor=session.doctor,
+            patient_name=session.patient_name,
+            patient_id=session.patient_id,
+            disease=session.disease,
+            access_email=session.access_email,
+            original_name=session.filename,
+            file=File(fh, name=session.filename),
+        )
+        # save() stores the bytes content-addressed; the blob may be shared, so a
+        # failure here leaves it to FileBlob bookkeeping rather than deleting it.
+        patient_file.save()
+        session.delete()
+    transaction.on_commit(lambda: _remove(path))
+    return patient_file
+
+
+def discard(session):
+    _remove(temp_path(session))
+    session.delete()
+
+
+def purge_stale(max_age_hours=None):
+    """Delete sessions (and temp files) untouched for ``max_age_hours``."""
+    max_age_hours = max_age_hours or settings.CHUNKED_UPLOAD_EXPIRY_HOURS
+    cutoff = timezone.now() - timedelta(hours=max_age_hours)
+    stale = list(UploadSession.objects.filter(updated_at__lt=cutoff))
+    for session in stale:
+        discard(session)
+    return len(stale)
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
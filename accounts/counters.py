@@ -0,0 +1,27 @@
+"""
+Exact values for the dashboard counters, computed from the tables.
+
+Used by the ``reconcile_counters`` command and the initial data migration;
+request handling only ever reads ``DashboardCounter``.
+"""
+from django.db.models import Count
+
+from .models import CustomUser, DashboardCounter, Patient
+
+
+def actual_counts():
+    counts = {f'users.{role}': 0 for role, _ in CustomUser.ROLE_CHOICES}
+    for row in CustomUser.objects.values('role').annotate(n=Count('id')).order_by():
+        counts[f"users.{row['role']}"] = row['n']
+    counts['patients'] = Patient.objects.count()
+    return counts
+
+
+def reconcile():
+    """Overwrite every counter with its true value. Returns ``{name: (stored, actual)}`` for drifted ones."""
+    actual = actual_counts()
+    stored = DashboardCounter.read(*actual)
+    drift = {name: (stored[name], value) for name, value in actual.items() if stored[name] != value}
+    for name, value in actual.items():
+        DashboardCounter.objects.update_or_create(name=name, defaults={'value': value})
+    return drift
@@ -0,0 +1,97 @@
+"""
+Encryption of PHI column values (AES-256-GCM).
+
+Keys are derived with HKDF-SHA256 from the secrets in PHI_ENCRYPTION_KEYS
+(the first one encrypts, all of them decrypt, so a new key can be put in
+front and the old ones kept until every row was re-saved). Derivation runs
+once per process and purpose (``functools.lru_cache``). The same secrets,
+derived for another purpose, encrypt stored files (accounts/streamcrypto.py).
+
+A stored value is ``enc1$<key id>$<base64url(nonce | ciphertext | tag)>``.
+The model and column name are bound in as associated data, so a value
+copied into another column does not decrypt. Empty strings are stored as
+they are; values without the prefix are read back unchanged (plaintext
+written before the column was encrypted).
+"""
+import base64
+import functools
+import hashlib
+import hmac
+import os
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+PREFIX = 'enc1$'
+NONCE_SIZE = 12
+
+
+class DecryptionError(Exception):
+    pass
+
+
+def _secrets():
+    secrets = tuple(secret for secret in settings.PHI_ENCRYPTION_KEYS if secret)
+    if not secrets:
+        raise ImproperlyConfigured(
+            "PHI_ENCRYPTION_KEYS is not set: put one or more comma-separated secrets in the environment."
+        )
+    return secrets
+
+
+@functools.lru_cache(maxsize=None)
+def _derive(secret, purpose):
+    return HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=purpose.encode()).derive(secret.encode())
+
+
+@functools.lru_cache(maxsize=None)
+def _keyring(secrets, purpose):
+    ciphers = {}
+    for secret in secrets:
+        key = _derive(secret, purpose)
+        ciphers.setdefault(hashlib.sha256(key).hexdigest()[:8], AESGCM(key))
+    return next(iter(ciphers)), ciphers
+
+
+def keyring(purpose):
+    """``(current key id, {key id: AESGCM})`` for ``purpose``; key ids are 8 hex digits."""
+    return _keyring(_secrets(), purpose)
+
+
+def encrypt(plaintext, context):
+    """Encrypt ``plaintext`` (str) for the column named by ``context``."""
+    if plaintext == '':
+        return ''
+    key_id, ciphers = keyring('phi-column')
+    nonce = os.urandom(NONCE_SIZE)
+    sealed = ciphers[key_id].encrypt(nonce, plaintext.encode(), context.encode())
+    return f"{PREFIX}{key_id}${base64.urlsafe_b64encode(nonce + sealed).decode().rstrip('=')}"
+
+
+def decrypt(token, context):
+    """Inverse of ``encrypt``; raises DecryptionError for an unknown key or a tampered value."""
+    if not is_encrypted(token):
+        return token
+    key_id, _, data = token[len(PREFIX):].partition('$')
+    cipher = keyring('phi-column')[1].get(key_id)
+    if cipher is None:
+        raise DecryptionError(f"No key with id {key_id} in PHI_ENCRYPTION_KEYS.")
+    raw = base64.urlsafe_b64decode(data + '=' * (-len(data) % 4))
+    try:
+        return cipher.decrypt(raw[:NONCE_SIZE], raw[NONCE_SIZE:], context.encode()).decode()
+    except InvalidTag:
+        raise DecryptionError(f"Value for {context} does not decrypt (wrong key or altered).")
+
+
+def is_encrypted(value):
+    return isinstance(value, str) and value.startswith(PREFIX)
+
+
+def blind_token(word):
+    """Keyed hash of a search word: the same for equal words, meaningless without the key."""
+    key = _derive(_secrets()[0], 'patient-search')
+    return base64.b32encode(hmac.digest(key, word.encode(), 'sha256')[:10]).decode().lower()
@@ -0,0 +1,140 @@
+"""
+Protected file delivery.
+
+Stored files are never exposed under MEDIA_URL. After an OTP check the view
+records a short-lived grant in the session and redirects to a download
+endpoint, which streams the file from storage in fixed-size chunks (with
+byte-range and ETag support) or hands the transfer to the front-end web
+server via ``X-Accel-Redirect`` (nginx) / ``X-Sendfile`` (Apache). Files in
+an encrypting storage (accounts/storage.py) are always streamed by Python: the
+web server would send the ciphertext. Their ranges decrypt only the chunks
+they cover.
+"""
+import hashlib
+import mimetypes
+import os
+import re
+import time
+from urllib.parse import quote
+
+from django.conf import settings
+from django.http import HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import content_disposition_header, parse_etags
+
+_RANGE_RE = re.compile(r'^bytes=(\d*)-(\d*)$')
+
+
+# ---------------- Session grants ----------------
+def grant_download(request, kind, pk):
+    """Allow this session to download object ``kind:pk`` for SECURE_DOWNLOAD_GRANT_SECONDS."""
+    now = time.time()
+    grants = {
+        key: expires for key, expires in request.session.get('download_grants', {}).items()
+        if expires > now
+    }
+    grants[f'{kind}:{pk}'] = now + settings.SECURE_DOWNLOAD_GRANT_SECONDS
+    request.session['download_grants'] = grants
+
+
+def has_download_grant(request, kind, pk):
+    expires = request.session.get('download_grants', {}).get(f'{kind}:{pk}')
+    return expires is not None and expires > time.time()
+
+
+# ---------------- Responses ----------------
+def file_etag(storage, name, size):
+    """Strong validator derived from the stored name, size and modification time."""
+    try:
+        mtime = storage.get_modified_time(name).timestamp()
+    except (NotImplementedError, OSError):
+        mtime = 0
+    digest = hashlib.sha256(f'{name}:{size}:{mtime}'.encode()).hexdigest()[:32]
+    return f'"{digest}"'
+
+
+def parse_range(header, size):
+    """Return ``(start, end)`` (inclusive) for a single ``bytes=`` range, ``None`` to
+    ignore the header, or ``False`` when the range cannot be satisfied."""
+    match = _RANGE_RE.match(header.strip()) if header else None
+    if not match:
+        return None  # absent, malformed or multi-range: serve the whole file
+    first, last = match.groups()
+    if not first and not last:
+        return None
+    if not first:  # suffix range: the last N bytes
+        length = int(last)
+        if length == 0 or size == 0:
+            return False
+        return max(size - length, 0), size - 1
+    start = int(first)
+    end = min(int(last), size - 1) if last else size - 1
+    if start >= size or start > end:
+        return False
+    return start, end
+
+
+def iter_file_range(storage, name, start, length, chunk_size):
+    """Yield ``length`` bytes from ``start`` without ever holding more than one chunk."""
+    with storage.open(name, 'rb') as fh:
+        if start:
+            fh.seek(start)
+        remaining = length
+        while remaining > 0:
+            data = fh.read(min(chunk_size, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+
+def serve_file(request, fieldfile, filename=None, as_attachment=False):
+    """Stream ``fieldfile`` to the client honouring Range, If-Range and If-None-Match."""
+    storage, name = fieldfile.storage, fieldfile.name
+    filename = filename or os.path.basename(name)
+    content_type = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+    size = storage.size(name)
+    etag = file_etag(storage, name, size)
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if if_none_match and (if_none_match.strip() == '*' or etag in parse_etags(if_none_match)):
+        response = HttpResponseNotModified()
+        response['ETag'] = etag
+        return response
+
+    mode = settings.SECURE_FILE_DELIVERY
+    if mode in ('x-accel-redirect', 'x-sendfile') and not getattr(storage, 'encrypted', False):
+        # The web server does the transfer (ranges included); Python sends no file bytes.
+        response = HttpResponse(content_type=content_type)
+        if mode == 'x-accel-redirect':
+            response['X-Accel-Redirect'] = settings.SECURE_FILE_ACCEL_PREFIX + quote(name)
+        else:
+            response['X-Sendfile'] = storage.path(name)
+    else:
+        byte_range = None
+        if_range = request.META.get('HTTP_IF_RANGE')
+        if not if_range or if_range.strip() == etag:
+            byte_range = parse_range(request.META.get('HTTP_RANGE'), size)
+        if byte_range is False:
+            response = HttpResponse(status=416)
+            response['Content-Range'] = f'bytes */{size}'
+            return response
+
+        start, end = byte_range or (0, size - 1)
+        length = max(end - start + 1, 0)
+        if request.method == 'HEAD':
+            response = HttpResponse(content_type=content_type)
+        else:
+            response = StreamingHttpResponse(
+                iter_file_range(storage, name, start, length, settings.SECURE_FILE_CHUNK_SIZE),
+                content_type=content_type,
+            )
+        if byte_range:
+            response.status_code = 206
+            response['Content-Range'] = f'bytes {start}-{end}/{size}'
+        response['Content-Length'] = str(length)
+        response['Accept-Ranges'] = 'bytes'
+
+    response['ETag'] = etag
+    response['Cache-Control'] = 'private, no-cache'
+    response['Content-Disposition'] = content_disposition_header(as_attachment, filename)
+    return response
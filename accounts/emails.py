@@ -0,0 +1,214 @@
+"""
+Precompiled transactional email layouts.
+
+Each layout is rendered through the Django template engine once per process
+with placeholder markers in place of the per-message values, its CSS is
+inlined, and the result is split into static chunks. Sending a message then
+only escapes the handful of variable values (OTP, username, patient name ...)
+and joins them with the cached chunks.
+"""
+import re
+from functools import lru_cache
+
+from django.conf import settings
+from django.template.loader import render_to_string
+from django.utils.html import escape
+
+from .outbox import enqueue_mail
+
+SITE_NAME = 'Secure Health'
+
+# name -> (subject, template base name, per-message variables)
+LAYOUTS = {
+    'registration': (
+        "🎉 Welcome to Secure Health - Your OTP for Login",
+        'registration_email',
+        ('username', 'otp'),
+    ),
+    'login_otp': (
+        "Secure Health - OTP Login Request",
+        'login_otp_email',
+        ('username', 'otp'),
+    ),
+    'file_access_otp': (
+        "Secure Health - Access Patient File",
+        'file_access_otp_email',
+        ('patient_name', 'file_name', 'otp'),
+    ),
+    'bundle_access_otp': (
+        "Secure Health - Access Patient Files",
+        'bundle_access_otp_email',
+        ('file_count', 'file_names', 'access_url', 'otp'),
+    ),
+    'patient_record': (
+        "Secure Health - Patient Record Created Successfully",
+        'patient_record_email',
+        ('username', 'patient_name', 'date_of_birth', 'patient_id', 'timestamp', 'otp'),
+    ),
+    'patient_access': (
+        "Secure Health - Access to Patient Medical Records",
+        'patient_access_email',
+        ('patient_name', 'date_of_birth', 'authorized_by', 'timestamp', 'otp'),
+    ),
+}
+
+# Private-use code points: never produced by templates and left alone by autoescaping.
+_MARK_OPEN = '\ue000'
+_MARK_CLOSE = '\ue001'
+_MARK_RE = re.compile(f'{_MARK_OPEN}(\\w+){_MARK_CLOSE}')
+
+
+class CompiledTemplate:
+    """A template pre-rendered into static chunks with named holes between them."""
+
+    def __init__(self, rendered, autoescape):
+        parts = _MARK_RE.split(rendered)
+        self.chunks = parts[0::2]
+        self.names = parts[1::2]
+        self.autoescape = autoescape
+
+    def render(self, values):
+        out = [self.chunks[0]]
+        for name, chunk in zip(self.names, self.chunks[1:]):
+            value = str(values[name])
+            out.append(escape(value) if self.autoescape else value)
+            out.append(chunk)
+        return ''.join(out)
+
+
+class EmailLayout:
+    def __init__(self, name):
+        self.subject, template, self.variables = LAYOUTS[name]
+        context = {var: f'{_MARK_OPEN}{var}{_MARK_CLOSE}' for var in self.variables}
+        context.update(support_email=settings.SUPPORT_EMAIL, site_name=SITE_NAME)
+        self.html = CompiledTemplate(inline_css(render_to_string(f'{template}.html', context)), autoescape=True)
+        self.text = CompiledTemplate(render_to_string(f'{template}.txt', context), autoescape=False)
+
+    def render(self, **values):
+        """Return ``(subject, text, html)`` for one message."""
+        missing = set(self.variables) - set(values)
+        if missing:
+            raise KeyError(f"Missing email variables: {', '.join(sorted(missing))}")
+        return self.subject, self.text.render(values), self.html.render(values)
+
+
+@lru_cache(maxsize=None)
+def get_layout(name):
+    """Compile ``name`` on first use; later calls reuse the compiled layout."""
+    return EmailLayout(name)
+
+
+def render_email(name, **values):
+    return get_layout(name).render(**values)
+
+
+def send_templated_mail(name, recipient_list, **values):
+    """Render layout ``name`` and queue it in the outbox."""
+    subject, text, html = render_email(name, **values)
+    return enqueue_mail(subject, text, settings.EMAIL_HOST_USER, recipient_list, html_message=html)
+
+
+# ---------------- CSS inlining ----------------
+_STYLE_BLOCK_RE = re.compile(r'<style[^>]*>(.*?)</style>', re.S | re.I)
+_COMMENT_RE = re.compile(r'/\*.*?\*/', re.S)
+_AT_STATEMENT_RE = re.compile(r'@(?:import|charset)\s+(?:url\([^)]*\)|"[^"]*"|\'[^\']*\')[^;{]*;')
+_START_TAG_RE = re.compile(r'<([a-zA-Z][a-zA-Z0-9]*)(\s[^<>]*?)?(/?)>')
+_ATTR_RE = re.compile(r'\s(class|style)\s*=\s*"([^"]*)"', re.I)
+_SIMPLE_SELECTOR_RE = re.compile(r'^([a-zA-Z][a-zA-Z0-9]*)?(?:\.([\w-]+))?$')
+
+
+def _parse_css(css):
+    """Split a stylesheet into (inlinable rules, leftover css text).
+
+    Only ``tag``, ``.class`` and ``tag.class`` selectors are inlined; at-rules,
+    pseudo selectors, combinators and ``*`` stay in the ``<style>`` block.
+    """
+    css = _COMMENT_RE.sub('', css)
+    rules = []
+    leftover = [stmt.strip() for stmt in _AT_STATEMENT_RE.findall(css)]
+    css = _AT_STATEMENT_RE.sub('', css)
+    pos = 0
+    while pos < len(css):
+        brace = css.find('{', pos)
+        if brace == -1:
+            tail = css[pos:].strip()
+            if tail:
+                leftover.append(tail)
+            break
+        prelude = css[pos:brace].strip()
+        depth, end = 0, brace
+        while end < len(css):
+            if css[end] == '{':
+                depth += 1
+            elif css[end] == '}':
+                depth -= 1
+                if depth == 0:
+                    break
+            end += 1
+        body = css[brace + 1:end].strip()
+        pos = end + 1
+
+        selectors = [sel.strip() for sel in prelude.split(',')]
+        if prelude.startswith('@'):
+            leftover.append(f'{prelude} {{ {body} }}')
+            continue
+        declarations = ' '.join(body.split())
+        if not all(_SIMPLE_SELECTOR_RE.match(sel) for sel in selectors):
+            leftover.append(f'{prelude} {{ {declarations} }}')
+            continue
+        if declarations and not declarations.endswith(';'):
+            declarations += ';'
+        for sel in selectors:
+            tag, cls = _SIMPLE_SELECTOR_RE.match(sel).groups()
+            rules.append((tag.lower() if tag else None, cls, declarations))
+    return rules, '\n'.join(leftover)
+
+
+def inline_css(html):
+    """Copy simple ``<style>`` rules onto matching elements as ``style`` attributes."""
+    rules, leftover = [], []
+    for block in _STYLE_BLOCK_RE.findall(html):
+        block_rules, block_leftover = _parse_css(block)
+        rules.extend(block_rules)
+        if block_leftover:
+            leftover.append(block_leftover)
+    if not rules:
+        return html
+
+    # tag rules first, then class rules: a rough stand-in for specificity
+    rules.sort(key=lambda rule: rule[1] is not None)
+
+    def apply(match):
+        tag, attrs, selfclose = match.group(1), match.group(2) or '', match.group(3)
+        if tag.lower() in ('style', 'html', 'head', 'meta', 'title'):
+            return match.group(0)
+        found = dict((name.lower(), value) for name, value in _ATTR_RE.findall(attrs))
+        classes = found.get('class', '').split()
+        styles = [
+            decl for rule_tag, rule_cls, decl in rules
+            if (rule_tag is None or rule_tag == tag.lower()) and (rule_cls is None or rule_cls in classes)
+        ]
+        if not styles:
+            return match.group(0)
+        existing = found.get('style', '').strip()
+        if existing:
+            styles.append(existing if existing.endswith(';') else existing + ';')  # inline style wins
+            attrs = re.sub(r'\sstyle\s*=\s*"[^"]*"', '', attrs, flags=re.I)
+        style_attr = ' '.join(styles).replace('"', "'")
+        return f'<{tag}{attrs} style="{style_attr}"{selfclose}>'
+
+    head_end = html.lower().find('</head>')
+    head, body = (html[:head_end], html[head_end:]) if head_end != -1 else ('', html)
+    body = _START_TAG_RE.sub(apply, body)
+
+    # keep what could not be inlined (media queries, pseudo elements ...) in one <style>
+    leftover_css = '\n'.join(leftover)
+    kept = []
+
+    def replace_style(match):
+        if kept or not leftover_css:
+            return ''
+        kept.append(True)
+        return f'<style>\n{leftover_css}\n</style>'
+
+    return _STYLE_BLOCK_RE.sub(replace_style, head) + body
@@ -0,0 +1,151 @@
+"""
+Streaming CSV / NDJSON exports of Patient and PatientFile rows.
+
+Rows are read with ``values_list(*columns).iterator(chunk_size)``: only the
+requested columns are selected (the large TextFields stay in the database
+unless asked for), no model instances are built and at most one fetch of
+EXPORT_CHUNK_SIZE rows is held in memory. Output is yielded in blocks of
+about EXPORT_BUFFER_SIZE bytes; the CSV header and the first row are sent on
+their own, so a client sees the first bytes as soon as the query starts.
+
+Used by ``export_view`` (StreamingHttpResponse) and the ``export_records``
+management command.
+"""
+import csv
+import datetime
+import json
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections
+
+from .fields import EncryptedMixin, plaintext
+from .models import Patient, PatientFile
+
+
+class Export:
+    def __init__(self, model, role, owner_field, columns, default_columns):
+        self.model = model
+        self.role = role  # who may export through the web view (their own rows only)
+        self.owner_field = owner_field
+        self.columns = columns
+        self.default_columns = default_columns
+
+    def queryset(self, owner=None):
+        queryset = self.model.objects.all()
+        if owner is not None:
+            queryset = queryset.filter(**{self.owner_field: owner})
+        return queryset
+
+    def clean_columns(self, requested):
+        """Validate a list of column names (empty: the defaults). Raises ValueError."""
+        columns = [name.strip() for name in requested if name.strip()] or list(self.default_columns)
+        unknown = [name for name in columns if name not in self.columns]
+        if unknown:
+            raise ValueError(f"Unknown column(s): {', '.join(unknown)}. Choose from: {', '.join(self.columns)}")
+        return columns
+
+
+EXPORTS = {
+    'patients': Export(
+        Patient, 'management', 'uploaded_by',
+        columns=(
+            'id', 'full_name', 'date_of_birth', 'gender', 'email', 'phone', 'address', 'national_id',
+            'medical_history', 'diagnosis', 'lab_results', 'imaging_reports', 'prescriptions',
+            'immunizations', 'insurance_details', 'payment_info', 'bank_account',
+            'access_email', 'pdf_status', 'pdf_file', 'uploaded_at',
+        ),
+        default_columns=('id', 'full_name', 'date_of_birth', 'gender', 'email', 'phone', 'pdf_status', 'uploaded_at'),
+    ),
+    'files': Export(
+        PatientFile, 'doctor', 'doctor',
+        columns=('id', 'patient_name', 'patient_id', 'disease', 'original_name', 'access_email', 'uploaded_at'),
+        default_columns=('id', 'patient_name', 'patient_id', 'disease', 'original_name', 'uploaded_at'),
+    ),
+}
+
+FORMATS = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+
+
+def iter_rows(queryset, columns, chunk_size=None):
+    """Yield value tuples for ``columns`` in id order with bounded memory (encrypted
+    columns decrypted)."""
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    encrypted = [n for n, name in enumerate(columns) if isinstance(queryset.model._meta.get_field(name), EncryptedMixin)]
+    rows = _iter_values(queryset, columns, chunk_size)
+    if not encrypted:
+        yield from rows
+        return
+    for row in rows:
+        row = list(row)
+        for n in encrypted:
+            row[n] = plaintext(row[n])
+        yield tuple(row)
+
+
+def _iter_values(queryset, columns, chunk_size):
+    connection = connections[queryset.db]
+    if connection.vendor == 'postgresql' and connection.settings_dict.get('DISABLE_SERVER_SIDE_CURSORS'):
+        # Behind pgbouncer iterator() would fetch the whole result client-side:
+        # walk the primary key in chunk_size pages instead.
+        fields = ['id', *columns]
+        last_id = None
+        while True:
+            page = queryset.order_by('id')
+            if last_id is not None:
+                page = page.filter(id__gt=last_id)
+            rows = list(page.values_list(*fields)[:chunk_size])
+            for row in rows:
+                yield row[1:]
+            if len(rows) < chunk_size:
+                return
+            last_id = rows[-1][0]
+    yield from queryset.order_by('id').values_list(*columns).iterator(chunk_size=chunk_size)
+
+
+def _text(value):
+    if value is None:
+        return ''
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return value
+
+
+class _Echo:
+    """csv.writer target that hands back each formatted line."""
+
+    def write(self, value):
+        return value
+
+
+def _csv_cell(value):
+    value = _text(value)
+    # Leading =, +, -, @ would make spreadsheet programs evaluate the cell as a formula.
+    if isinstance(value, str) and value[:1] in ('=', '+', '-', '@', '\t', '\r'):
+        return "'" + value
+    return value
+
+
+def iter_export(rows, columns, fmt):
+    """Yield the encoded export in blocks of about EXPORT_BUFFER_SIZE bytes."""
+    if fmt == 'csv':
+        writer = csv.writer(_Echo())
+        yield writer.writerow(columns).encode()
+        lines = (writer.writerow([_csv_cell(value) for value in row]) for row in rows)
+    else:
+        lines = (
+            json.dumps(dict(zip(columns, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n' for row in rows
+        )
+
+    buffer, size, limit = [], 0, 1  # the first row goes out on its own
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= limit:
+            yield ''.join(buffer).encode()
+            buffer, size, limit = [], 0, settings.EXPORT_BUFFER_SIZE
+    if buffer:
+        yield ''.join(buffer).encode()
@@ -0,0 +1,104 @@
+"""
+Model fields whose column holds the value encrypted (see accounts/crypto.py).
+
+Loading a row does not decrypt anything: ``from_db_value`` wraps the stored
+token in ``Ciphertext`` and the field's descriptor decrypts it the first
+time the attribute is read, keeping the plaintext on the instance. A list
+that shows three columns never pays for the other ten, and saving an
+instance writes back the tokens of attributes nobody read without
+decrypting and re-encrypting them. Use ``only()`` / ``defer()`` so bulk
+reads do not fetch ciphertext at all.
+
+``values()`` / ``values_list()`` bypass the descriptor and return
+``Ciphertext`` objects; call ``plaintext(value)`` on them. The only lookups
+are ``exact`` (which is only useful against '') and ``isnull``: the random
+nonce makes every other comparison meaningless.
+"""
+from django.db import models
+from django.db.models.query_utils import DeferredAttribute
+
+from . import crypto
+
+
+class Ciphertext:
+    """An encrypted column value that has not been decrypted yet."""
+
+    __slots__ = ('token', 'context')
+
+    def __init__(self, token, context):
+        self.token = token
+        self.context = context
+
+    def decrypt(self):
+        return crypto.decrypt(self.token, self.context)
+
+    def __repr__(self):
+        return f'<Ciphertext {self.context}>'
+
+    def __reduce__(self):
+        return Ciphertext, (self.token, self.context)
+
+
+def plaintext(value):
+    return value.decrypt() if isinstance(value, Ciphertext) else value
+
+
+class DecryptingAttribute(DeferredAttribute):
+    # a data descriptor (unlike DeferredAttribute), so it sees every read and
+    # not only the first one of a deferred field
+    def __set__(self, instance, value):
+        instance.__dict__[self.field.attname] = value
+
+    def __get__(self, instance, cls=None):
+        if instance is None:
+            return self
+        value = super().__get__(instance, cls)
+        if isinstance(value, Ciphertext):
+            value = instance.__dict__[self.field.attname] = value.decrypt()
+        return value
+
+
+class EncryptedMixin:
+    descriptor_class = DecryptingAttribute
+
+    def get_internal_type(self):
+        return 'TextField'  # tokens are longer than max_length, which applies to the plaintext
+
+    @property
+    def crypto_context(self):
+        return f'{self.model._meta.label}.{self.name}'
+
+    def from_db_value(self, value, expression, connection):
+        if crypto.is_encrypted(value):
+            return Ciphertext(value, self.crypto_context)
+        return value
+
+    def to_python(self, value):
+        return super().to_python(plaintext(value))
+
+    def pre_save(self, model_instance, add):
+        # the raw attribute: an unread Ciphertext is written back as it is
+        if self.attname in model_instance.__dict__:
+            return model_instance.__dict__[self.attname]
+        return super().pre_save(model_instance, add)
+
+    def get_prep_value(self, value):
+        if isinstance(value, Ciphertext):
+            return value.token
+        value = super().get_prep_value(value)
+        if value is None:
+            return None
+        return crypto.encrypt(str(value), self.crypto_context)
+
+    def get_lookup(self, lookup_name):
+        if lookup_name not in ('exact', 'isnull'):
+            return None
+        return super().get_lookup(lookup_name)
+
+
+class EncryptedTextField(EncryptedMixin, models.TextField):
+    pass
+
+
+class EncryptedCharField(EncryptedMixin, models.CharField):
+    pass
@@ -1,5 +1,12 @@
+import os
+from datetime import datetime, time, timedelta
+
 from django import forms
-from .models import CustomUser, PatientFile, Patient
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+from .models import CustomUser, PatientFile, Patient, UploadSession, search_key
 
 class RegisterForm(forms.ModelForm):
     role = forms.ChoiceField(choices=CustomUser.ROLE_CHOICES)
@@ -16,11 +23,25 @@ class PatientFileUploadForm(forms.ModelForm):
 class SendFileForm(forms.Form):
     email = forms.EmailField(label="Enter recipient's email")
 
+class SendBundleForm(forms.Form):
+    email = forms.EmailField(label="Enter recipient's email")
+    files = forms.ModelMultipleChoiceField(queryset=PatientFile.objects.none())
+
+    def __init__(self, *args, doctor=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['files'].queryset = PatientFile.objects.filter(doctor=doctor)
+
+    def clean_files(self):
+        files = self.cleaned_data['files']
+        if len(files) > settings.BUNDLE_MAX_FILES:
+            raise forms.ValidationError(f"Select at most {settings.BUNDLE_MAX_FILES} files per bundle.")
+        return files
+
 class PatientForm(forms.ModelForm):
     class Meta:
         model = Patient
         fields = '__all__'
-        exclude = ['uploaded_by', 'pdf_file', 'otp', 'access_email']
+        exclude = ['uploaded_by', 'pdf_file', 'pdf_status', 'pdf_claimed_at', 'pdf_attempts', 'pdf_error', 'pdf_hash', 'access_email']
         
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
@@ -29,4 +50,90 @@ class PatientForm(forms.ModelForm):
 
 class SendOTPForm(forms.Form):
     email = forms.EmailField(label="Enter recipient's email")
-    patient_id = forms.IntegerField(widget=forms.HiddenInput())
\ No newline at end of file
+    patient_id = forms.IntegerField(widget=forms.HiddenInput())
+
+class PatientFilterForm(forms.Form):
+    HAS_PDF_CHOICES = (
+        ('', 'All records'),
+        ('yes', 'With PDF'),
+        ('no', 'Without PDF'),
+    )
+
+    name = forms.CharField(required=False, label="Patient name")
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    has_pdf = forms.ChoiceField(required=False, choices=HAS_PDF_CHOICES)
+
+    def filter(self, queryset):
+        """Apply the valid filters to a Patient queryset."""
+        if not self.is_valid():
+            return queryset
+        data = self.cleaned_data
+        if data['name']:
+            queryset = queryset.filter(full_name__icontains=data['name'].strip())
+        # Plain datetime bounds (not __date) so the uploaded_at index stays usable.
+        if data['date_from']:
+            queryset = queryset.filter(uploaded_at__gte=_start_of_day(data['date_from']))
+        if data['date_to']:
+            queryset = queryset.filter(uploaded_at__lt=_start_of_day(data['date_to'] + timedelta(days=1)))
+        if data['has_pdf'] == 'yes':
+            queryset = queryset.exclude(pdf_file='').exclude(pdf_file__isnull=True)
+        elif data['has_pdf'] == 'no':
+            queryset = queryset.filter(Q(pdf_file='') | Q(pdf_file__isnull=True))
+        return queryset
+
+
+class PatientFileFilterForm(forms.Form):
+    name = forms.CharField(required=False, label="Patient name starts with")
+    patient_id = forms.CharField(required=False, label="Patient ID starts with")
+    disease = forms.CharField(required=False)
+    date_from = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+    date_to = forms.DateField(required=False, widget=forms.DateInput(attrs={'type': 'date'}))
+
+    def filter(self, queryset):
+        """Apply the valid filters to a PatientFile queryset."""
+        if not self.is_valid():
+            return queryset
+        data = self.cleaned_data
+        if search_key(data['name']):
+            queryset = queryset.filter(_prefix('patient_name_key', search_key(data['name'])))
+        if search_key(data['patient_id']):
+            queryset = queryset.filter(_prefix('patient_id_key', search_key(data['patient_id'])))
+        if data['disease']:
+            queryset = queryset.filter(disease=data['disease'])  # exact facet value
+        if data['date_from']:
+            queryset = queryset.filter(uploaded_at__gte=_start_of_day(data['date_from']))
+        if data['date_to']:
+            queryset = queryset.filter(uploaded_at__lt=_start_of_day(data['date_to'] + timedelta(days=1)))
+        return queryset
+
+
+def _prefix(field, prefix):
+    """``field`` starts with ``prefix`` in a form the field's index can serve: LIKE 'x%' on
+    PostgreSQL (varchar_pattern_ops), a range elsewhere (SQLite's LIKE is case-insensitive
+    and skips ordinary indexes; the keys are already case-folded)."""
+    if connection.vendor == 'postgresql':
+        return Q(**{f'{field}__startswith': prefix})
+    return Q(**{f'{field}__gte': prefix, f'{field}__lt': prefix + '\U0010ffff'})
+
+
+def _start_of_day(day):
+    return timezone.make_aware(datetime.combine(day, time.min))
+
+
+class ChunkedUploadInitForm(forms.ModelForm):
+    total_size = forms.IntegerField(min_value=1)
+
+    class Meta:
+        model = UploadSession
+        fields = ['patient_name', 'patient_id', 'disease', 'access_email', 'filename', 'total_size']
+
+    def clean_total_size(self):
+        size = self.cleaned_data['total_size']
+        if size > settings.CHUNKED_UPLOAD_MAX_SIZE:
+            raise forms.ValidationError("File is larger than the maximum upload size.")
+        return size
+
+    def clean_filename(self):
+        # keep only the base name a browser would send
+        return os.path.basename(self.cleaned_data['filename'].replace('\\', '/'))
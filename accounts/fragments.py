@@ -0,0 +1,110 @@
+"""
+Cached dashboard fragments with versioned keys.
+
+Every cached value belongs to one or more *scopes*: ``user:<id>`` for what
+one user's dashboard shows of their own rows, ``staff`` for the admin's user
+lists and counts, ``patients`` for the admin's patient count. A scope has a
+version number in DASHBOARD_VERSION_CACHE; the version is part of each key, so
+``bump`` invalidates every fragment of the scope at once without knowing
+their keys, and stale entries simply expire. A version that is missing
+(never set, or evicted) starts at the current time in nanoseconds, so it can
+never come back to a number an old fragment was stored under. Every key
+also carries the version of the ``all`` scope, which ``reset`` sets afresh
+after each ``migrate``: a recreated database (tests included) reuses row and
+user ids, and must not find the fragments of the previous one.
+
+Signals (accounts/signals.py) bump on commit after any save or delete of a
+Patient, PatientFile or CustomUser; code that writes with ``update()``,
+``bulk_create`` or raw SQL bumps itself.
+
+Rendered HTML is cached in DASHBOARD_CACHE with CSRF_PLACEHOLDER in place of
+the CSRF token, and the requesting user's token is put back on every read.
+DASHBOARD_CACHE is per-process memory, which evicts in constant time; each
+worker renders a fragment once per version. DASHBOARD_VERSION_CACHE holds
+only numbers and must be shared by all web workers and render_pdfs, or a
+bump in one process is not seen by the others.
+"""
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.middleware.csrf import get_token
+from django.template.loader import render_to_string
+from django.utils.safestring import mark_safe
+
+CSRF_PLACEHOLDER = 'dashboard-csrf-token-placeholder'
+
+
+def _cache():
+    return caches[settings.DASHBOARD_CACHE]
+
+
+def _version_cache():
+    return caches[settings.DASHBOARD_VERSION_CACHE]
+
+
+def _version_key(scope):
+    return f'dashboard:version:{scope}'
+
+
+def user_scope(user_or_id):
+    return f'user:{getattr(user_or_id, "pk", user_or_id)}'
+
+
+def versions(scopes):
+    """The current version of each scope (and of ``all``), joined into one key part."""
+    cache = _version_cache()
+    keys = [_version_key(scope) for scope in ('all', *scopes)]
+    found = cache.get_many(keys)
+    for key in keys:
+        if key not in found:
+            cache.add(key, time.time_ns(), None)
+            found[key] = cache.get(key)  # another process may have added first
+    return '.'.join(str(found[key]) for key in keys)
+
+
+def bump(*scopes):
+    """Invalidate everything cached for ``scopes``, once the current transaction commits."""
+    transaction.on_commit(lambda: _bump(scopes))
+
+
+def _bump(scopes):
+    cache = _version_cache()
+    for scope in scopes:
+        try:
+            cache.incr(_version_key(scope))
+        except ValueError:
+            pass  # no version yet: the next read starts a new one
+
+
+def reset():
+    """Invalidate every dashboard fragment."""
+    _version_cache().set(_version_key('all'), time.time_ns(), None)
+
+
+def cached(name, scopes, build, vary=''):
+    """``build()``, cached until one of ``scopes`` is bumped. ``vary`` tells apart
+    variants of the same fragment (filters, page cursor)."""
+    cache = _cache()
+    key = f"dashboard:{name}:{'|'.join(scopes)}:{versions(scopes)}"
+    if vary:
+        key += ':' + hashlib.md5(vary.encode()).hexdigest()
+    value = cache.get(key)
+    if value is None:
+        value = build()
+        cache.set(key, value, settings.DASHBOARD_CACHE_TIMEOUT)
+    return value
+
+
+def cached_fragment(request, name, scopes, template, build, vary=''):
+    """``template`` rendered with the context ``build()`` returns, cached like ``cached``.
+
+    The template is rendered without the request (no context processors): it
+    gets only what ``build`` returns, plus the CSRF placeholder.
+    """
+    html = cached(
+        name, scopes, lambda: render_to_string(template, {**build(), 'csrf_token': CSRF_PLACEHOLDER}), vary,
+    )
+    return mark_safe(html.replace(CSRF_PLACEHOLDER, get_token(request)))
@@ -0,0 +1,58 @@
+"""
+Short locks kept next to a cache's data, for read-modify-write on cache values.
+
+``cache.add`` is atomic on memcached, redis and the local-memory backend, so
+there a lock is a key that one caller manages to add. FileBasedCache
+implements ``add`` as ``has_key()`` followed by ``set()``, which two processes
+can both get through; with that backend the lock is a file created with
+``O_CREAT | O_EXCL`` in the cache directory, which exactly one process can
+create. A lock whose holder died is broken ``timeout`` seconds after it was
+taken.
+"""
+import os
+import time
+
+from django.core.cache.backends.filebased import FileBasedCache
+
+
+def acquire(cache, key, attempts, wait, timeout=2):
+    """Take lock ``key`` in ``cache``, trying ``attempts`` times ``wait`` seconds
+    apart. Returns whether it was taken."""
+    for attempt in range(attempts):
+        if attempt:
+            time.sleep(wait)
+        if _take(cache, key, timeout):
+            return True
+    return False
+
+
+def release(cache, key):
+    if isinstance(cache, FileBasedCache):
+        try:
+            os.remove(_lock_file(cache, key))
+        except FileNotFoundError:
+            pass
+    else:
+        cache.delete(key)
+
+
+def _take(cache, key, timeout):
+    if not isinstance(cache, FileBasedCache):
+        return cache.add(key, 1, timeout=timeout)
+    path = _lock_file(cache, key)
+    cache._createdir()  # the cache directory can be deleted at any time
+    try:
+        os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY, 0o600))
+        return True
+    except FileExistsError:
+        try:
+            if time.time() - os.path.getmtime(path) > timeout:
+                os.remove(path)  # its holder died; the next attempt can take it
+        except FileNotFoundError:
+            pass
+        return False
+
+
+def _lock_file(cache, key):
+    # not a '.djcache' file, so culling and clear() leave it alone
+    return cache._key_to_file(key) + '.lock'
@@ -0,0 +1,113 @@
+import os
+import shutil
+import statistics
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, connection
+from django.test.utils import override_settings
+
+from accounts.emails import send_templated_mail
+from accounts.models import CustomUser, Patient, PatientFile
+from accounts.signals import set_journal_mode
+
+BENCH_USER = 'bench_db_user'
+PAYLOAD = b'%PDF-1.4 bench payload\n' * 512
+
+
+def upload_file(user, n):
+    """Doctor upload: blob reference + PatientFile row (dedup means no file write after the first)."""
+    PatientFile(
+        doctor=user, patient_name=f'Bench {n}', patient_id=f'B{n}', disease='Benchmark',
+        file=ContentFile(PAYLOAD, name='bench.pdf'),
+    ).save()
+
+
+def create_record(user, n):
+    """Management upload: Patient row + dashboard counter update (signal)."""
+    Patient.objects.create(full_name=f'Bench {n}', email='bench@example.com', uploaded_by=user)
+
+
+def request_otp(user, n):
+    """OTP request: user lookup + outbox insert (the code itself lives in the cache)."""
+    found = CustomUser.objects.get(username=user.username)
+    send_templated_mail('login_otp', [found.email], username=found.username, otp=found.generate_otp())
+
+
+PATHS = {'upload': upload_file, 'record': create_record, 'otp': request_otp}
+
+
+class Command(BaseCommand):
+    help = ("Measure write throughput of the upload and OTP paths on a scratch database of the "
+            "configured backend (Django's test database, created and dropped by the command; on "
+            "PostgreSQL the role needs CREATEDB). Uploads go to a temporary MEDIA_ROOT. Run once "
+            "per backend (e.g. with and without DATABASE_URL) to compare.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=8, help="Concurrent workers, like gunicorn threads.")
+        parser.add_argument('--iterations', type=int, default=200, help="Operations per worker and path.")
+        parser.add_argument('--paths', nargs='+', choices=sorted(PATHS), default=sorted(PATHS))
+
+    def handle(self, *args, **options):
+        scratch = tempfile.mkdtemp(prefix='bench_db_')
+        original_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            # a file, like the real database (the test database would be in memory)
+            connection.settings_dict['TEST']['NAME'] = os.path.join(scratch, 'bench.sqlite3')
+        created = False
+        try:
+            with override_settings(MEDIA_ROOT=os.path.join(scratch, 'media')):
+                connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+                created = True
+                if connection.vendor == 'sqlite':
+                    set_journal_mode(connection, settings.SQLITE_JOURNAL_MODE)  # as deployed
+                self.run_paths(options)
+        finally:
+            if created:
+                connection.creation.destroy_test_db(original_name, verbosity=0)
+            shutil.rmtree(scratch, ignore_errors=True)
+
+    def run_paths(self, options):
+        threads, iterations = options['threads'], options['iterations']
+        user = CustomUser.objects.create(username=BENCH_USER, email='bench@example.com', role='management')
+        settings_dict = connection.settings_dict
+        self.stdout.write(f"{connection.vendor} (scratch {settings_dict['NAME']}), "
+                          f"CONN_MAX_AGE={settings_dict['CONN_MAX_AGE']}, {threads} threads x {iterations} ops")
+        self.stdout.write(f"{'path':<10}{'ops/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+        for name in options['paths']:
+            ops, latencies, errors = self.run_path(PATHS[name], user, threads, iterations)
+            p50 = statistics.median(latencies) * 1e3 if latencies else 0
+            p95 = statistics.quantiles(latencies, n=20)[-1] * 1e3 if len(latencies) > 1 else p50
+            self.stdout.write(f"{name:<10}{ops:>10.0f}{p50:>10.1f}{p95:>10.1f}{errors:>8}")
+
+    def run_path(self, op, user, threads, iterations):
+        latencies, errors = [], []
+        lock = threading.Lock()
+
+        def worker(index):
+            mine, failed = [], 0
+            try:
+                for i in range(iterations):
+                    start = time.perf_counter()
+                    try:
+                        op(user, index * iterations + i)
+                    except OperationalError:  # e.g. SQLite "database is locked"
+                        failed += 1
+                        continue
+                    mine.append(time.perf_counter() - start)
+            finally:
+                connection.close()  # each thread has its own connection
+            with lock:
+                latencies.extend(mine)
+                errors.append(failed)
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            list(pool.map(worker, range(threads)))
+        elapsed = time.perf_counter() - start
+        return len(latencies) / elapsed, latencies, sum(errors)
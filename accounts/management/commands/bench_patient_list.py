@@ -0,0 +1,98 @@
+import random
+import statistics
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.template.loader import render_to_string
+
+from accounts.fields import EncryptedMixin
+from accounts.fragments import CSRF_PLACEHOLDER, bump, user_scope
+from accounts.models import CustomUser, DashboardCounter, Patient
+from accounts.pagination import KeysetPage
+from accounts.search import index_patients
+
+BENCH_USER = 'bench_patient_list'
+WORDS = [
+    'patient', 'reports', 'mild', 'severe', 'chronic', 'acute', 'follow', 'up', 'recommended', 'pain',
+    'hypertension', 'diabetes', 'asthma', 'metformin', 'insulin', 'lisinopril', 'blood', 'pressure',
+]
+LIST_COLUMNS = ('id', 'full_name', 'date_of_birth', 'email', 'uploaded_at', 'pdf_file', 'pdf_status')
+PHI_FIELDS = [field.name for field in Patient._meta.fields if isinstance(field, EncryptedMixin)]
+
+
+def render_page(queryset, read_phi=False):
+    """One management dashboard table page: a keyset page rendered like the view does."""
+    page = KeysetPage(queryset, per_page=settings.MANAGEMENT_DASHBOARD_PAGE_SIZE)
+    if read_phi:
+        for patient in page:
+            for name in PHI_FIELDS:
+                getattr(patient, name)
+    return render_to_string('management_patient_list.html', {
+        'patients': page, 'filter_query': '', 'csrf_token': CSRF_PLACEHOLDER,
+    })
+
+
+class Command(BaseCommand):
+    help = ("Time the management patient list over plaintext rows (as before column encryption) "
+            "and over encrypted rows. Point DATABASE_URL at a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=5000, help="Patients per owner.")
+        parser.add_argument('--iterations', type=int, default=300)
+
+    def handle(self, *args, **options):
+        rng = random.Random(24)
+        plain, encrypted = self.seed('plain', options['rows'], rng), self.seed('encrypted', options['rows'], rng)
+        self.store_plaintext(plain, rng)
+        cases = (
+            # Before: every column fetched, stored and read as plaintext.
+            ('plaintext rows', Patient.objects.filter(uploaded_by=plain), False),
+            # Every column fetched; the template reads none of the PHI, so nothing is decrypted.
+            ('encrypted, all columns', Patient.objects.filter(uploaded_by=encrypted), False),
+            # What decrypting on load would cost: every PHI attribute read.
+            ('encrypted, all read', Patient.objects.filter(uploaded_by=encrypted), True),
+            # The view: only the listed columns, no ciphertext fetched.
+            ('encrypted, only()', Patient.objects.filter(uploaded_by=encrypted).only(*LIST_COLUMNS), False),
+        )
+        self.stdout.write(f"{connection.vendor}: {options['rows']} patients per owner, "
+                          f"{settings.MANAGEMENT_DASHBOARD_PAGE_SIZE} per page")
+        self.stdout.write(f"{'case':<26}{'p50 ms':>10}{'p95 ms':>10}")
+        try:
+            for name, queryset, read_phi in cases:
+                render_page(queryset, read_phi)  # warm the template cache and the connection
+                timings = []
+                for _ in range(options['iterations']):
+                    start = time.perf_counter()
+                    render_page(queryset, read_phi)
+                    timings.append(time.perf_counter() - start)
+                p50 = statistics.median(timings) * 1e3
+                p95 = statistics.quantiles(timings, n=20, method='inclusive')[-1] * 1e3
+                self.stdout.write(f"{name:<26}{p50:>10.2f}{p95:>10.2f}")
+        finally:
+            for owner in (plain, encrypted):
+                owner.delete()  # cascades to the seeded patients (their counter and index rows)
+
+    def seed(self, suffix, rows, rng):
+        owner, _ = CustomUser.objects.get_or_create(
+            username=f'{BENCH_USER}_{suffix}', defaults={'email': 'bench@example.com', 'role': 'management'},
+        )
+        patients = Patient.objects.bulk_create([
+            Patient(full_name=f'Bench {n}', email='bench@example.com', uploaded_by=owner,
+                    **{name: ' '.join(rng.choices(WORDS, k=20)) for name in PHI_FIELDS})
+            for n in range(rows)
+        ], batch_size=500)
+        DashboardCounter.incr('patients', rows)  # bulk_create skips the post_save counter and the index
+        index_patients(patients)
+        bump(user_scope(owner), 'patients')
+        return owner
+
+    def store_plaintext(self, owner, rng):
+        # Raw SQL, so the values bypass the fields' encryption (and read back unchanged).
+        sets = ', '.join(f'{connection.ops.quote_name(name)} = %s' for name in PHI_FIELDS)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Patient._meta.db_table} SET {sets} WHERE uploaded_by_id = %s",
+                [' '.join(rng.choices(WORDS, k=20)) for _ in PHI_FIELDS] + [owner.pk],
+            )
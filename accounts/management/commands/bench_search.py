@@ -0,0 +1,128 @@
+import random
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from accounts.fragments import bump, user_scope
+from accounts.models import CustomUser, DashboardCounter, Patient, search_key
+from accounts.search import SEARCH_FIELDS, index_patients, search_patients, search_terms, unindex_patients
+
+BENCH_USER = 'bench_search_user'
+CONDITIONS = [
+    'diabetes', 'hypertension', 'asthma', 'migraine', 'arthritis', 'anemia', 'bronchitis', 'pneumonia',
+    'hypothyroidism', 'osteoporosis', 'psoriasis', 'gastritis', 'sinusitis', 'tendinitis', 'insomnia',
+    'depression', 'anxiety', 'eczema', 'gout', 'angina', 'epilepsy', 'glaucoma', 'hepatitis', 'lupus',
+]
+DRUGS = [
+    'metformin', 'insulin', 'lisinopril', 'amlodipine', 'albuterol', 'ibuprofen', 'levothyroxine',
+    'omeprazole', 'sertraline', 'prednisone', 'amoxicillin', 'atorvastatin', 'warfarin', 'gabapentin',
+]
+# In about one record per thousand: the case where a scan has to read everything.
+RARE = ['sarcoidosis', 'amyloidosis', 'porphyria', 'acromegaly', 'myasthenia', 'pheochromocytoma']
+FILLER = [
+    'patient', 'reports', 'mild', 'severe', 'chronic', 'acute', 'follow', 'up', 'recommended', 'pain',
+    'history', 'family', 'normal', 'elevated', 'reduced', 'levels', 'noted', 'stable', 'review', 'weeks',
+    'blood', 'pressure', 'glucose', 'imaging', 'shows', 'no', 'abnormality', 'left', 'right', 'mri', 'ct',
+]
+
+
+def sentence(rng, words, extra):
+    return ' '.join(rng.choice(FILLER) for _ in range(words)) + ' ' + ' '.join(rng.sample(extra, 2))
+
+
+def scan_search(user, text, limit=50):
+    """What a search without the index looks like: the fields are encrypted, so every one of
+    the user's records is fetched and decrypted, and each term must start a word of it."""
+    terms = search_terms(text)
+    found = []
+    for patient in Patient.objects.filter(uploaded_by=user).only('id', 'full_name', 'date_of_birth', 'email',
+                                                                 'uploaded_at', *SEARCH_FIELDS).iterator():
+        words = re.findall(r'\w+', search_key(' '.join(getattr(patient, name) for name in SEARCH_FIELDS)))
+        if all(any(word.startswith(term) for word in words) for term in terms):
+            found.append(patient)
+            if len(found) == limit:
+                break
+    return found
+
+
+class Command(BaseCommand):
+    help = ("Seed synthetic patients and compare the blind search index with decrypting and scanning. "
+            "Point DATABASE_URL at a scratch database.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=1_000_000)
+        parser.add_argument('--owners', type=int, default=10, help="Uploaders the rows are spread over.")
+        parser.add_argument('--queries', type=int, default=50, help="Queries per method.")
+        parser.add_argument('--keep', action='store_true', help="Keep the seeded rows for the next run.")
+
+    def handle(self, *args, **options):
+        rng = random.Random(20)
+        owners = self.seed(options['rows'], options['owners'], rng)
+        queries = {
+            kind: [
+                ' '.join(term[:rng.randint(4, len(term))] for term in rng.sample(words, rng.randint(1, 2)))
+                for _ in range(options['queries'])
+            ]
+            for kind, words in (('common', CONDITIONS + DRUGS), ('rare', RARE))
+        }
+        self.stdout.write(f"{connection.vendor} ({connection.settings_dict['NAME']}): "
+                          f"{Patient.objects.count()} patients, {len(owners)} owners")
+        self.stdout.write(f"{'terms':<8}{'method':<8}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'avg hits':>10}")
+        try:
+            for kind, texts in queries.items():
+                for name, method in (('index', search_patients), ('scan', scan_search)):
+                    timings, hits = [], 0
+                    for n, text in enumerate(texts):
+                        start = time.perf_counter()
+                        hits += len(method(owners[n % len(owners)], text))
+                        timings.append(time.perf_counter() - start)
+                    p50 = statistics.median(timings) * 1e3
+                    p95 = statistics.quantiles(timings, n=20, method='inclusive')[-1] * 1e3 if len(timings) > 1 else p50
+                    self.stdout.write(f"{kind:<8}{name:<8}{p50:>10.1f}{p95:>10.1f}{max(timings) * 1e3:>10.1f}"
+                                      f"{hits / len(texts):>10.1f}")
+        finally:
+            if not options['keep']:
+                self.cleanup(owners)
+
+    def cleanup(self, owners):
+        # One DELETE instead of a post_delete signal per row, so the index is cleaned here too.
+        ids = [owner.pk for owner in owners]
+        unindex_patients(Patient.objects.filter(uploaded_by_id__in=ids).values_list('id', flat=True))
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {Patient._meta.db_table} WHERE uploaded_by_id IN ({', '.join(['%s'] * len(ids))})", ids,
+            )
+            DashboardCounter.incr('patients', -cursor.rowcount)
+        bump('patients', *map(user_scope, ids))
+        CustomUser.objects.filter(pk__in=ids).delete()
+
+    def seed(self, rows, owner_count, rng):
+        owners = [
+            CustomUser.objects.get_or_create(
+                username=f'{BENCH_USER}_{n}', defaults={'email': f'bench{n}@example.com', 'role': 'management'},
+            )[0]
+            for n in range(owner_count)
+        ]
+        missing = rows - Patient.objects.filter(uploaded_by__in=owners).count()
+        batch, made = 5000, 0
+        while made < missing:
+            size = min(batch, missing - made)
+            index_patients(Patient.objects.bulk_create([
+                Patient(
+                    full_name=f'Bench {made + n}', email='bench@example.com', uploaded_by=owners[(made + n) % owner_count],
+                    medical_history=sentence(rng, 30, RARE if rng.random() < 0.001 else CONDITIONS),
+                    diagnosis=' '.join(rng.sample(CONDITIONS, 2)),
+                    lab_results=sentence(rng, 10, CONDITIONS), imaging_reports=sentence(rng, 10, CONDITIONS),
+                    prescriptions=' '.join(rng.sample(DRUGS, 2)),
+                )
+                for n in range(size)
+            ]))
+            DashboardCounter.incr('patients', size)  # bulk_create skips the post_save counter and the index
+            bump('patients', *map(user_scope, owners))
+            made += size
+            if made % 100_000 < batch:
+                self.stdout.write(f"seeded {made}/{missing}")
+        return owners
@@ -0,0 +1,142 @@
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import OperationalError, connection, connections
+from django.db.models import Count, Q
+from django.test.utils import override_settings
+
+from accounts.emails import send_templated_mail
+from accounts.fragments import bump, user_scope
+from accounts.models import CustomUser, DashboardCounter, EmailOutbox, Patient
+from accounts.pagination import KeysetPage
+from accounts.signals import set_journal_mode
+
+BENCH_USER = 'bench_sqlite_user'
+# What a connection gets with none of SQLITE_PRAGMAS applied (Python's sqlite3 and
+# Django already wait up to 5s for a lock, so keep that for a fair comparison). The
+# default mode is a rollback journal, so SQLITE_WAL_PRAGMAS are not applied to it.
+DEFAULT_JOURNAL_MODE = 'delete'
+DEFAULT_PRAGMAS = {'synchronous': 'full', 'busy_timeout': 5000}
+
+
+def dashboard_read(user):
+    """Management dashboard: stat aggregate + first keyset page + admin counters."""
+    own = Patient.objects.filter(uploaded_by=user)
+    own.aggregate(n=Count('id'), shared=Count('id', filter=Q(access_email__isnull=False)))
+    list(KeysetPage(own, per_page=25))
+    DashboardCounter.read('patients', 'users.doctor', 'users.management')
+
+
+def otp_write(user):
+    """OTP request: user lookup + outbox insert."""
+    found = CustomUser.objects.get(pk=user.pk)
+    send_templated_mail('login_otp', [found.email], username=found.username, otp=found.generate_otp())
+
+
+class Command(BaseCommand):
+    help = ("Mixed dashboard reads and OTP writes from concurrent threads, with the tuned "
+            "SQLITE_JOURNAL_MODE / SQLITE_PRAGMAS and with SQLite defaults. Point DATABASE_URL "
+            "at a scratch copy.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--readers', type=int, default=8)
+        parser.add_argument('--writers', type=int, default=4)
+        parser.add_argument('--seconds', type=float, default=5.0, help="Run time per mode.")
+        parser.add_argument('--rows', type=int, default=2000, help="Patients to seed for the reads.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("bench_sqlite only runs against a SQLite database.")
+        modes = [
+            ('tuned', settings.SQLITE_JOURNAL_MODE, settings.SQLITE_PRAGMAS),
+            ('default', DEFAULT_JOURNAL_MODE, DEFAULT_PRAGMAS),
+        ]
+        original_mode, _ = set_journal_mode(connection, settings.SQLITE_JOURNAL_MODE)  # restored at the end
+
+        user = self.seed(options['rows'])
+        self.stdout.write(f"{connection.settings_dict['NAME']}: {options['readers']} readers, "
+                          f"{options['writers']} writers, {options['seconds']:.0f}s per mode")
+        self.stdout.write(f"{'mode':<9}{'kind':<7}{'ops/s':>9}{'p50 ms':>9}{'p95 ms':>9}"
+                          f"{'max ms':>9}{'lock wait s':>13}{'locked':>8}")
+        try:
+            for mode, journal_mode, pragmas in modes:
+                set_journal_mode(connection, journal_mode)
+                with override_settings(SQLITE_PRAGMAS=pragmas):
+                    connections.close_all()  # new connections pick up this mode's pragmas
+                    results = self.run_mode(user, options)
+                for kind, (ops, latencies, waited, locked) in results.items():
+                    p50 = statistics.median(latencies) * 1e3 if latencies else 0
+                    p95 = statistics.quantiles(latencies, n=20)[-1] * 1e3 if len(latencies) > 1 else p50
+                    peak = max(latencies, default=0) * 1e3
+                    self.stdout.write(f"{mode:<9}{kind:<7}{ops:>9.0f}{p50:>9.1f}{p95:>9.1f}"
+                                      f"{peak:>9.1f}{waited:>13.2f}{locked:>8}")
+        finally:
+            connections.close_all()
+            set_journal_mode(connection, original_mode)
+            EmailOutbox.objects.filter(recipients=user.email, status='pending').delete()
+            user.delete()  # cascades to the seeded patients (and their counter)
+
+    def seed(self, rows):
+        user, _ = CustomUser.objects.get_or_create(
+            username=BENCH_USER, defaults={'email': 'bench@example.com', 'role': 'management'},
+        )
+        Patient.objects.bulk_create(
+            [Patient(full_name=f'Bench {n}', email='bench@example.com', uploaded_by=user) for n in range(rows)],
+            batch_size=500,
+        )
+        DashboardCounter.incr('patients', rows)  # bulk_create skips the post_save counter
+        bump(user_scope(user), 'patients')
+        return user
+
+    def run_mode(self, user, options):
+        # Uncontended cost of each operation, so time above it counts as waiting (for the
+        # database lock, or for the GIL: compare modes, not absolute values).
+        baseline = {kind: self.uncontended(op, user) for kind, op in (('read', dashboard_read), ('write', otp_write))}
+        deadline = time.perf_counter() + options['seconds']
+        stats = {'read': ([], [0.0], [0]), 'write': ([], [0.0], [0])}
+        lock = threading.Lock()
+
+        def worker(kind, op):
+            latencies, waited, locked = [], 0.0, 0
+            try:
+                while time.perf_counter() < deadline:
+                    start = time.perf_counter()
+                    try:
+                        op(user)
+                    except OperationalError:  # "database is locked" after busy_timeout
+                        locked += 1
+                        waited += time.perf_counter() - start
+                        continue
+                    elapsed = time.perf_counter() - start
+                    latencies.append(elapsed)
+                    waited += max(elapsed - baseline[kind], 0)
+            finally:
+                connection.close()
+            with lock:
+                stats[kind][0].extend(latencies)
+                stats[kind][1][0] += waited
+                stats[kind][2][0] += locked
+
+        workers = [threading.Thread(target=worker, args=('read', dashboard_read)) for _ in range(options['readers'])]
+        workers += [threading.Thread(target=worker, args=('write', otp_write)) for _ in range(options['writers'])]
+        start = time.perf_counter()
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        elapsed = time.perf_counter() - start
+        return {
+            kind: (len(latencies) / elapsed, latencies, waited[0], locked[0])
+            for kind, (latencies, waited, locked) in stats.items()
+        }
+
+    def uncontended(self, op, user, samples=20):
+        timings = []
+        for _ in range(samples):
+            start = time.perf_counter()
+            op(user)
+            timings.append(time.perf_counter() - start)
+        return statistics.median(timings)
@@ -0,0 +1,36 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from accounts.models import PatientFile
+
+
+class Command(BaseCommand):
+    help = "Move patient files stored before content addressing into shared blobs."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would move.")
+
+    def handle(self, *args, **options):
+        legacy = PatientFile.objects.filter(blob__isnull=True).exclude(file='')
+        moved = missing = 0
+        for patient_file in legacy.iterator():
+            old_name = patient_file.file.name
+            storage = patient_file.file.storage
+            if not storage.exists(old_name):
+                missing += 1
+                self.stderr.write(f"#{patient_file.id}: {old_name} is missing")
+                continue
+            if options['dry_run']:
+                moved += 1
+                continue
+            with storage.open(old_name, 'rb') as fh, transaction.atomic():
+                patient_file.original_name = patient_file.original_name or os.path.basename(old_name)
+                patient_file.file.save(old_name, fh, save=False)
+                patient_file.save(update_fields=['file', 'original_name'])
+            if not PatientFile.objects.filter(file=old_name).exists():
+                storage.delete(old_name)
+            moved += 1
+        verb = "Would move" if options['dry_run'] else "Moved"
+        self.stdout.write(f"{verb} {moved} file(s) into blobs; {missing} missing.")
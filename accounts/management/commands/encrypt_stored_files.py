@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from accounts.models import Patient, PatientFile
+
+
+class Command(BaseCommand):
+    help = "Encrypt patient files and PDFs stored before storage encryption (each one rewritten in place)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help="Only report what would be encrypted.")
+
+    def handle(self, *args, **options):
+        stored = [
+            (PatientFile._meta.get_field('file').storage,
+             PatientFile.objects.exclude(file='').values_list('file', flat=True).distinct()),
+            (Patient._meta.get_field('pdf_file').storage,
+             Patient.objects.exclude(pdf_file='').exclude(pdf_file__isnull=True)
+             .values_list('pdf_file', flat=True).distinct()),
+        ]
+        encrypted = skipped = missing = 0
+        for storage, names in stored:
+            for name in names.iterator():
+                if not storage.exists(name):
+                    missing += 1
+                    self.stderr.write(f"{name} is missing")
+                elif storage.stored_encrypted(name):
+                    skipped += 1
+                else:
+                    if not options['dry_run']:
+                        storage.encrypt_in_place(name)
+                    encrypted += 1
+        verb = "Would encrypt" if options['dry_run'] else "Encrypted"
+        self.stdout.write(f"{verb} {encrypted} file(s); {skipped} already encrypted, {missing} missing.")
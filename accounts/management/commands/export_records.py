@@ -0,0 +1,42 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.exports import EXPORTS, FORMATS, iter_export, iter_rows
+from accounts.models import CustomUser
+
+
+class Command(BaseCommand):
+    help = "Stream patients or patient files as CSV or NDJSON with constant memory."
+
+    def add_arguments(self, parser):
+        parser.add_argument('kind', choices=sorted(EXPORTS))
+        parser.add_argument('--columns', default='', help="Comma-separated columns (default: the short ones).")
+        parser.add_argument('--format', choices=sorted(FORMATS), default='csv')
+        parser.add_argument('--owner', help="Only rows uploaded by this username.")
+        parser.add_argument('--output', help="File to write (default: stdout).")
+        parser.add_argument('--chunk-size', type=int, help="Rows fetched per database round trip.")
+
+    def handle(self, *args, **options):
+        export = EXPORTS[options['kind']]
+        try:
+            columns = export.clean_columns(options['columns'].split(','))
+        except ValueError as exc:
+            raise CommandError(exc)
+        owner = None
+        if options['owner']:
+            try:
+                owner = CustomUser.objects.get(username=options['owner'])
+            except CustomUser.DoesNotExist:
+                raise CommandError(f"No user named {options['owner']!r}.")
+
+        rows = iter_rows(export.queryset(owner=owner), columns, options['chunk_size'])
+        out = open(options['output'], 'wb') if options['output'] else sys.stdout.buffer
+        try:
+            for block in iter_export(rows, columns, options['format']):
+                out.write(block)
+        finally:
+            if options['output']:
+                out.close()
+            else:
+                out.flush()
@@ -0,0 +1,149 @@
+import csv
+import io
+import itertools
+import json
+import os
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils import timezone
+
+from accounts.forms import PatientForm
+from accounts.fragments import bump, user_scope
+from accounts.models import CustomUser, DashboardCounter, Patient, PatientImport
+from accounts.search import index_patients
+
+FORMATS = {'.csv': 'csv', '.jsonl': 'jsonl', '.ndjson': 'jsonl'}
+PROGRESS_INTERVAL = 5.0  # seconds between progress lines
+
+
+def read_rows(fh, fmt):
+    """Yield ``(data, error)`` per input record without reading the whole file."""
+    if fmt == 'csv':
+        for row in csv.DictReader(fh):
+            row.pop(None, None)  # surplus cells beyond the header
+            yield row, None
+        return
+    for line in fh:
+        if not line.strip():
+            continue
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            yield {'line': line.rstrip('\r\n')}, f"invalid JSON: {exc}"
+            continue
+        if not isinstance(data, dict):
+            yield {'line': line.rstrip('\r\n')}, "expected a JSON object"
+            continue
+        yield data, None
+
+
+class Command(BaseCommand):
+    help = ("Import patient records from a CSV (header row of Patient field names) or JSONL file. "
+            "Rows are validated with PatientForm and inserted in batches; PDFs are left queued for "
+            "render_pdfs. Re-running the same command resumes after the last committed batch.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('path')
+        parser.add_argument('--owner', required=True, help="Username of the management user the records belong to.")
+        parser.add_argument('--format', choices=sorted(set(FORMATS.values())),
+                            help="Input format (default: from the file extension).")
+        parser.add_argument('--batch-size', type=int, default=settings.PATIENT_IMPORT_BATCH_SIZE)
+        parser.add_argument('--rejects', help="Where to write rejected rows as JSONL (default: <path>.rejects.jsonl).")
+        parser.add_argument('--restart', action='store_true',
+                            help="Forget the saved position and import the file from the first row again.")
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        if not os.path.isfile(path):
+            raise CommandError(f"{path} does not exist.")
+        fmt = options['format'] or FORMATS.get(os.path.splitext(path)[1].lower())
+        if fmt is None:
+            raise CommandError("Cannot tell the format from the extension; pass --format.")
+        try:
+            owner = CustomUser.objects.get(username=options['owner'], role='management')
+        except CustomUser.DoesNotExist:
+            raise CommandError(f"No management user named {options['owner']!r}.")
+
+        job, resumed = self.get_job(path, owner, options['restart'])
+        rejects_path = options['rejects'] or f'{path}.rejects.jsonl'
+        if resumed:
+            self.stdout.write(f"Resuming after row {job.rows_done} ({job.imported} imported, {job.rejected} rejected)")
+
+        with open(path, 'rb') as raw, open(rejects_path, 'a' if resumed else 'w') as rejects_file:
+            fh = io.TextIOWrapper(raw, encoding='utf-8-sig', newline='')
+            rows = itertools.islice(enumerate(read_rows(fh, fmt), start=1), job.rows_done, None)
+            self.run(job, owner, rows, options['batch_size'], rejects_file, raw)
+
+        job.finished_at = timezone.now()
+        job.save(update_fields=['finished_at', 'updated_at'])
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {job.imported} patient(s), rejected {job.rejected} row(s) of {job.rows_done}."
+        ))
+        if job.rejected:
+            self.stdout.write(f"Rejected rows: {rejects_path}")
+        self.stdout.write("New records are queued for render_pdfs.")
+
+    def get_job(self, path, owner, restart):
+        """The import checkpoint for ``path``; ``resumed`` is True when rows were already committed."""
+        size = os.path.getsize(path)
+        job = PatientImport.objects.filter(source=path).first()
+        if job and restart:
+            job.delete()
+            job = None
+        if job is None:
+            return PatientImport.objects.create(source=path, source_size=size, uploaded_by=owner), False
+        if job.finished_at:
+            raise CommandError(f"{path} was already imported on {job.finished_at:%Y-%m-%d %H:%M}; "
+                               "pass --restart to import it again.")
+        if job.source_size != size or job.uploaded_by_id != owner.id:
+            raise CommandError(f"{path} changed (or --owner differs) since the interrupted import; "
+                               "pass --restart to start over.")
+        return job, job.rows_done > 0
+
+    def run(self, job, owner, rows, batch_size, rejects_file, raw):
+        total_size = job.source_size or 1
+        started = last_report = time.monotonic()
+        start_rows = job.rows_done
+        while True:
+            chunk = list(itertools.islice(rows, batch_size))
+            if not chunk:
+                break
+            patients, rejects = [], []
+            for number, (data, error) in chunk:
+                if error is None:
+                    form = PatientForm(data)
+                    if form.is_valid():
+                        patient = form.save(commit=False)
+                        patient.uploaded_by = owner
+                        patients.append(patient)
+                        continue
+                    error = form.errors.get_json_data()
+                rejects.append({'row': number, 'errors': error, 'data': data})
+            self.commit_batch(job, patients, rejects, len(chunk), rejects_file)
+
+            now = time.monotonic()
+            if now - last_report >= PROGRESS_INTERVAL:
+                last_report = now
+                rate = (job.rows_done - start_rows) / (now - started)
+                self.stdout.write(f"{job.rows_done} rows ({raw.tell() * 100 // total_size}%), "
+                                  f"{job.imported} imported, {job.rejected} rejected, {rate:.0f} rows/s")
+
+    def commit_batch(self, job, patients, rejects, rows, rejects_file):
+        # Rejects are written first: a crash before the commit re-reads (and may repeat)
+        # them on resume, but never loses one.
+        for reject in rejects:
+            rejects_file.write(json.dumps(reject, default=str) + '\n')
+        rejects_file.flush()
+        with transaction.atomic():
+            Patient.objects.bulk_create(patients)
+            if patients:
+                index_patients(patients)  # bulk_create skips the search-index signal
+                DashboardCounter.incr('patients', len(patients))  # bulk_create skips the post_save counter
+                bump(user_scope(job.uploaded_by_id), 'patients')
+            job.rows_done += rows
+            job.imported += len(patients)
+            job.rejected += len(rejects)
+            job.save(update_fields=['rows_done', 'imported', 'rejected', 'updated_at'])
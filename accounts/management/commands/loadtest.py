@@ -0,0 +1,289 @@
+import random
+import re
+import statistics
+import threading
+import time
+import uuid
+from http.cookiejar import CookieJar, DefaultCookiePolicy
+from urllib.error import HTTPError
+from urllib.parse import urlencode
+from urllib.request import HTTPCookieProcessor, HTTPRedirectHandler, Request, build_opener
+
+from django.core.management.base import BaseCommand, CommandError
+
+from accounts.emails import LAYOUTS
+from accounts.models import CustomUser, EmailOutbox, Patient, PatientFile
+
+_OTP_RE = re.compile(r'OTP[^\n:]*:\s*(\d{6})')
+EMAIL_DOMAIN = 'loadtest.invalid'
+
+
+class FlowError(Exception):
+    pass
+
+
+class _SecureCookiesOverHttp(DefaultCookiePolicy):
+    # SESSION_COOKIE_SECURE/CSRF_COOKIE_SECURE are on; a local gunicorn speaks plain HTTP.
+    def return_ok_secure(self, cookie, request):
+        return True
+
+
+class _NoRedirect(HTTPRedirectHandler):
+    def redirect_request(self, req, fp, code, msg, headers, newurl):
+        return None  # surface 302s so each step can check where it was sent
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+        self.order = []
+
+    def record(self, step, seconds=None, error=False):
+        with self.lock:
+            if step not in self.latencies:
+                self.order.append(step)
+                self.latencies[step], self.errors[step] = [], 0
+            if error:
+                self.errors[step] += 1
+            else:
+                self.latencies[step].append(seconds)
+
+
+class Session:
+    """One browser: its own cookies and CSRF token, requests timed per step."""
+
+    def __init__(self, base_url, stats, timeout):
+        self.base_url = base_url.rstrip('/')
+        self.stats = stats
+        self.timeout = timeout
+        self.jar = CookieJar(policy=_SecureCookiesOverHttp())
+        self.opener = build_opener(HTTPCookieProcessor(self.jar), _NoRedirect)
+
+    def csrf_token(self):
+        return next((c.value for c in self.jar if c.name == 'csrftoken'), '')
+
+    def request(self, step, method, path, fields=None, files=None, expect=(200,), location=None):
+        url = self.base_url + path
+        headers = {'Referer': url}
+        body = None
+        if method == 'POST':
+            fields = dict(fields or {}, csrfmiddlewaretoken=self.csrf_token())
+            if files:
+                body, headers['Content-Type'] = _multipart(fields, files)
+            else:
+                body = urlencode(fields).encode()
+                headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        start = time.perf_counter()
+        try:
+            try:
+                response = self.opener.open(Request(url, data=body, headers=headers, method=method),
+                                             timeout=self.timeout)
+            except HTTPError as exc:
+                response = exc  # 3xx/4xx/5xx: still a response
+            content = response.read()
+            status = response.status if hasattr(response, 'status') else response.code
+            if status not in expect:
+                hint = ' (is RATELIMIT_ENABLED=0 set on the server?)' if status == 429 else ''
+                raise FlowError(f"{step}: {method} {path} returned {status}{hint}")
+            if location and location not in response.headers.get('Location', ''):
+                raise FlowError(f"{step}: expected redirect to {location}, got {response.headers.get('Location')}")
+        except FlowError:
+            self.stats.record(step, error=True)
+            raise
+        except OSError as exc:
+            self.stats.record(step, error=True)
+            raise FlowError(f"{step}: {exc}") from exc
+        self.stats.record(step, time.perf_counter() - start)
+        return content
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, data, content_type) in files.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'.encode() + data + b'\r\n'
+        )
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+def wait_for_otp(stats, step, email, layout, timeout):
+    """Read the newest OTP mailed to ``email`` from the outbox (no SMTP involved)."""
+    subject = LAYOUTS[layout][0]
+    start = time.perf_counter()
+    while time.perf_counter() - start < timeout:
+        mail = EmailOutbox.objects.filter(recipients=email, subject=subject).order_by('-id').first()
+        match = _OTP_RE.search(mail.body) if mail else None
+        if match:
+            stats.record(step, time.perf_counter() - start)
+            return match.group(1)
+        time.sleep(0.05)
+    stats.record(step, error=True)
+    raise FlowError(f"{step}: no '{layout}' email for {email} within {timeout}s")
+
+
+class Command(BaseCommand):
+    help = ("Drive concurrent end-to-end doctor and management sessions against a running "
+            "server (e.g. gunicorn on localhost) and report per-step latency and errors. "
+            "Run it with the server's settings so OTPs can be read back from the email outbox; "
+            "start the server with RATELIMIT_ENABLED=0 and, for the management flow, "
+            "keep `render_pdfs` running (and `send_outbox` only with "
+            "EMAIL_BACKEND=django.core.mail.backends.locmem.EmailBackend).")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--concurrency', type=int, default=10, help="Simultaneous sessions.")
+        parser.add_argument('--sessions', type=int, default=50, help="Total sessions to run.")
+        parser.add_argument('--management-ratio', type=float, default=0.3,
+                            help="Share of sessions that run the management flow.")
+        parser.add_argument('--file-size', type=int, default=256 * 1024, help="Bytes per doctor upload.")
+        parser.add_argument('--timeout', type=float, default=30.0,
+                            help="Seconds to wait for a response, an OTP email or a rendered PDF.")
+        parser.add_argument('--keep', action='store_true', help="Keep the users and data created.")
+
+    def handle(self, *args, **options):
+        self.options = options
+        self.run_id = uuid.uuid4().hex[:8]
+        self.stats = Stats()
+        counter = iter(range(options['sessions']))
+        counter_lock = threading.Lock()
+        failures = []
+
+        def worker():
+            while True:
+                with counter_lock:
+                    n = next(counter, None)
+                if n is None:
+                    return
+                flow = self.management_flow if random.random() < options['management_ratio'] else self.doctor_flow
+                try:
+                    flow(n)
+                except FlowError as exc:
+                    failures.append(str(exc))
+                    self.stats.record(f'session:{flow.__name__}', error=True)
+
+        self.stdout.write(f"Run {self.run_id}: {options['sessions']} sessions, concurrency "
+                          f"{options['concurrency']} against {options['base_url']}")
+        start = time.perf_counter()
+        threads = [threading.Thread(target=worker) for _ in range(options['concurrency'])]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - start
+
+        try:
+            self.report(elapsed, failures)
+        finally:
+            if not options['keep']:
+                self.cleanup()
+        if len(failures) == options['sessions']:
+            raise CommandError("Every session failed; is the server running?")
+
+    # ---------------- flows ----------------
+    def sign_in(self, session, n, role):
+        username = f'lt{self.run_id}{role[0]}{n}'
+        email = f'{username}@{EMAIL_DOMAIN}'
+        timeout = self.options['timeout']
+        session.request('register_form', 'GET', '/register/')
+        session.request('register', 'POST', '/register/', {'username': username, 'email': email, 'role': role},
+                        expect=(302,), location='/login/')
+        session.request('request_otp_form', 'GET', '/request-otp/')
+        session.request('request_otp', 'POST', '/request-otp/', {'username': username},
+                        expect=(302,), location='/login/')
+        otp = wait_for_otp(self.stats, 'otp_email', email, 'login_otp', timeout)
+        session.request('login', 'POST', '/login/', {'username': username, 'otp': otp}, expect=(302,))
+        return username, email
+
+    def doctor_flow(self, n):
+        session = Session(self.options['base_url'], self.stats, self.options['timeout'])
+        username, email = self.sign_in(session, n, 'doctor')
+        session.request('doctor_dashboard', 'GET', '/doctor-dashboard/')
+
+        payload = f'load test {self.run_id} {n}\n'.encode() * (self.options['file_size'] // 20 + 1)
+        session.request('upload', 'POST', '/doctor-dashboard/', {
+            'upload_file': '1', 'patient_name': f'Load Patient {n}', 'patient_id': f'LT{n}',
+            'disease': 'Load test', 'access_email': email,
+        }, files={'file': (f'scan_{n}.pdf', payload[:self.options['file_size']], 'application/pdf')},
+            expect=(302,))
+        file_id = PatientFile.objects.filter(doctor__username=username).values_list('id', flat=True).first()
+        if file_id is None:
+            raise FlowError("upload: no PatientFile was created")
+
+        session.request('send_file_otp', 'POST', '/doctor-dashboard/',
+                        {'send_otp': '1', 'file_id': file_id, 'email': email}, expect=(302,))
+        otp = wait_for_otp(self.stats, 'file_otp_email', email, 'file_access_otp', self.options['timeout'])
+        session.request('access_file', 'POST', f'/access-file/{file_id}/', {'email': email, 'otp': otp},
+                        expect=(302,), location=f'/download-file/{file_id}/')
+        session.request('download_file', 'GET', f'/download-file/{file_id}/')
+        self.stats.record('session:doctor_flow', 0)
+
+    def management_flow(self, n):
+        session = Session(self.options['base_url'], self.stats, self.options['timeout'])
+        username, email = self.sign_in(session, n, 'management')
+        session.request('management_dashboard', 'GET', '/management-dashboard/')
+        session.request('add_patient', 'POST', '/management-dashboard/', {
+            'upload_patient': '1', 'full_name': f'Load Patient {n}', 'email': email,
+            'date_of_birth': '1980-01-01', 'diagnosis': 'Load test', 'medical_history': 'None',
+        }, expect=(302,))
+        patient_id = Patient.objects.filter(uploaded_by__username=username).values_list('id', flat=True).first()
+        if patient_id is None:
+            raise FlowError("add_patient: no Patient was created")
+
+        start = time.perf_counter()
+        while not Patient.objects.filter(id=patient_id, pdf_status='ready').exists():
+            if time.perf_counter() - start > self.options['timeout']:
+                self.stats.record('pdf_ready', error=True)
+                raise FlowError(f"pdf_ready: patient {patient_id} not rendered (is render_pdfs running?)")
+            time.sleep(0.1)
+        self.stats.record('pdf_ready', time.perf_counter() - start)
+
+        share_email = f'share.{username}@{EMAIL_DOMAIN}'
+        session.request('share_patient', 'POST', '/management-dashboard/',
+                        {'send_otp': '1', 'patient_id': patient_id, 'email': share_email}, expect=(302,))
+        otp = wait_for_otp(self.stats, 'share_otp_email', share_email, 'patient_access', self.options['timeout'])
+        session.request('access_pdf', 'POST', f'/access-patient-pdf/{patient_id}/',
+                        {'email': share_email, 'otp': otp},
+                        expect=(302,), location=f'/download-patient-pdf/{patient_id}/')
+        session.request('download_pdf', 'GET', f'/download-patient-pdf/{patient_id}/')
+        self.stats.record('session:management_flow', 0)
+
+    # ---------------- output ----------------
+    def report(self, elapsed, failures):
+        stats = self.stats
+        requests = sum(len(v) for k, v in stats.latencies.items() if not k.startswith('session:'))
+        self.stdout.write(f"\n{elapsed:.1f}s, {requests / elapsed:.1f} steps/s\n")
+        self.stdout.write(f"{'step':<24}{'ok':>6}{'err':>6}{'err %':>7}{'p50 ms':>9}{'p90 ms':>9}"
+                          f"{'p99 ms':>9}{'max ms':>9}")
+        for step in stats.order:
+            latencies, errors = stats.latencies[step], stats.errors[step]
+            total = len(latencies) + errors
+            if step.startswith('session:'):
+                self.stdout.write(f"{step:<24}{len(latencies):>6}{errors:>6}{errors / total * 100:>6.1f}%")
+                continue
+            if len(latencies) > 1:
+                cuts = statistics.quantiles(latencies, n=100, method='inclusive')
+                p50, p90, p99 = cuts[49], cuts[89], cuts[98]
+            else:
+                p50 = p90 = p99 = latencies[0] if latencies else 0
+            self.stdout.write(
+                f"{step:<24}{len(latencies):>6}{errors:>6}{errors / total * 100:>6.1f}%"
+                f"{p50 * 1e3:>9.1f}{p90 * 1e3:>9.1f}{p99 * 1e3:>9.1f}{max(latencies, default=0) * 1e3:>9.1f}"
+            )
+        for message in sorted(set(failures))[:10]:
+            self.stderr.write(f"  {failures.count(message)} x {message}")
+
+    def cleanup(self):
+        users = CustomUser.objects.filter(username__startswith=f'lt{self.run_id}')
+        for patient_file in PatientFile.objects.filter(doctor__in=users):
+            patient_file.delete()  # releases the stored blob
+        for patient in Patient.objects.filter(uploaded_by__in=users):
+            patient.pdf_file.delete(save=False)
+        EmailOutbox.objects.filter(recipients__contains=f'lt{self.run_id}', recipients__endswith=EMAIL_DOMAIN).delete()
+        users.delete()
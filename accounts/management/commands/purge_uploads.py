@@ -0,0 +1,16 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.chunked_upload import purge_stale
+
+
+class Command(BaseCommand):
+    help = "Delete abandoned chunked upload sessions and their temp files."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--hours', type=int, default=settings.CHUNKED_UPLOAD_EXPIRY_HOURS,
+                            help="Remove sessions not touched for this many hours.")
+
+    def handle(self, *args, **options):
+        removed = purge_stale(options['hours'])
+        self.stdout.write(f"Removed {removed} stale upload session(s).")
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from accounts.counters import reconcile
+
+
+class Command(BaseCommand):
+    help = "Recompute the admin dashboard counters from the tables and fix any drift."
+
+    def handle(self, *args, **options):
+        drift = reconcile()
+        if not drift:
+            self.stdout.write("Counters are in sync.")
+            return
+        for name, (stored, actual) in sorted(drift.items()):
+            self.stdout.write(f"{name}: {stored} -> {actual}")
+        self.stdout.write(self.style.WARNING(f"Fixed {len(drift)} drifted counter(s)."))
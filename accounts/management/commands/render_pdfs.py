@@ -0,0 +1,56 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.fragments import bump, user_scope
+from accounts.metrics import start_metrics_server
+from accounts.models import Patient
+from accounts.render_jobs import run_render_batch
+
+
+class Command(BaseCommand):
+    help = "Render queued patient PDFs in a process pool (runs forever unless --once is given)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Render everything queued and exit.")
+        parser.add_argument('--workers', type=int, default=settings.PDF_RENDER_WORKERS)
+        parser.add_argument('--batch-size', type=int, default=settings.PDF_RENDER_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.PDF_RENDER_POLL_INTERVAL,
+                            help="Seconds to sleep when nothing is queued.")
+        parser.add_argument('--retry-failed', action='store_true',
+                            help="Re-queue records whose previous render failed before starting.")
+        parser.add_argument('--metrics-port', type=int,
+                            help="Serve Prometheus metrics for this worker on this port.")
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
+        if options['retry_failed']:
+            failed = Patient.objects.filter(pdf_status='failed')
+            owners = set(failed.values_list('uploaded_by_id', flat=True))
+            requeued = failed.update(pdf_status='queued', pdf_attempts=0, pdf_error='')
+            bump(*map(user_scope, owners))
+            self.stdout.write(f"Re-queued {requeued} failed render(s)")
+
+        executor = ProcessPoolExecutor(max_workers=options['workers'])
+        try:
+            while True:
+                try:
+                    rendered = run_render_batch(executor, options['batch_size'])
+                except BrokenProcessPool:
+                    # the batch's jobs are back in the queue; carry on with a fresh pool
+                    self.stderr.write("Render pool broke, starting a new one")
+                    executor.shutdown(wait=False)
+                    executor = ProcessPoolExecutor(max_workers=options['workers'])
+                    continue
+                if rendered:
+                    self.stdout.write(f"Rendered {rendered} patient PDF(s)")
+                    continue
+                if options['once']:
+                    return
+                time.sleep(options['interval'])
+        finally:
+            executor.shutdown()
@@ -0,0 +1,31 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from accounts.metrics import start_metrics_server
+from accounts.outbox import deliver_batch
+
+
+class Command(BaseCommand):
+    help = "Deliver queued emails from the outbox (runs forever unless --once is given)."
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help="Drain due messages once and exit.")
+        parser.add_argument('--batch-size', type=int, default=settings.OUTBOX_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=settings.OUTBOX_POLL_INTERVAL,
+                            help="Seconds to sleep when the outbox is empty.")
+        parser.add_argument('--metrics-port', type=int,
+                            help="Serve Prometheus metrics for this worker on this port.")
+
+    def handle(self, *args, **options):
+        if options['metrics_port']:
+            start_metrics_server(options['metrics_port'])
+        while True:
+            sent, failed = deliver_batch(options['batch_size'])
+            if sent or failed:
+                self.stdout.write(f"Outbox: {sent} sent, {failed} failed")
+                continue
+            if options['once']:
+                return
+            time.sleep(options['interval'])
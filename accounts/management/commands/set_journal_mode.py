@@ -0,0 +1,25 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from accounts.signals import set_journal_mode
+
+
+class Command(BaseCommand):
+    help = ("Put the SQLite database in SQLITE_JOURNAL_MODE (WAL by default). The database "
+            "file keeps the mode, so this runs once per database, e.g. when deploying.")
+
+    def add_arguments(self, parser):
+        parser.add_argument('--mode', help="Journal mode to set instead of SQLITE_JOURNAL_MODE, e.g. delete.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'sqlite':
+            raise CommandError("set_journal_mode only applies to a SQLite database.")
+        mode = (options['mode'] or settings.SQLITE_JOURNAL_MODE).lower()
+        previous, current = set_journal_mode(connection, mode)
+        if current != mode:
+            raise CommandError(f"SQLite kept journal mode {current} instead of {mode}.")
+        if previous == current:
+            self.stdout.write(f"{connection.settings_dict['NAME']} already uses journal mode {current}.")
+        else:
+            self.stdout.write(f"{connection.settings_dict['NAME']}: journal mode {previous} -> {current}.")
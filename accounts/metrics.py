@@ -0,0 +1,157 @@
+"""
+In-process metrics in the Prometheus text exposition format.
+
+Counters and histograms live in this process's memory; recording a sample
+takes a lock and a few dict operations, so the per-request cost stays in the
+microseconds. ``/metrics`` (see ``metrics_view``) serves the web process's
+registry. The ``send_outbox`` and ``render_pdfs`` workers can serve theirs
+with ``--metrics-port`` (``start_metrics_server``).
+
+With several gunicorn workers every process keeps its own registry; scrape
+each worker (or run one worker per metrics port) and aggregate in Prometheus.
+"""
+import bisect
+import threading
+import time
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+REGISTRY = []
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def expose(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+        with self._lock:
+            items = sorted(self._values.items())
+            lines.extend(self._samples(items))
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def _samples(self, items):
+        for key, value in items:
+            yield f'{self.name}{_labels(self.labelnames, key)} {value}'
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self, items):
+        for key, (counts, total) in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                yield f'{self.name}_bucket{_labels(self.labelnames, key, [("le", le)])} {cumulative}'
+            yield f'{self.name}_sum{_labels(self.labelnames, key)} {total}'
+            yield f'{self.name}_count{_labels(self.labelnames, key)} {cumulative}'
+
+
+def render():
+    """The whole registry as Prometheus text."""
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.expose())
+    return '\n'.join(lines) + '\n'
+
+
+def start_metrics_server(port, addr=''):
+    """Serve ``render()`` on ``addr:port`` from a daemon thread (for the worker commands)."""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = render().encode()
+            self.send_response(200)
+            self.send_header('Content-Type', CONTENT_TYPE)
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((addr, port), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------- Web requests (see accounts/middleware.py) ----------------
+REQUESTS = Counter('http_requests_total', "Responses by view, method and status.", ('view', 'method', 'status'))
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', "Time until the response (headers, for streams) was ready.",
+    ('view', 'method'),
+)
+DB_QUERIES = Counter('http_db_queries_total', "Database queries run while handling requests.", ('view',))
+DB_SECONDS = Counter('http_db_query_seconds_total', "Time spent in database queries.", ('view',))
+RESPONSE_BYTES = Counter('http_response_bytes_total', "Response body bytes sent.", ('view',))
+
+# ---------------- Background work ----------------
+SMTP_SECONDS = Histogram('smtp_send_seconds', "SMTP delivery time per message.", ('result',))
+PDF_RENDER_SECONDS = Histogram(
+    'pdf_render_seconds', "reportlab render time per patient PDF.",
+    buckets=(0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0),
+)
+PDF_CACHE = Counter(
+    'pdf_render_cache_total', "Patient PDFs by source: kept (unchanged record), copied (same content "
+    "as another record) or rendered.", ('result',),
+)
+RATELIMIT_REJECTIONS = Counter(
+    'ratelimit_rejections_total', "Requests refused by the OTP rate limiter.", ('scope', 'kind'),
+)
@@ -0,0 +1,61 @@
+import time
+
+from django.db import connection
+
+from . import metrics
+
+
+class QueryTimer:
+    """``connection.execute_wrapper`` hook counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.seconds += time.perf_counter() - start
+            self.count += 1
+
+
+class MetricsMiddleware:
+    """Record latency, queries, bytes and status per resolved URL name (see accounts/metrics.py)."""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        timer = QueryTimer()
+        with connection.execute_wrapper(timer):
+            response = self.get_response(request)
+        elapsed = time.perf_counter() - start
+
+        match = request.resolver_match
+        view = (match.url_name or match.view_name) if match else 'unmatched'
+        if view == 'metrics':
+            return response
+
+        metrics.REQUEST_SECONDS.observe(elapsed, view=view, method=request.method)
+        metrics.REQUESTS.inc(view=view, method=request.method, status=response.status_code)
+        if timer.count:
+            metrics.DB_QUERIES.inc(timer.count, view=view)
+            metrics.DB_SECONDS.inc(timer.seconds, view=view)
+        if response.streaming:
+            response.streaming_content = _count_bytes(response.streaming_content, view)
+        else:
+            metrics.RESPONSE_BYTES.inc(len(response.content), view=view)
+        return response
+
+
+def _count_bytes(chunks, view):
+    sent = 0
+    try:
+        for chunk in chunks:
+            sent += len(chunk)
+            yield chunk
+    finally:
+        metrics.RESPONSE_BYTES.inc(sent, view=view)
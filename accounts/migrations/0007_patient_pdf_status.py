@@ -0,0 +1,34 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+def mark_existing_pdfs_ready(apps, schema_editor):
+    Patient = apps.get_model('accounts', 'Patient')
+    Patient.objects.exclude(pdf_file='').exclude(pdf_file__isnull=True).update(pdf_status='ready')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0006_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='pdf_claimed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='pdf_error',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.AddField(
+            model_name='patient',
+            name='pdf_status',
+            field=models.CharField(choices=[('queued', 'Queued'), ('rendering', 'Rendering'), ('ready', 'Ready'), ('failed', 'Failed')], default='queued', max_length=10),
+        ),
+        migrations.RunPython(mark_existing_pdfs_ready, migrations.RunPython.noop),
+    ]
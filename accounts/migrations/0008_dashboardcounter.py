@@ -0,0 +1,35 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:09
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def populate_counters(apps, schema_editor):
+    CustomUser = apps.get_model('accounts', 'CustomUser')
+    Patient = apps.get_model('accounts', 'Patient')
+    DashboardCounter = apps.get_model('accounts', 'DashboardCounter')
+    counts = {'users.admin': 0, 'users.doctor': 0, 'users.management': 0}
+    for row in CustomUser.objects.values('role').annotate(n=Count('id')).order_by():
+        counts[f"users.{row['role']}"] = row['n']
+    counts['patients'] = Patient.objects.count()
+    DashboardCounter.objects.bulk_create(
+        [DashboardCounter(name=name, value=value) for name, value in counts.items()]
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0007_patient_pdf_status'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DashboardCounter',
+            fields=[
+                ('name', models.CharField(max_length=50, primary_key=True, serialize=False)),
+                ('value', models.BigIntegerField(default=0)),
+            ],
+        ),
+        migrations.RunPython(populate_counters, migrations.RunPython.noop),
+    ]
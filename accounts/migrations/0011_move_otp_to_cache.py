@@ -0,0 +1,25 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:15
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0010_patientfile_blob'),
+    ]
+
+    operations = [
+        migrations.RemoveField(
+            model_name='customuser',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='patient',
+            name='otp',
+        ),
+        migrations.RemoveField(
+            model_name='patientfile',
+            name='otp',
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0011_move_otp_to_cache'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='customuser',
+            index=models.Index(fields=['role', '-date_joined'], name='user_role_joined_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['uploaded_by', '-uploaded_at', '-id'], name='patient_owner_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('access_email__isnull', False)), fields=['uploaded_by', '-uploaded_at', '-id'], name='patient_owner_shared_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(condition=models.Q(('pdf_file', ''), ('pdf_file__isnull', True), _connector='OR'), fields=['uploaded_by', '-uploaded_at', '-id'], name='patient_owner_nopdf_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patient',
+            index=models.Index(fields=['pdf_status', 'uploaded_at', 'id'], name='patient_render_queue_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientfile',
+            index=models.Index(fields=['doctor', '-uploaded_at'], name='pfile_doctor_uploaded_idx'),
+        ),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:33
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0014_patientimport'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FileBundle',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('access_email', models.EmailField(max_length=254)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('doctor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='file_bundles', to=settings.AUTH_USER_MODEL)),
+                ('files', models.ManyToManyField(related_name='bundles', to='accounts.patientfile')),
+            ],
+        ),
+    ]
@@ -0,0 +1,67 @@
+from django.db import migrations
+
+# The index as this migration created it, frozen here: accounts/search.py has
+# since replaced it (see 0018_encrypt_patient_phi).
+FTS_TABLE = 'accounts_patient_fts'
+FTS_COLUMNS = ('uploaded_by_id', 'medical_history', 'diagnosis', 'lab_results', 'imaging_reports', 'prescriptions')
+
+
+def sqlite_ddl():
+    columns = ', '.join(FTS_COLUMNS)
+    new = ', '.join(f'new.{name}' for name in FTS_COLUMNS)
+    old = ', '.join(f'old.{name}' for name in FTS_COLUMNS)
+    delete_old = (f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) "
+                  f"VALUES ('delete', old.id, {old});")
+    insert_new = f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new});"
+    return [
+        (f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5({columns}, "
+         f"content='accounts_patient', content_rowid='id', prefix='2 3', "
+         f"tokenize='unicode61 remove_diacritics 2')"),
+        (f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON accounts_patient "
+         f"BEGIN {insert_new} END"),
+        (f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON accounts_patient "
+         f"BEGIN {delete_old} END"),
+        (f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF {columns} "
+         f"ON accounts_patient BEGIN {delete_old} {insert_new} END"),
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+    ]
+
+
+POSTGRES_VECTOR = ' || '.join([
+    "setweight(to_tsvector('english', coalesce(diagnosis, '')), 'A')",
+    "setweight(to_tsvector('english', coalesce(prescriptions, '')), 'B')",
+    "setweight(to_tsvector('english', coalesce(medical_history, '')), 'C')",
+    "setweight(to_tsvector('english', coalesce(lab_results, '') || ' ' || coalesce(imaging_reports, '')), 'D')",
+])
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for statement in sqlite_ddl():
+            schema_editor.execute(statement)
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute(f"ALTER TABLE accounts_patient ADD COLUMN IF NOT EXISTS search_vector tsvector "
+                              f"GENERATED ALWAYS AS ({POSTGRES_VECTOR}) STORED")
+        schema_editor.execute("CREATE INDEX IF NOT EXISTS accounts_patient_search_gin "
+                              "ON accounts_patient USING GIN (search_vector)")
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        for suffix in ('_ai', '_ad', '_au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS accounts_patient_search_gin")
+        schema_editor.execute("ALTER TABLE accounts_patient DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0015_filebundle'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, remove_search_index),
+    ]
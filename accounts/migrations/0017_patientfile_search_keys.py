@@ -0,0 +1,67 @@
+# Generated by Django 4.2.30 on 2026-10-18 02:55
+
+import unicodedata
+
+from django.db import migrations, models
+
+
+def search_key(value):
+    # accounts.models.search_key as of this migration
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def fill_search_keys(apps, schema_editor):
+    PatientFile = apps.get_model('accounts', 'PatientFile')
+    rows = PatientFile.objects.only('patient_name', 'patient_id')
+    batch = []
+    for row in rows.iterator(chunk_size=2000):
+        row.patient_name_key = search_key(row.patient_name)
+        row.patient_id_key = search_key(row.patient_id)
+        batch.append(row)
+        if len(batch) == 2000:
+            PatientFile.objects.bulk_update(batch, ['patient_name_key', 'patient_id_key'])
+            batch = []
+    PatientFile.objects.bulk_update(batch, ['patient_name_key', 'patient_id_key'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0016_patient_search'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patientfile',
+            name='patient_id_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=50),
+        ),
+        migrations.AddField(
+            model_name='patientfile',
+            name='patient_name_key',
+            field=models.CharField(blank=True, default='', editable=False, max_length=100),
+        ),
+        migrations.RunPython(fill_search_keys, migrations.RunPython.noop),
+        migrations.RemoveIndex(
+            model_name='patientfile',
+            name='pfile_doctor_uploaded_idx',
+        ),
+        migrations.AddIndex(
+            model_name='patientfile',
+            index=models.Index(fields=['doctor', '-uploaded_at', '-id'], name='pfile_doctor_uploaded_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='patientfile',
+            index=models.Index(fields=['doctor', 'patient_name_key'], name='pfile_doctor_name_idx', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='patientfile',
+            index=models.Index(fields=['doctor', 'patient_id_key'], name='pfile_doctor_pid_idx', opclasses=['int8_ops', 'varchar_pattern_ops']),
+        ),
+        migrations.AddIndex(
+            model_name='patientfile',
+            index=models.Index(fields=['doctor', 'disease', '-uploaded_at', '-id'], name='pfile_doctor_disease_idx'),
+        ),
+    ]
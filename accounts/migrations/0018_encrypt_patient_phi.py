@@ -0,0 +1,202 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:05
+
+import re
+import unicodedata
+
+import accounts.fields
+from django.db import migrations, models
+
+from accounts import crypto
+
+PHI_FIELDS = (
+    'national_id', 'medical_history', 'diagnosis', 'lab_results', 'imaging_reports', 'prescriptions',
+    'immunizations', 'insurance_details', 'payment_info', 'bank_account',
+)
+# The search index as of this migration (accounts/search.py maintains it afterwards)
+FTS_TABLE = 'accounts_patient_fts'
+SEARCH_FIELDS = ('medical_history', 'diagnosis', 'lab_results', 'imaging_reports', 'prescriptions')
+PG_WEIGHTS = {'diagnosis': 'A', 'prescriptions': 'B', 'medical_history': 'C', 'lab_results': 'D', 'imaging_reports': 'D'}
+PREFIX_MIN, PREFIX_MAX = 2, 12
+BATCH_SIZE = 500
+
+
+def search_key(value):
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
+def index_text(text):
+    """The hashed prefixes of every word of ``text`` (the keyed hash itself is crypto.blind_token)."""
+    return ' '.join(
+        crypto.blind_token(word[:n])
+        for word in re.findall(r'\w+', search_key(text))
+        for n in range(PREFIX_MIN, min(len(word), PREFIX_MAX) + 1)
+    )
+
+
+# ---------------- 0016's plaintext index ----------------
+def drop_plaintext_index(apps, schema_editor):
+    # its triggers would copy every re-encrypted value into the index
+    if schema_editor.connection.vendor == 'sqlite':
+        for suffix in ('_ai', '_ad', '_au'):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS accounts_patient_search_gin")
+        schema_editor.execute("ALTER TABLE accounts_patient DROP COLUMN IF EXISTS search_vector")
+
+
+def restore_plaintext_index(apps, schema_editor):
+    columns = ', '.join(('uploaded_by_id',) + SEARCH_FIELDS)
+    if schema_editor.connection.vendor == 'sqlite':
+        new = ', '.join(f'new.{name}' for name in ('uploaded_by_id',) + SEARCH_FIELDS)
+        old = ', '.join(f'old.{name}' for name in ('uploaded_by_id',) + SEARCH_FIELDS)
+        delete_old = f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, {columns}) VALUES ('delete', old.id, {old});"
+        insert_new = f"INSERT INTO {FTS_TABLE}(rowid, {columns}) VALUES (new.id, {new});"
+        for statement in (
+            (f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({columns}, content='accounts_patient', "
+             f"content_rowid='id', prefix='2 3', tokenize='unicode61 remove_diacritics 2')"),
+            f"CREATE TRIGGER {FTS_TABLE}_ai AFTER INSERT ON accounts_patient BEGIN {insert_new} END",
+            f"CREATE TRIGGER {FTS_TABLE}_ad AFTER DELETE ON accounts_patient BEGIN {delete_old} END",
+            (f"CREATE TRIGGER {FTS_TABLE}_au AFTER UPDATE OF {columns} ON accounts_patient "
+             f"BEGIN {delete_old} {insert_new} END"),
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')",
+        ):
+            schema_editor.execute(statement)
+    elif schema_editor.connection.vendor == 'postgresql':
+        vector = ' || '.join([
+            "setweight(to_tsvector('english', coalesce(diagnosis, '')), 'A')",
+            "setweight(to_tsvector('english', coalesce(prescriptions, '')), 'B')",
+            "setweight(to_tsvector('english', coalesce(medical_history, '')), 'C')",
+            "setweight(to_tsvector('english', coalesce(lab_results, '') || ' ' || coalesce(imaging_reports, '')), 'D')",
+        ])
+        schema_editor.execute(f"ALTER TABLE accounts_patient ADD COLUMN search_vector tsvector "
+                              f"GENERATED ALWAYS AS ({vector}) STORED")
+        schema_editor.execute("CREATE INDEX accounts_patient_search_gin ON accounts_patient USING GIN (search_vector)")
+
+
+# ---------------- Column encryption ----------------
+def encrypt_phi(apps, schema_editor):
+    # plaintext reads back unchanged and is encrypted on write; values already encrypted are kept
+    Patient = apps.get_model('accounts', 'Patient')
+    batch = []
+    for row in Patient.objects.only(*PHI_FIELDS).iterator(chunk_size=BATCH_SIZE):
+        batch.append(row)
+        if len(batch) == BATCH_SIZE:
+            Patient.objects.bulk_update(batch, PHI_FIELDS)
+            batch = []
+    Patient.objects.bulk_update(batch, PHI_FIELDS)
+
+
+def decrypt_phi(apps, schema_editor):
+    Patient = apps.get_model('accounts', 'Patient')
+    for row in Patient.objects.only(*PHI_FIELDS).iterator(chunk_size=BATCH_SIZE):
+        Patient.objects.filter(pk=row.pk).update(**{
+            name: models.Value(getattr(row, name), output_field=models.TextField()) for name in PHI_FIELDS
+        })
+
+
+# ---------------- Blind search index ----------------
+def create_blind_index(apps, schema_editor):
+    conn = schema_editor.connection
+    if conn.vendor == 'sqlite':
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5(uploaded_by_id, {', '.join(SEARCH_FIELDS)}, tokenize='ascii')"
+        )
+        sql = f"INSERT INTO {FTS_TABLE}(rowid, uploaded_by_id, {', '.join(SEARCH_FIELDS)}) VALUES (%s, %s, %s, %s, %s, %s, %s)"
+
+        def row(patient, texts):
+            return (patient.pk, patient.uploaded_by_id, *texts)
+    elif conn.vendor == 'postgresql':
+        schema_editor.execute("ALTER TABLE accounts_patient ADD COLUMN search_vector tsvector")
+        schema_editor.execute("CREATE INDEX accounts_patient_search_gin ON accounts_patient USING GIN (search_vector)")
+        vector = ' || '.join(f"setweight(to_tsvector('simple', %s), '{PG_WEIGHTS[name]}')" for name in SEARCH_FIELDS)
+        sql = f"UPDATE accounts_patient SET search_vector = {vector} WHERE id = %s"
+
+        def row(patient, texts):
+            return (*texts, patient.pk)
+    else:
+        return
+    Patient = apps.get_model('accounts', 'Patient')
+    patients = Patient.objects.only('id', 'uploaded_by_id', *SEARCH_FIELDS).order_by()
+    rows = []
+    with conn.cursor() as cursor:
+        for patient in patients.iterator(chunk_size=BATCH_SIZE):
+            rows.append(row(patient, [index_text(getattr(patient, name)) for name in SEARCH_FIELDS]))
+            if len(rows) == BATCH_SIZE:
+                cursor.executemany(sql, rows)
+                rows = []
+        if rows:
+            cursor.executemany(sql, rows)
+
+
+def drop_blind_index(apps, schema_editor):
+    if schema_editor.connection.vendor == 'sqlite':
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+    elif schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute("DROP INDEX IF EXISTS accounts_patient_search_gin")
+        schema_editor.execute("ALTER TABLE accounts_patient DROP COLUMN IF EXISTS search_vector")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0017_patientfile_search_keys'),
+    ]
+
+    operations = [
+        migrations.RunPython(drop_plaintext_index, restore_plaintext_index),
+        migrations.AlterField(
+            model_name='patient',
+            name='bank_account',
+            field=accounts.fields.EncryptedCharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='diagnosis',
+            field=accounts.fields.EncryptedTextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='imaging_reports',
+            field=accounts.fields.EncryptedTextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='immunizations',
+            field=accounts.fields.EncryptedTextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='insurance_details',
+            field=accounts.fields.EncryptedTextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='lab_results',
+            field=accounts.fields.EncryptedTextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='medical_history',
+            field=accounts.fields.EncryptedTextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='national_id',
+            field=accounts.fields.EncryptedCharField(blank=True, default='', max_length=50),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='payment_info',
+            field=accounts.fields.EncryptedTextField(blank=True, default=''),
+        ),
+        migrations.AlterField(
+            model_name='patient',
+            name='prescriptions',
+            field=accounts.fields.EncryptedTextField(blank=True, default=''),
+        ),
+        migrations.RunPython(encrypt_phi, decrypt_phi),
+        migrations.RunPython(create_blind_index, drop_blind_index),
+    ]
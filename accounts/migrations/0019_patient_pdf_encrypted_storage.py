@@ -0,0 +1,19 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:14
+
+import accounts.storage
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0018_encrypt_patient_phi'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='patient',
+            name='pdf_file',
+            field=models.FileField(blank=True, null=True, storage=accounts.storage.patient_pdf_storage, upload_to='patient_pdfs/'),
+        ),
+    ]
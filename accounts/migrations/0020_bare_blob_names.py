@@ -0,0 +1,47 @@
+import os
+import re
+
+from django.core.files.storage import FileSystemStorage
+from django.db import migrations
+
+# accounts.storage blob names as of this migration: blobs/<aa>/<bb>/<sha256>, once
+# followed by the extension of the first upload
+BLOB_NAME_RE = re.compile(r'^blobs/[0-9a-f]{2}/[0-9a-f]{2}/([0-9a-f]{64})(\.[\w.-]*)?$')
+
+
+def bare_name(sha256):
+    return f'blobs/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def strip_blob_extensions(apps, schema_editor):
+    """Store each blob once under its bare name: copies of the same bytes that were
+    written under different extensions are merged and the extra files deleted."""
+    FileBlob = apps.get_model('accounts', 'FileBlob')
+    PatientFile = apps.get_model('accounts', 'PatientFile')
+    storage = FileSystemStorage()  # renames only: the encrypted bytes do not depend on the name
+    for blob in FileBlob.objects.iterator():
+        target = bare_name(blob.sha256)
+        names = set(PatientFile.objects.filter(blob=blob).values_list('file', flat=True)) | {blob.name}
+        for name in sorted(names - {target}):
+            if not BLOB_NAME_RE.match(name) or not storage.exists(name):
+                continue
+            if storage.exists(target):
+                storage.delete(name)
+            else:
+                os.makedirs(os.path.dirname(storage.path(target)), exist_ok=True)
+                os.replace(storage.path(name), storage.path(target))
+        PatientFile.objects.filter(blob=blob).exclude(file=target).update(file=target)
+        if blob.name != target:
+            blob.name = target
+            blob.save(update_fields=['name'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0019_patient_pdf_encrypted_storage'),
+    ]
+
+    operations = [
+        migrations.RunPython(strip_blob_extensions, migrations.RunPython.noop),
+    ]
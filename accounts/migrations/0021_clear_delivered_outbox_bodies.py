@@ -0,0 +1,18 @@
+from django.db import migrations
+
+
+def clear_bodies(apps, schema_editor):
+    # sent and dead-lettered mail keeps only its envelope: the bodies carry OTPs
+    EmailOutbox = apps.get_model('accounts', 'EmailOutbox')
+    EmailOutbox.objects.filter(status__in=('sent', 'dead')).update(body='', html_body='')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0020_bare_blob_names'),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_bodies, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0021_clear_delivered_outbox_bodies'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='pdf_attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+    ]
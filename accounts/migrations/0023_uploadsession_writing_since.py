@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounts', '0022_patient_pdf_attempts'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='uploadsession',
+            name='writing_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
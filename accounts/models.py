@@ -1,9 +1,18 @@
 # models.py
 from django.db import models
 from django.contrib.auth.models import AbstractUser
+from django.db import transaction
+from django.utils import timezone
+import os
 import random
+import unicodedata
+import uuid
 import string
 
+from .fields import EncryptedCharField, EncryptedTextField
+from .otp import issue_otp, revoke_otp, verify_otp
+from .storage import blob_sha, patient_file_storage, patient_pdf_storage
+
 # ---------------- Custom User Model ----------------
 class CustomUser(AbstractUser):
     ROLE_CHOICES = (
@@ -14,24 +23,73 @@ class CustomUser(AbstractUser):
 
     role = models.CharField(max_length=15, choices=ROLE_CHOICES, default='doctor')
     is_verified = models.BooleanField(default=False)
-    otp = models.CharField(max_length=6, blank=True, null=True)
     profile_image = models.ImageField(upload_to="profiles/", blank=True, null=True)
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            # staff lists: filter(role=...).order_by('-date_joined')
+            models.Index(fields=['role', '-date_joined'], name='user_role_joined_idx'),
+        ]
+
     def generate_password(self, length=8):
         """Generate a random password (kept for registration use)."""
         return ''.join(random.choices(string.ascii_letters + string.digits, k=length))
 
     def generate_otp(self):
-        """Generate a 6-digit OTP (string)."""
-        self.otp = ''.join(random.choices(string.digits, k=6))
-        self.save(update_fields=['otp'])
-        return self.otp
+        """Issue a 6-digit login OTP (string); see accounts/otp.py."""
+        return issue_otp('login', self.pk)
+
+    def verify_otp(self, code):
+        return verify_otp('login', self.pk, code)
 
     def __str__(self):
         return f"{self.username} ({self.get_full_name()})"
 
 
+# ---------------- Shared file blobs (content-addressed, see accounts/storage.py) ----------------
+class FileBlob(models.Model):
+    sha256 = models.CharField(max_length=64, primary_key=True)
+    name = models.CharField(max_length=255)  # storage name
+    size = models.BigIntegerField()
+    ref_count = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    @classmethod
+    def acquire(cls, sha256, name, size):
+        """Record one more row using this blob."""
+        if not cls.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') + 1):
+            _, created = cls.objects.get_or_create(
+                sha256=sha256, defaults={'name': name, 'size': size, 'ref_count': 1},
+            )
+            if not created:
+                cls.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') + 1)
+
+    @classmethod
+    def release(cls, sha256):
+        """Drop one reference; the last one deletes the stored bytes after commit."""
+        cls.objects.filter(sha256=sha256).update(ref_count=models.F('ref_count') - 1)
+        blob = cls.objects.filter(sha256=sha256, ref_count__lte=0).first()
+        if blob and cls.objects.filter(sha256=sha256, ref_count__lte=0).delete()[0]:
+            transaction.on_commit(lambda: cls._delete_if_unreferenced(sha256, blob.name))
+
+    @classmethod
+    def _delete_if_unreferenced(cls, sha256, name):
+        if not cls.objects.filter(sha256=sha256).exists():  # re-acquired meanwhile?
+            patient_file_storage().delete(name)
+
+    def __str__(self):
+        return f"{self.sha256[:12]} x{self.ref_count}"
+
+
 # ---------------- Patient File Model (for doctor uploads) ----------------
+def search_key(value):
+    """Normalised form of a name or ID for prefix search: accents dropped, case-folded,
+    runs of whitespace collapsed ("  José  Pérez" -> "jose perez")."""
+    decomposed = unicodedata.normalize('NFKD', value or '')
+    stripped = ''.join(char for char in decomposed if not unicodedata.combining(char))
+    return ' '.join(stripped.casefold().split())
+
+
 class PatientFile(models.Model):
     doctor = models.ForeignKey(
         CustomUser,
@@ -42,25 +100,88 @@ class PatientFile(models.Model):
     patient_name = models.CharField(max_length=100)
     patient_id = models.CharField(max_length=50, default='UnknownID')
     disease = models.CharField(max_length=200, default='Unknown')
-    file = models.FileField(upload_to='patient_files/', blank=False, null=False)
+    file = models.FileField(upload_to='patient_files/', storage=patient_file_storage, blank=False, null=False)
+    original_name = models.CharField(max_length=255, blank=True, default='')  # name as uploaded
+    blob = models.ForeignKey('FileBlob', on_delete=models.PROTECT, null=True, blank=True, related_name='patient_files')
     uploaded_at = models.DateTimeField(auto_now_add=True)
-    otp = models.CharField(max_length=6, blank=True, null=True)
     access_email = models.EmailField(blank=True, null=True)  # recipient email for access
+    # search_key() of patient_name / patient_id, kept current by save()
+    patient_name_key = models.CharField(max_length=100, blank=True, default='', editable=False)
+    patient_id_key = models.CharField(max_length=50, blank=True, default='', editable=False)
+
+    class Meta:
+        indexes = [
+            # doctor dashboard: filter(doctor=...).order_by('-uploaded_at')
+            models.Index(fields=['doctor', '-uploaded_at', '-id'], name='pfile_doctor_uploaded_idx'),
+            # file search: prefix ranges on the normalised keys (pattern opclass for LIKE on Postgres)
+            models.Index(fields=['doctor', 'patient_name_key'], name='pfile_doctor_name_idx',
+                         opclasses=['int8_ops', 'varchar_pattern_ops']),
+            models.Index(fields=['doctor', 'patient_id_key'], name='pfile_doctor_pid_idx',
+                         opclasses=['int8_ops', 'varchar_pattern_ops']),
+            # disease facet: one condition's files newest first, and the per-condition counts
+            models.Index(fields=['doctor', 'disease', '-uploaded_at', '-id'], name='pfile_doctor_disease_idx'),
+        ]
+
+    @property
+    def display_name(self):
+        return self.original_name or os.path.basename(self.file.name)
+
+    def save(self, *args, **kwargs):
+        self.patient_name_key = search_key(self.patient_name)
+        self.patient_id_key = search_key(self.patient_id)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and {'patient_name', 'patient_id'} & set(update_fields):
+            kwargs['update_fields'] = set(update_fields) | {'patient_name_key', 'patient_id_key'}
+        if self.file and not self.file._committed:
+            # Store the bytes now (deduplicated by content) so the row is written once.
+            self.original_name = self.original_name or os.path.basename(self.file.name)
+            self.file.save(self.file.name, self.file.file, save=False)
+        sha256 = blob_sha(self.file.name)
+        if sha256 != self.blob_id:
+            previous = self.blob_id
+            if sha256:
+                FileBlob.acquire(sha256, self.file.name, self.file.size)
+            self.blob_id = sha256
+            if previous:
+                FileBlob.release(previous)
+            update_fields = kwargs.get('update_fields')
+            if update_fields is not None:
+                kwargs['update_fields'] = set(update_fields) | {'blob'}
+        super().save(*args, **kwargs)
 
     def generate_otp(self):
-        """Generate and persist a 6-digit OTP for this file."""
-        self.otp = str(random.randint(100000, 999999))
-        self.save(update_fields=['otp'])
-        return self.otp
+        """Issue a 6-digit OTP for this file; see accounts/otp.py."""
+        return issue_otp('patient_file', self.pk)
+
+    def verify_otp(self, code):
+        return verify_otp('patient_file', self.pk, code)
 
     def clear_otp(self):
-        self.otp = None
-        self.save(update_fields=['otp'])
+        revoke_otp('patient_file', self.pk)
 
     def __str__(self):
         return f"{self.patient_name} - {self.file.name}"
 
 
+# ---------------- File bundles (several patient files behind one OTP) ----------------
+class FileBundle(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    doctor = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='file_bundles')
+    files = models.ManyToManyField(PatientFile, related_name='bundles')
+    access_email = models.EmailField()  # recipient allowed to download the bundle
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def generate_otp(self):
+        """Issue a 6-digit OTP covering every file in the bundle; see accounts/otp.py."""
+        return issue_otp('bundle', self.pk)
+
+    def verify_otp(self, code):
+        return verify_otp('bundle', self.pk, code)
+
+    def __str__(self):
+        return f"Bundle {self.pk} for {self.access_email}"
+
+
 # ---------------- Patient Model (for management uploads / full records) ----------------
 class Patient(models.Model):
     # Personal Info
@@ -69,41 +190,166 @@ class Patient(models.Model):
     address = models.TextField(blank=True, default='')
     phone = models.CharField(max_length=20, blank=True, default='')
     email = models.EmailField()
-    national_id = models.CharField(max_length=50, blank=True, default='')
-
-    # Medical Info
-    medical_history = models.TextField(blank=True, default='')
-    diagnosis = models.TextField(blank=True, default='')
-    lab_results = models.TextField(blank=True, default='')
-    imaging_reports = models.TextField(blank=True, default='')
-    prescriptions = models.TextField(blank=True, default='')
-    immunizations = models.TextField(blank=True, default='')
+    national_id = EncryptedCharField(max_length=50, blank=True, default='')
+
+    # Medical Info (encrypted at rest, decrypted on first attribute access; see accounts/fields.py)
+    medical_history = EncryptedTextField(blank=True, default='')
+    diagnosis = EncryptedTextField(blank=True, default='')
+    lab_results = EncryptedTextField(blank=True, default='')
+    imaging_reports = EncryptedTextField(blank=True, default='')
+    prescriptions = EncryptedTextField(blank=True, default='')
+    immunizations = EncryptedTextField(blank=True, default='')
     gender = models.CharField(max_length=20, blank=True, default='')
 
     # Financial Info
-    insurance_details = models.TextField(blank=True, default='')
-    payment_info = models.TextField(blank=True, default='')
-    bank_account = models.CharField(max_length=50, blank=True, default='')
+    insurance_details = EncryptedTextField(blank=True, default='')
+    payment_info = EncryptedTextField(blank=True, default='')
+    bank_account = EncryptedCharField(max_length=50, blank=True, default='')
 
     uploaded_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='patients')
     uploaded_at = models.DateTimeField(auto_now_add=True)
 
     # Generated PDF containing the full patient record
-    pdf_file = models.FileField(upload_to='patient_pdfs/', blank=True, null=True)
+    PDF_STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('rendering', 'Rendering'),
+        ('ready', 'Ready'),
+        ('failed', 'Failed'),
+    )
+    pdf_file = models.FileField(upload_to='patient_pdfs/', storage=patient_pdf_storage, blank=True, null=True)
+    pdf_status = models.CharField(max_length=10, choices=PDF_STATUS_CHOICES, default='queued')
+    pdf_claimed_at = models.DateTimeField(null=True, blank=True)  # set while a render worker owns the job
+    pdf_attempts = models.PositiveSmallIntegerField(default=0)  # renders lost with their worker
+    pdf_error = models.TextField(blank=True, default='')
+    pdf_hash = models.CharField(max_length=64, blank=True, default='', db_index=True)  # see accounts/pdf.py
 
     # OTP & sharing
-    otp = models.CharField(max_length=6, blank=True, null=True)
     access_email = models.EmailField(blank=True, null=True)  # email of other management allowed to access
 
+    class Meta:
+        indexes = [
+            # management dashboard keyset pages: filter(uploaded_by=...).order_by('-uploaded_at', '-id')
+            models.Index(fields=['uploaded_by', '-uploaded_at', '-id'], name='patient_owner_uploaded_idx'),
+            # the shared and missing-PDF subsets only index the rows they can match (SQLite
+            # skips partial indexes whose condition compares against a constant, e.g. pdf_file='')
+            models.Index(
+                fields=['uploaded_by', '-uploaded_at', '-id'], name='patient_owner_shared_idx',
+                condition=models.Q(access_email__isnull=False),
+            ),
+            models.Index(
+                fields=['uploaded_by', '-uploaded_at', '-id'], name='patient_owner_nopdf_idx',
+                condition=models.Q(pdf_file='') | models.Q(pdf_file__isnull=True),
+            ),
+            # render_pdfs queue: oldest first within a status
+            models.Index(fields=['pdf_status', 'uploaded_at', 'id'], name='patient_render_queue_idx'),
+        ]
+
     def generate_otp(self):
-        """Generate and persist a 6-digit OTP for PDF access."""
-        self.otp = str(random.randint(100000, 999999))
-        self.save(update_fields=['otp'])
-        return self.otp
+        """Issue a 6-digit OTP for PDF access; see accounts/otp.py."""
+        return issue_otp('patient', self.pk)
+
+    def verify_otp(self, code):
+        return verify_otp('patient', self.pk, code)
 
     def clear_otp(self):
-        self.otp = None
-        self.save(update_fields=['otp'])
+        revoke_otp('patient', self.pk)
 
     def __str__(self):
         return f"{self.full_name} - uploaded by {self.uploaded_by.username}"
+
+
+# ---------------- Email Outbox (queued outbound mail) ----------------
+class EmailOutbox(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sending', 'Sending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    )
+
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    html_body = models.TextField(blank=True, default='')
+    from_email = models.CharField(max_length=254)
+    recipients = models.TextField()  # comma separated list of addresses
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True, default='')
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'next_attempt_at'], name='outbox_status_due_idx'),
+        ]
+
+    @property
+    def recipient_list(self):
+        return [r for r in self.recipients.split(',') if r]
+
+    def __str__(self):
+        return f"{self.subject} -> {self.recipients} ({self.status})"
+
+
+# ---------------- Dashboard Counters (kept current by accounts.signals) ----------------
+class DashboardCounter(models.Model):
+    name = models.CharField(max_length=50, primary_key=True)
+    value = models.BigIntegerField(default=0)
+
+    @classmethod
+    def incr(cls, name, delta=1):
+        """Atomically add ``delta`` to counter ``name`` (created on first use)."""
+        if not cls.objects.filter(name=name).update(value=models.F('value') + delta):
+            _, created = cls.objects.get_or_create(name=name, defaults={'value': delta})
+            if not created:
+                cls.objects.filter(name=name).update(value=models.F('value') + delta)
+
+    @classmethod
+    def read(cls, *names):
+        """Return ``{name: value}`` for ``names`` in one query; missing counters read as 0."""
+        values = dict(cls.objects.filter(name__in=names).values_list('name', 'value'))
+        return {name: values.get(name, 0) for name in names}
+
+    def __str__(self):
+        return f"{self.name} = {self.value}"
+
+
+# ---------------- Resumable chunked uploads (doctor patient files) ----------------
+class UploadSession(models.Model):
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    doctor = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='upload_sessions')
+    patient_name = models.CharField(max_length=100)
+    patient_id = models.CharField(max_length=50, default='UnknownID')
+    disease = models.CharField(max_length=200, default='Unknown')
+    access_email = models.EmailField(blank=True, null=True)
+    filename = models.CharField(max_length=255)
+    total_size = models.BigIntegerField()
+    received = models.BigIntegerField(default=0)  # last acknowledged offset
+    writing_since = models.DateTimeField(null=True, blank=True)  # set while a PUT owns the temp file
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    @property
+    def is_complete(self):
+        return self.received == self.total_size
+
+    def __str__(self):
+        return f"{self.filename} ({self.received}/{self.total_size})"
+
+
+# ---------------- Bulk patient imports (see the import_patients command) ----------------
+class PatientImport(models.Model):
+    source = models.CharField(max_length=500, unique=True)  # absolute path of the input file
+    source_size = models.BigIntegerField()
+    uploaded_by = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='patient_imports')
+    rows_done = models.BigIntegerField(default=0)  # input rows committed (imported or rejected)
+    imported = models.BigIntegerField(default=0)
+    rejected = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    def __str__(self):
+        return f"{self.source} ({self.rows_done} rows, {self.imported} imported, {self.rejected} rejected)"
@@ -0,0 +1,82 @@
+"""
+One-time passwords kept in the cache instead of on the user/patient rows.
+
+Each code is stored under ``otp:<purpose>:<pk>`` as a keyed hash, with a
+per-purpose TTL from ``OTP_TTL_SECONDS``; the cache drops it when it expires.
+Issuing a new code for the same object replaces the old one. A code is
+single-use: it is consumed with ``cache.delete()``, which reports whether this
+caller removed the key, so of two concurrent correct submissions only one
+succeeds. After ``OTP_MAX_ATTEMPTS`` wrong guesses the code is revoked; the
+guesses are counted under a short lock (accounts/locks.py), since
+``cache.incr`` is a plain read-modify-write on the file-based backend.
+
+The store uses the ``OTP_CACHE`` alias, which must be shared by the web
+workers and ``render_pdfs`` (file-based by default; Redis or memcached in
+production).
+"""
+import secrets
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare, salted_hmac
+
+from . import locks
+
+KEY_PREFIX = 'otp'
+_LOCK_ATTEMPTS = 5
+_LOCK_WAIT = 0.005  # seconds between attempts to take a counter lock
+
+
+def _cache():
+    return caches[settings.OTP_CACHE]
+
+
+def _key(purpose, pk):
+    return f'{KEY_PREFIX}:{purpose}:{pk}'
+
+
+def _digest(key, code):
+    return salted_hmac(key, str(code)).hexdigest()
+
+
+def issue_otp(purpose, pk):
+    """Create a fresh 6-digit code for ``purpose``/``pk`` and return it."""
+    code = f'{secrets.randbelow(10 ** 6):06d}'
+    key = _key(purpose, pk)
+    ttl = settings.OTP_TTL_SECONDS[purpose]
+    _cache().set_many({key: _digest(key, code), f'{key}:fails': 0}, timeout=ttl)
+    return code
+
+
+def verify_otp(purpose, pk, code):
+    """Consume the code for ``purpose``/``pk`` if ``code`` matches it."""
+    cache = _cache()
+    key = _key(purpose, pk)
+    stored = cache.get(key)
+    if stored is None or not code:
+        return False
+    if constant_time_compare(stored, _digest(key, code)):
+        return cache.delete(key)  # only the caller that removes the key wins
+    if _count_failure(cache, key, settings.OTP_TTL_SECONDS[purpose]) >= settings.OTP_MAX_ATTEMPTS:
+        revoke_otp(purpose, pk)
+    return False
+
+
+def _count_failure(cache, key, ttl):
+    """Add one wrong guess to ``key``'s count and return the new count."""
+    lock = f'{key}:lock'
+    if not locks.acquire(cache, lock, _LOCK_ATTEMPTS, _LOCK_WAIT):
+        return settings.OTP_MAX_ATTEMPTS  # a burst of parallel guesses: revoke the code
+    try:
+        fails = cache.get(f'{key}:fails')
+        if fails is None:  # expired or evicted
+            return settings.OTP_MAX_ATTEMPTS
+        cache.set(f'{key}:fails', fails + 1, timeout=ttl)
+        return fails + 1
+    finally:
+        locks.release(cache, lock)
+
+
+def revoke_otp(purpose, pk):
+    key = _key(purpose, pk)
+    _cache().delete_many([key, f'{key}:fails'])
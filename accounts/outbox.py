@@ -0,0 +1,145 @@
+"""
+Persisted email outbox.
+
+Views call ``enqueue_mail`` instead of ``send_mail``: it costs a single INSERT
+and returns immediately. The ``send_outbox`` management command drains the
+table in batches over one SMTP connection, retrying failures with exponential
+backoff and dead-lettering messages that keep failing.
+
+Bodies carry one-time passwords in plaintext, so they are blanked (``CLEARED``)
+as soon as a message is sent or dead-lettered; only the envelope is kept.
+"""
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .metrics import SMTP_SECONDS
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+CLEARED = {'body': '', 'html_body': ''}
+
+
+def enqueue_mail(subject, message, from_email, recipient_list, html_message=None):
+    """Queue an email for background delivery (same arguments as ``send_mail``)."""
+    return EmailOutbox.objects.create(
+        subject=subject,
+        body=message,
+        html_body=html_message or '',
+        from_email=from_email or settings.EMAIL_HOST_USER,
+        recipients=','.join(recipient_list),
+    )
+
+
+def retry_delay(attempts):
+    """Exponential backoff: base, 2*base, 4*base ... capped at OUTBOX_RETRY_MAX_DELAY."""
+    delay = settings.OUTBOX_RETRY_BACKOFF * (2 ** max(attempts - 1, 0))
+    return timedelta(seconds=min(delay, settings.OUTBOX_RETRY_MAX_DELAY))
+
+
+def claim_batch(batch_size=None):
+    """Lease up to ``batch_size`` due messages to this worker."""
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.OUTBOX_LEASE_SECONDS)
+    due = Q(status='pending', next_attempt_at__lte=now)
+    expired = Q(status='sending', locked_at__lt=stale)  # worker died mid-batch
+    candidates = (
+        EmailOutbox.objects.filter(due | expired)
+        .order_by('next_attempt_at', 'id')
+        .values_list('id', 'status')[:batch_size]
+    )
+    # Each UPDATE repeats the condition the row was read under, so of two
+    # workers that read the same row only the one whose UPDATE changes it
+    # owns the message (row locks are not available on SQLite).
+    ids = []
+    for pk, status in candidates:
+        if status == 'pending':
+            claimed = EmailOutbox.objects.filter(due, id=pk).update(status='sending', locked_at=now)
+        else:
+            # A lease that ran out counts as an attempt, so a message that kills
+            # its worker is dead-lettered instead of being reclaimed forever.
+            claimed = EmailOutbox.objects.filter(expired, id=pk).update(
+                locked_at=now, attempts=F('attempts') + 1,
+                last_error='Lease expired: the worker sending it stopped.',
+            )
+        if claimed:
+            ids.append(pk)
+    dead = set(EmailOutbox.objects.filter(
+        id__in=ids, attempts__gte=settings.OUTBOX_MAX_ATTEMPTS,
+    ).values_list('id', flat=True))
+    if dead:
+        EmailOutbox.objects.filter(id__in=dead).update(status='dead', locked_at=None, **CLEARED)
+        logger.error("Outbox messages %s dead-lettered after their last lease expired", sorted(dead))
+    ids = [pk for pk in ids if pk not in dead]
+    if not ids:
+        return []
+    return list(EmailOutbox.objects.filter(id__in=ids).order_by('id'))
+
+
+def deliver_batch(batch_size=None):
+    """Send one batch of due messages. Returns (sent, failed) counts."""
+    batch = claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+
+    sent = failed = 0
+    handled = set()
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for item in batch:
+            email = EmailMultiAlternatives(
+                subject=item.subject,
+                body=item.body,
+                from_email=item.from_email,
+                to=item.recipient_list,
+                connection=connection,
+            )
+            if item.html_body:
+                email.attach_alternative(item.html_body, 'text/html')
+            start = time.perf_counter()
+            try:
+                email.send()
+            except Exception as exc:
+                SMTP_SECONDS.observe(time.perf_counter() - start, result='error')
+                failed += 1
+                _mark_failed(item, exc)
+            else:
+                SMTP_SECONDS.observe(time.perf_counter() - start, result='sent')
+                sent += 1
+                EmailOutbox.objects.filter(id=item.id).update(
+                    status='sent', sent_at=timezone.now(), locked_at=None, last_error='', **CLEARED,
+                )
+            handled.add(item.id)
+    except Exception as exc:
+        # Could not connect (or the connection dropped): release the rest of the batch.
+        for item in batch:
+            if item.id not in handled:
+                failed += 1
+                _mark_failed(item, exc)
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    return sent, failed
+
+
+def _mark_failed(item, exc):
+    attempts = item.attempts + 1
+    fields = {'attempts': attempts, 'locked_at': None, 'last_error': repr(exc)[:2000]}
+    if attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        fields.update(status='dead', **CLEARED)
+        logger.error("Outbox message %s dead-lettered after %s attempts: %r", item.id, attempts, exc)
+    else:
+        fields['status'] = 'pending'
+        fields['next_attempt_at'] = timezone.now() + retry_delay(attempts)
+        logger.warning("Outbox message %s failed (attempt %s): %r", item.id, attempts, exc)
+    EmailOutbox.objects.filter(id=item.id).update(**fields)
@@ -0,0 +1,71 @@
+"""
+Keyset (cursor) pagination over ``(uploaded_at, id)``.
+
+Unlike OFFSET pagination the cost of a page does not depend on how deep the
+user has paged: each page is a single index range scan that starts right
+after (or before) the row encoded in the cursor.
+"""
+import base64
+from datetime import datetime
+
+from django.db.models import Q
+
+
+def encode_cursor(obj, field='uploaded_at'):
+    raw = f"{getattr(obj, field).isoformat()}|{obj.pk}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(token):
+    """Return ``(timestamp, pk)`` or ``None`` for a missing/garbled cursor."""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode()
+        stamp, pk = raw.rsplit('|', 1)
+        return datetime.fromisoformat(stamp), int(pk)
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+class KeysetPage:
+    """One page of rows, newest first, plus cursors for the neighbouring pages."""
+
+    def __init__(self, queryset, after=None, before=None, per_page=25, field='uploaded_at'):
+        self.field = field
+        after, before = decode_cursor(after), decode_cursor(before)
+
+        if before:
+            # Walk backwards (oldest first) from the cursor, then flip back.
+            stamp, pk = before
+            qs = queryset.filter(Q(**{f'{field}__gt': stamp}) | Q(**{field: stamp, 'pk__gt': pk}))
+            rows = list(qs.order_by(field, 'pk')[:per_page + 1])
+            self.has_previous = len(rows) > per_page
+            self.has_next = True
+            self.object_list = rows[:per_page][::-1]
+        else:
+            qs = queryset
+            if after:
+                stamp, pk = after
+                qs = qs.filter(Q(**{f'{field}__lt': stamp}) | Q(**{field: stamp, 'pk__lt': pk}))
+            rows = list(qs.order_by(f'-{field}', '-pk')[:per_page + 1])
+            self.has_next = len(rows) > per_page
+            self.has_previous = after is not None
+            self.object_list = rows[:per_page]
+
+        if not self.object_list:
+            self.has_next = self.has_previous = False
+
+    @property
+    def next_cursor(self):
+        return encode_cursor(self.object_list[-1], self.field) if self.has_next else None
+
+    @property
+    def previous_cursor(self):
+        return encode_cursor(self.object_list[0], self.field) if self.has_previous else None
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
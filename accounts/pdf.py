@@ -0,0 +1,190 @@
+"""
+Patient record PDF rendering.
+
+``render_patient_pdf`` only depends on reportlab and a plain dict of strings,
+so it can run inside a ``ProcessPoolExecutor`` worker without Django. The
+static page (title, rules, fixed section titles, footer) is a form XObject
+drawn by ``draw_skeleton``; the render only adds the patient's values.
+
+``pdf_content_hash`` keys rendered output by the printed values, so the
+render pipeline can reuse stored bytes for an unchanged record.
+"""
+import hashlib
+import json
+from io import BytesIO
+
+from django.utils import timezone
+from reportlab.pdfgen import canvas
+
+SKELETON = 'PatientRecordSkeleton'
+# Bump when the layout changes so cached PDFs are re-rendered.
+LAYOUT_VERSION = 2
+
+
+def patient_pdf_fields(patient):
+    """Snapshot the values printed on the PDF (picklable, safe to ship to a worker)."""
+    return {
+        'full_name': patient.full_name,
+        'date_of_birth': str(patient.date_of_birth),
+        'gender': patient.gender,
+        'national_id': patient.national_id,
+        'email': patient.email,
+        'phone': patient.phone,
+        'address': patient.address,
+        'medical_history': patient.medical_history,
+        'diagnosis': patient.diagnosis,
+        'lab_results': patient.lab_results,
+        'imaging_reports': patient.imaging_reports,
+        'prescriptions': patient.prescriptions,
+        'immunizations': patient.immunizations,
+        'insurance_details': patient.insurance_details,
+        'payment_info': patient.payment_info,
+        'bank_account': patient.bank_account,
+        'generated_at': timezone.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+
+
+def pdf_content_hash(fields):
+    """Hash of everything printed on the PDF except the generation time."""
+    printed = {key: value for key, value in fields.items() if key != 'generated_at'}
+    payload = json.dumps([LAYOUT_VERSION, printed], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def patient_pdf_filename(patient):
+    return f"{patient.full_name.replace(' ', '_')}_medical_record.pdf"
+
+
+def draw_skeleton(p):
+    """Define the static page (title, rules, fixed section titles, footer) as a form XObject."""
+    p.beginForm(SKELETON)
+
+    # Set up PDF styling
+    p.setFont("Helvetica-Bold", 16)
+    p.setFillColorRGB(0.2, 0.4, 0.6)  # Dark blue color
+    p.drawString(100, 800, "SECURE HEALTH - PATIENT MEDICAL RECORD")
+
+    # Add logo/header line
+    p.setStrokeColorRGB(0.2, 0.4, 0.6)
+    p.setLineWidth(2)
+    p.line(100, 790, 500, 790)
+
+    # Section titles at fixed positions
+    p.setFont("Helvetica-Bold", 12)
+    p.setFillColorRGB(0.3, 0.3, 0.3)
+    p.drawString(100, 760, "PATIENT INFORMATION")
+    p.drawString(100, 620, "CONTACT INFORMATION")
+    p.drawString(100, 540, "MEDICAL INFORMATION")
+
+    # Footer
+    p.setFont("Helvetica-Oblique", 8)
+    p.setFillColorRGB(0.5, 0.5, 0.5)
+    p.drawString(100, 50, "This document contains confidential patient information. Unauthorized access is prohibited.")
+    p.drawString(100, 30, "Secure Health - Protecting Patient Privacy")
+
+    p.endForm()
+
+
+def render_patient_pdf(fields):
+    """Render the patient medical record and return the PDF bytes.
+
+    The output depends only on ``fields`` (``invariant=1`` fixes the creation
+    date and document ID reportlab would otherwise vary).
+    """
+    buffer = BytesIO()
+    p = canvas.Canvas(buffer, invariant=1)
+    draw_skeleton(p)
+    p.doForm(SKELETON)
+
+    # Patient Information
+    p.setFont("Helvetica", 10)
+    p.setFillColorRGB(0, 0, 0)
+    p.drawString(100, 740, f"Full Name: {fields['full_name']}")
+    p.drawString(100, 725, f"Date of Birth: {fields['date_of_birth']}")
+    p.drawString(100, 710, f"Gender: {fields['gender']}")
+    p.drawString(100, 695, f"National ID: {fields['national_id']}")
+    p.drawString(100, 680, f"Email: {fields['email']}")
+    p.drawString(100, 665, f"Phone: {fields['phone']}")
+    p.drawString(100, 650, f"Address: {fields['address']}")
+
+    # Contact Information
+    p.drawString(100, 600, f"Phone: {fields['phone']}")
+    p.drawString(100, 585, f"Email: {fields['email']}")
+    p.drawString(100, 570, f"Address: {fields['address']}")
+
+    # Medical Information (grey text, as the section title colour always carried over)
+    p.setFillColorRGB(0.3, 0.3, 0.3)
+    y_position = 520
+
+    # Medical History with text wrapping
+    medical_history = fields['medical_history'] or "Not specified"
+    if len(medical_history) > 80:
+        medical_history_lines = [medical_history[i:i+80] for i in range(0, len(medical_history), 80)]
+        p.drawString(100, y_position, "Medical History:")
+        y_position -= 15
+        for line in medical_history_lines[:3]:  # Limit to 3 lines
+            p.drawString(120, y_position, line)
+            y_position -= 15
+        if len(medical_history_lines) > 3:
+            p.drawString(120, y_position, "...")
+            y_position -= 15
+    else:
+        p.drawString(100, y_position, f"Medical History: {medical_history}")
+        y_position -= 15
+
+    # Diagnosis
+    diagnosis = fields['diagnosis'] or "Not specified"
+    if len(diagnosis) > 80:
+        diagnosis_lines = [diagnosis[i:i+80] for i in range(0, len(diagnosis), 80)]
+        p.drawString(100, y_position, "Diagnosis:")
+        y_position -= 15
+        for line in diagnosis_lines[:2]:
+            p.drawString(120, y_position, line)
+            y_position -= 15
+    else:
+        p.drawString(100, y_position, f"Diagnosis: {diagnosis}")
+        y_position -= 15
+
+    # Lab Results
+    lab_results = fields['lab_results'] or "Not specified"
+    p.drawString(100, y_position, f"Lab Results: {lab_results}")
+    y_position -= 15
+
+    # Imaging Reports
+    imaging_reports = fields['imaging_reports'] or "Not specified"
+    p.drawString(100, y_position, f"Imaging Reports: {imaging_reports}")
+    y_position -= 15
+
+    # Prescriptions
+    prescriptions = fields['prescriptions'] or "Not specified"
+    p.drawString(100, y_position, f"Prescriptions: {prescriptions}")
+    y_position -= 15
+
+    # Immunizations
+    immunizations = fields['immunizations'] or "Not specified"
+    p.drawString(100, y_position, f"Immunizations: {immunizations}")
+    y_position -= 15
+
+    # Financial Information Section
+    p.setFont("Helvetica-Bold", 12)
+    p.setFillColorRGB(0.3, 0.3, 0.3)
+    p.drawString(100, y_position - 20, "FINANCIAL INFORMATION")
+    y_position -= 40
+
+    p.setFont("Helvetica", 10)
+    p.drawString(100, y_position, f"Insurance Details: {fields['insurance_details'] or 'Not specified'}")
+    y_position -= 15
+    p.drawString(100, y_position, f"Payment Information: {fields['payment_info'] or 'Not specified'}")
+    y_position -= 15
+    p.drawString(100, y_position, f"Bank Account: {fields['bank_account'] or 'Not specified'}")
+
+    # Footer (generation time; the fixed lines are in the skeleton)
+    p.setFont("Helvetica-Oblique", 8)
+    p.setFillColorRGB(0.5, 0.5, 0.5)
+    p.drawString(100, 40, f"Generated on: {fields['generated_at']}")
+
+    p.showPage()
+    p.save()
+    pdf_value = buffer.getvalue()
+    buffer.close()
+    return pdf_value
@@ -0,0 +1,128 @@
+"""
+Token-bucket rate limiting for the OTP endpoints.
+
+Each bucket lives in the Django cache (``RATELIMIT_CACHE``), so every worker
+that shares the cache backend shares the limits. A bucket holds up to
+``capacity`` tokens and refills ``capacity`` tokens every ``period`` seconds;
+each request spends one token. Buckets are keyed per endpoint and identity
+(client IP, username, target email) as configured in ``RATELIMIT_RULES``.
+
+Views check the IP and username buckets before touching the database and the
+target-email bucket before writing an OTP or queueing mail. Rejected requests
+are counted in the cache (see ``rejection_counts``).
+"""
+import hashlib
+import logging
+import math
+import time
+
+from django.conf import settings
+from django.contrib import messages
+from django.core.cache import caches
+from django.shortcuts import render
+
+from . import locks
+from .metrics import RATELIMIT_REJECTIONS
+
+logger = logging.getLogger(__name__)
+
+KEY_PREFIX = 'ratelimit'
+_LOCK_ATTEMPTS = 5
+_LOCK_WAIT = 0.005  # seconds between attempts to take a bucket lock
+
+
+def _cache():
+    return caches[settings.RATELIMIT_CACHE]
+
+
+def client_ip(request):
+    header = settings.RATELIMIT_IP_HEADER
+    if header and request.META.get(header):
+        # X-Forwarded-For style: the proxy appends, so the left-most entry is the client.
+        return request.META[header].split(',')[0].strip()
+    return request.META.get('REMOTE_ADDR', '')
+
+
+def _bucket_key(scope, kind, value):
+    digest = hashlib.sha256(str(value).strip().lower().encode()).hexdigest()[:32]
+    return f'{KEY_PREFIX}:{scope}:{kind}:{digest}'
+
+
+def take_token(key, capacity, period, now=None):
+    """Spend one token from bucket ``key``.
+
+    Returns 0 when the request may proceed, otherwise the seconds until a token
+    will be available. The read-modify-write runs under a short lock (see
+    accounts/locks.py) so concurrent requests cannot spend the same token.
+    """
+    cache = _cache()
+    lock = f'{key}:lock'
+    if not locks.acquire(cache, lock, _LOCK_ATTEMPTS, _LOCK_WAIT):
+        return 1  # bucket is busy with a burst of parallel requests: shed this one
+
+    try:
+        now = time.time() if now is None else now
+        rate = capacity / period  # tokens per second
+        tokens, stamp = cache.get(key) or (capacity, now)
+        tokens = min(capacity, tokens + (now - stamp) * rate)
+        if tokens < 1:
+            cache.set(key, (tokens, now), timeout=math.ceil(period))
+            return (1 - tokens) / rate
+        cache.set(key, (tokens - 1, now), timeout=math.ceil(period))
+        return 0
+    finally:
+        locks.release(cache, lock)
+
+
+def check_rate_limit(request, scope, **identities):
+    """Spend a token from every bucket configured for ``scope``.
+
+    ``identities`` maps an identity kind (``username``, ``email``) to its value;
+    the ``ip`` identity is taken from the request. Returns ``None`` when the
+    request is allowed, or the Retry-After value in whole seconds.
+    """
+    if not settings.RATELIMIT_ENABLED:
+        return None
+    identities.setdefault('ip', client_ip(request))
+    retry_after = 0
+    for kind, (capacity, period) in settings.RATELIMIT_RULES.get(scope, {}).items():
+        value = identities.get(kind)
+        if not value:
+            continue
+        wait = take_token(_bucket_key(scope, kind, value), capacity, period)
+        if wait:
+            record_rejection(scope, kind)
+            retry_after = max(retry_after, wait)
+    return math.ceil(retry_after) if retry_after else None
+
+
+def record_rejection(scope, kind):
+    cache = _cache()
+    key = f'{KEY_PREFIX}:rejected:{scope}:{kind}'
+    cache.add(key, 0, timeout=None)
+    try:
+        cache.incr(key)
+    except ValueError:  # evicted between add() and incr()
+        cache.set(key, 1, timeout=None)
+    RATELIMIT_REJECTIONS.inc(scope=scope, kind=kind)
+    logger.warning("Rate limit hit: %s by %s", scope, kind)
+
+
+def rejection_counts():
+    """``{(scope, kind): rejected}`` for every configured bucket."""
+    keys = {
+        f'{KEY_PREFIX}:rejected:{scope}:{kind}': (scope, kind)
+        for scope, rules in settings.RATELIMIT_RULES.items()
+        for kind in rules
+    }
+    found = _cache().get_many(list(keys))
+    return {keys[key]: found.get(key, 0) for key in keys}
+
+
+def rate_limited_response(request, template, retry_after, context=None):
+    """Re-render ``template`` with a 429 status and a Retry-After header."""
+    minutes = max(1, math.ceil(retry_after / 60))
+    messages.error(request, f"Too many attempts. Please try again in {minutes} minute(s).")
+    response = render(request, template, context, status=429)
+    response['Retry-After'] = str(retry_after)
+    return response
@@ -0,0 +1,189 @@
+"""
+Background PDF render pipeline for new patient records.
+
+Views only insert the ``Patient`` row (``pdf_status='queued'``). The
+``render_pdfs`` management command claims queued rows, renders them in a
+process pool, stores the PDF, issues the access OTP and queues the uploader
+notification through the email outbox.
+"""
+import logging
+import time
+from concurrent.futures import as_completed
+from concurrent.futures.process import BrokenProcessPool
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Patient
+from .fragments import bump, user_scope
+from .emails import send_templated_mail
+from .metrics import PDF_CACHE, PDF_RENDER_SECONDS
+from .pdf import pdf_content_hash, patient_pdf_fields, patient_pdf_filename, render_patient_pdf
+
+logger = logging.getLogger(__name__)
+
+
+def claim_render_jobs(limit=None):
+    """Move up to ``limit`` abandoned or queued patients to 'rendering'."""
+    limit = limit or settings.PDF_RENDER_BATCH_SIZE
+    now = timezone.now()
+    stale = now - timedelta(seconds=settings.PDF_RENDER_LEASE_SECONDS)
+    # Two range scans on patient_render_queue_idx (pdf_status, uploaded_at, id),
+    # each already in order: re-queue abandoned jobs first, then new ones.
+    lanes = (
+        Q(pdf_status='rendering', pdf_claimed_at__lt=stale),
+        Q(pdf_status='queued'),
+    )
+    # A lease that ran out counts as an attempt, so a record that kills its
+    # worker is failed after PDF_RENDER_MAX_ATTEMPTS instead of reclaimed forever.
+    claims = (
+        dict(pdf_claimed_at=now, pdf_attempts=F('pdf_attempts') + 1,
+             pdf_error='Lease expired: the worker rendering it stopped.'),
+        dict(pdf_status='rendering', pdf_claimed_at=now),
+    )
+    ids = []
+    for lane, claim in zip(lanes, claims):
+        candidates = (
+            Patient.objects.filter(lane)
+            .order_by('uploaded_at', 'id')
+            .values_list('id', flat=True)[:limit - len(ids)]
+        )
+        # The UPDATE repeats the lane's condition, so of two workers that read
+        # the same row only the one whose UPDATE changes it owns the job (row
+        # locks are not available on SQLite).
+        ids += [pk for pk in candidates if Patient.objects.filter(lane, id=pk).update(**claim)]
+        if len(ids) >= limit:
+            break
+    if ids:
+        failed = fail_exhausted(ids)
+        ids = [pk for pk in ids if pk not in failed]
+    if not ids:
+        return []
+    patients = list(Patient.objects.filter(id__in=ids).select_related('uploaded_by'))
+    bump(*{user_scope(patient.uploaded_by_id) for patient in patients})  # update() sends no signals
+    return patients
+
+
+def run_render_batch(executor, limit=None):
+    """Render one batch of claimed patients on ``executor``. Returns the batch size."""
+    patients = claim_render_jobs(limit)
+    futures = {}
+    try:
+        for patient in patients:
+            fields = patient_pdf_fields(patient)
+            digest = pdf_content_hash(fields)
+            if reuse_cached_pdf(patient, digest):
+                continue
+            PDF_CACHE.inc(result='rendered')
+            futures[executor.submit(render_timed, fields)] = (patient, digest)
+        for future in as_completed(futures):
+            patient, digest = futures[future]
+            try:
+                pdf_value, seconds = future.result()
+            except BrokenProcessPool:
+                raise
+            except Exception as exc:
+                logger.exception("PDF render failed for patient %s", patient.id)
+                Patient.objects.filter(id=patient.id).update(
+                    pdf_status='failed', pdf_claimed_at=None, pdf_error=repr(exc)[:2000],
+                )
+                bump(user_scope(patient.uploaded_by_id))
+                continue
+            PDF_RENDER_SECONDS.observe(seconds)
+            finish_render(patient, digest, pdf_value)
+    except BrokenProcessPool:
+        # A pool process died (segfault, OOM kill) and took the pool with it:
+        # no job of this batch can finish here, so hand the unfinished ones back.
+        release_render_jobs(patients, 'Render pool broke: a worker process died.')
+        raise
+    return len(patients)
+
+
+def release_render_jobs(patients, error):
+    """Re-queue the jobs of ``patients`` this worker still holds, counting the lost
+    render as an attempt."""
+    ids = [patient.id for patient in patients]
+    Patient.objects.filter(id__in=ids, pdf_status='rendering').update(
+        pdf_status='queued', pdf_claimed_at=None, pdf_attempts=F('pdf_attempts') + 1, pdf_error=error,
+    )
+    fail_exhausted(ids)
+    bump(*{user_scope(patient.uploaded_by_id) for patient in patients})
+
+
+def fail_exhausted(ids):
+    """Mark the unfinished jobs among ``ids`` that used up PDF_RENDER_MAX_ATTEMPTS
+    failed; their ``pdf_error`` keeps the reason of the last loss. Returns their ids."""
+    exhausted = Patient.objects.filter(
+        id__in=ids, pdf_status__in=('queued', 'rendering'), pdf_attempts__gte=settings.PDF_RENDER_MAX_ATTEMPTS,
+    )
+    failed = dict(exhausted.values_list('id', 'uploaded_by_id'))
+    if failed:
+        Patient.objects.filter(id__in=failed).update(pdf_status='failed', pdf_claimed_at=None)
+        bump(*map(user_scope, set(failed.values())))
+        logger.error("PDF renders for patients %s failed after %s attempts",
+                     sorted(failed), settings.PDF_RENDER_MAX_ATTEMPTS)
+    return set(failed)
+
+
+def reuse_cached_pdf(patient, digest):
+    """Finish ``patient`` without rendering when a PDF of the same content is stored."""
+    if patient.pdf_hash == digest and patient.pdf_file and patient.pdf_file.storage.exists(patient.pdf_file.name):
+        PDF_CACHE.inc(result='kept')
+        finish_render(patient, digest)
+        return True
+    source = (
+        Patient.objects.filter(pdf_hash=digest, pdf_status='ready')
+        .exclude(id=patient.id).exclude(pdf_file='').only('pdf_file').first()
+    )
+    if source is None:
+        return False
+    try:
+        with source.pdf_file.open('rb') as fh:
+            pdf_value = fh.read()
+    except OSError:
+        return False
+    PDF_CACHE.inc(result='copied')
+    finish_render(patient, digest, pdf_value)
+    return True
+
+
+def render_timed(fields):
+    """Runs in the pool: render and report the time spent in reportlab itself."""
+    start = time.perf_counter()
+    pdf_value = render_patient_pdf(fields)
+    return pdf_value, time.perf_counter() - start
+
+
+def finish_render(patient, digest, pdf_value=None):
+    """Store the rendered PDF (``None``: keep the current file), mark the record
+    ready and notify the uploader."""
+    if pdf_value is not None:
+        previous = patient.pdf_file.name
+        patient.pdf_file.save(patient_pdf_filename(patient), ContentFile(pdf_value), save=False)
+        if previous and previous != patient.pdf_file.name:
+            patient.pdf_file.storage.delete(previous)
+    patient.pdf_hash = digest
+    patient.pdf_status = 'ready'
+    patient.pdf_claimed_at = None
+    patient.pdf_attempts = 0
+    patient.pdf_error = ''
+    patient.save(update_fields=['pdf_file', 'pdf_hash', 'pdf_status', 'pdf_claimed_at', 'pdf_attempts', 'pdf_error'])
+
+    otp = patient.generate_otp()
+    notify_uploader(patient, otp)
+
+
+def notify_uploader(patient, otp):
+    """Send the 'record created' email with the access OTP to the uploader."""
+    send_templated_mail(
+        'patient_record', [patient.uploaded_by.email],
+        username=patient.uploaded_by.username,
+        patient_name=patient.full_name,
+        date_of_birth=patient.date_of_birth,
+        patient_id=patient.id,
+        timestamp=timezone.now().strftime('%B %d, %Y at %H:%M'),
+        otp=otp,
+    )
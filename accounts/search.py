@@ -0,0 +1,209 @@
+"""
+Full-text search over the Patient medical fields.
+
+The medical columns are encrypted (accounts/fields.py), so the database
+cannot index their text. The application feeds a blind index instead: each
+word of an indexed field is normalised (``search_key``: case-folded, accents
+stripped) and every prefix of PREFIX_MIN to PREFIX_MAX characters is stored
+as a keyed hash (``crypto.blind_token``). No word of the text is stored; a
+query hashes its terms the same way and matches them exactly, which keeps
+"every word as a prefix" ("diab insul" finds "diabetes ... insulin"). Equal
+words hash equally, so the index still shows how often a hidden term occurs.
+
+SQLite: an FTS5 table (``accounts_patient_fts``) with the uploader id and
+one column per field; the owner filter is part of the MATCH and results are
+ranked with bm25. PostgreSQL: a ``search_vector`` tsvector column (weighted
+per field) with a GIN index, ranked with ts_rank. Diagnosis and
+prescriptions weigh more than the notes on both.
+
+``index_patients`` / ``unindex_patients`` run from the Patient post_save /
+post_delete receivers (accounts/signals.py); code that writes without
+signals (bulk_create, raw DELETE) calls them itself. ``install_search_index``
+is idempotent and rebuilds the index whenever it had to create it. The
+hashes depend on the first PHI_ENCRYPTION_KEYS entry: after putting a new
+key in front, run ``rebuild_search_index()``.
+"""
+import functools
+import re
+
+from django.conf import settings
+from django.db import connection
+
+from . import crypto
+from .models import Patient, search_key
+
+SEARCH_FIELDS = ('medical_history', 'diagnosis', 'lab_results', 'imaging_reports', 'prescriptions')
+FTS_TABLE = 'accounts_patient_fts'
+FTS_COLUMNS = ('uploaded_by_id',) + SEARCH_FIELDS
+# bm25 column weights, in FTS_COLUMNS order (the owner column never counts)
+FTS_WEIGHTS = (0.0, 1.0, 3.0, 1.0, 1.0, 2.0)
+# tsvector weight per field on PostgreSQL
+PG_WEIGHTS = {'diagnosis': 'A', 'prescriptions': 'B', 'medical_history': 'C', 'lab_results': 'D', 'imaging_reports': 'D'}
+MAX_TERMS = 8
+PREFIX_MIN = 2
+PREFIX_MAX = 12    # longer query terms are cut to this length
+INDEX_BATCH_SIZE = 1000
+
+_TERM_RE = re.compile(r'\w+')
+_LEGACY_TRIGGERS = ('_ai', '_ad', '_au')  # the plaintext external-content index of 0016
+
+
+# ---------------- Blind tokens ----------------
+def search_terms(text):
+    """Normalised words of ``text`` (at most MAX_TERMS) that are long enough to search for."""
+    return [term for term in _TERM_RE.findall(search_key(text)) if len(term) >= PREFIX_MIN][:MAX_TERMS]
+
+
+@functools.lru_cache(maxsize=65536)
+def _blind(secret, word):
+    return crypto.blind_token(word)
+
+
+def _token(word):
+    return _blind(settings.PHI_ENCRYPTION_KEYS[0], word[:PREFIX_MAX])
+
+
+def index_text(text):
+    """The hashed prefixes of every word of ``text``, space separated (one per occurrence, for ranking)."""
+    return ' '.join(
+        _token(word[:n])
+        for word in _TERM_RE.findall(search_key(text or ''))
+        for n in range(PREFIX_MIN, min(len(word), PREFIX_MAX) + 1)
+    )
+
+
+# ---------------- Index DDL ----------------
+def install_search_index(conn=None):
+    """Create whatever part of the search index is missing (replacing the plaintext
+    index of older versions) and fill it. Returns True if anything was created."""
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            for suffix in _LEGACY_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}{suffix}")
+            cursor.execute("SELECT sql FROM sqlite_master WHERE name = %s", [FTS_TABLE])
+            row = cursor.fetchone()
+            if row and 'content=' not in row[0]:
+                return False
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+            cursor.execute(f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({', '.join(FTS_COLUMNS)}, tokenize='ascii')")
+        elif conn.vendor == 'postgresql':
+            cursor.execute(
+                "SELECT is_generated FROM information_schema.columns "
+                "WHERE table_name = 'accounts_patient' AND column_name = 'search_vector'"
+            )
+            row = cursor.fetchone()
+            if row and row[0] == 'NEVER':
+                return False
+            cursor.execute("DROP INDEX IF EXISTS accounts_patient_search_gin")
+            cursor.execute("ALTER TABLE accounts_patient DROP COLUMN IF EXISTS search_vector")
+            cursor.execute("ALTER TABLE accounts_patient ADD COLUMN search_vector tsvector")
+            cursor.execute("CREATE INDEX accounts_patient_search_gin ON accounts_patient USING GIN (search_vector)")
+        else:
+            return False
+    rebuild_search_index(conn)
+    return True
+
+
+def drop_search_index(conn=None):
+    conn = conn or connection
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            for suffix in _LEGACY_TRIGGERS:
+                cursor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}{suffix}")
+            cursor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+        elif conn.vendor == 'postgresql':
+            cursor.execute("DROP INDEX IF EXISTS accounts_patient_search_gin")
+            cursor.execute("ALTER TABLE accounts_patient DROP COLUMN IF EXISTS search_vector")
+
+
+# ---------------- Index maintenance ----------------
+def index_patients(patients, conn=None):
+    """(Re)index ``patients``; reads (and so decrypts) their SEARCH_FIELDS."""
+    conn = conn or connection
+    rows = [(patient.pk, patient.uploaded_by_id, *(index_text(getattr(patient, name)) for name in SEARCH_FIELDS))
+            for patient in patients]
+    if not rows:
+        return
+    with conn.cursor() as cursor:
+        if conn.vendor == 'sqlite':
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(rows))})",
+                           [row[0] for row in rows])
+            cursor.executemany(
+                f"INSERT INTO {FTS_TABLE}(rowid, {', '.join(FTS_COLUMNS)}) "
+                f"VALUES ({', '.join(['%s'] * (len(FTS_COLUMNS) + 1))})", rows,
+            )
+        elif conn.vendor == 'postgresql':
+            vector = ' || '.join(f"setweight(to_tsvector('simple', %s), '{PG_WEIGHTS[name]}')" for name in SEARCH_FIELDS)
+            cursor.executemany(f"UPDATE accounts_patient SET search_vector = {vector} WHERE id = %s",
+                               [(*row[2:], row[0]) for row in rows])
+
+
+def unindex_patients(ids, conn=None):
+    """Remove deleted patients from the index (PostgreSQL's vector goes with the row)."""
+    conn = conn or connection
+    ids = list(ids)
+    if conn.vendor != 'sqlite':
+        return
+    with conn.cursor() as cursor:
+        for start in range(0, len(ids), INDEX_BATCH_SIZE):
+            batch = ids[start:start + INDEX_BATCH_SIZE]
+            cursor.execute(f"DELETE FROM {FTS_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(batch))})", batch)
+
+
+def rebuild_search_index(conn=None):
+    conn = conn or connection
+    if conn.vendor == 'sqlite':
+        with conn.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {FTS_TABLE}")
+    patients = Patient.objects.using(conn.alias).only('id', 'uploaded_by_id', *SEARCH_FIELDS).order_by()
+    batch = []
+    for patient in patients.iterator(chunk_size=INDEX_BATCH_SIZE):
+        batch.append(patient)
+        if len(batch) == INDEX_BATCH_SIZE:
+            index_patients(batch, conn)
+            batch = []
+    index_patients(batch, conn)
+
+
+# ---------------- Queries ----------------
+def ranked_ids(user, text, limit=None):
+    """``[(patient id, rank)]`` for ``user``'s patients matching every term of ``text``,
+    best (highest rank) first."""
+    tokens = [_token(term) for term in search_terms(text)]
+    if not tokens:
+        return []
+    limit = limit or settings.SEARCH_RESULTS_LIMIT
+    if connection.vendor == 'sqlite':
+        weights = ', '.join(map(str, FTS_WEIGHTS))
+        # bm25() is lower-is-better; negated so ``rank`` means the same on both backends
+        sql = (f"SELECT rowid, -bm25({FTS_TABLE}, {weights}) AS rank FROM {FTS_TABLE} "
+               f"WHERE {FTS_TABLE} MATCH %s ORDER BY rank DESC LIMIT %s")
+        words = ' AND '.join(f'"{token}"' for token in tokens)
+        params = [f'uploaded_by_id : "{user.pk}" AND {{{" ".join(SEARCH_FIELDS)}}} : ({words})', limit]
+    elif connection.vendor == 'postgresql':
+        sql = ("SELECT id, ts_rank(search_vector, query) AS rank "
+               "FROM accounts_patient, to_tsquery('simple', %s) query "
+               "WHERE uploaded_by_id = %s AND search_vector @@ query ORDER BY rank DESC LIMIT %s")
+        params = [' & '.join(tokens), user.pk, limit]
+    else:
+        raise NotImplementedError(f"Full-text search is not available on {connection.vendor}.")
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        return cursor.fetchall()
+
+
+def search_patients(user, text, limit=None, fields=('id', 'full_name', 'date_of_birth', 'email', 'uploaded_at')):
+    """``user``'s patients matching ``text``, best first, each with ``search_rank`` set.
+
+    Only ``fields`` are loaded; the medical text stays in the database.
+    """
+    ranked = ranked_ids(user, text, limit)
+    found = Patient.objects.only(*fields).in_bulk([pk for pk, _ in ranked])
+    results = []
+    for pk, rank in ranked:
+        patient = found.get(pk)
+        if patient is not None:
+            patient.search_rank = rank
+            results.append(patient)
+    return results
@@ -0,0 +1,155 @@
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.models.signals import post_delete, post_init, post_migrate, post_save
+from django.dispatch import receiver
+
+from . import fragments
+from .backends import invalidate_cached_user
+from .models import CustomUser, DashboardCounter, FileBlob, Patient, PatientFile
+from .search import SEARCH_FIELDS, index_patients, install_search_index, unindex_patients
+
+
+_UNKNOWN = object()
+
+
+def user_counter(role):
+    return f'users.{role}'
+
+
+# ---------------- Dashboard counters ----------------
+@receiver(post_init, sender=CustomUser)
+def remember_counted_role(sender, instance, **kwargs):
+    # __dict__ lookup so a deferred 'role' never triggers a query
+    instance._counted_role = instance.__dict__.get('role', _UNKNOWN) if instance.pk else None
+
+
+@receiver(post_save, sender=CustomUser)
+def count_user_saved(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    previous = None if created else getattr(instance, '_counted_role', _UNKNOWN)
+    if previous is _UNKNOWN:
+        pass  # role was never loaded; reconcile_counters repairs any drift
+    elif previous != instance.role:
+        if previous:
+            DashboardCounter.incr(user_counter(previous), -1)
+        DashboardCounter.incr(user_counter(instance.role))
+    instance._counted_role = instance.role
+
+
+@receiver(post_delete, sender=CustomUser)
+def count_user_deleted(sender, instance, **kwargs):
+    DashboardCounter.incr(user_counter(instance.role), -1)
+
+
+@receiver(post_save, sender=Patient)
+def count_patient_saved(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        DashboardCounter.incr('patients')
+
+
+@receiver(post_delete, sender=Patient)
+def count_patient_deleted(sender, instance, **kwargs):
+    DashboardCounter.incr('patients', -1)
+
+
+# ---------------- Blob reference counts ----------------
+@receiver(post_delete, sender=PatientFile)
+def release_patient_file_blob(sender, instance, **kwargs):
+    if instance.blob_id:
+        FileBlob.release(instance.blob_id)
+
+
+# ---------------- Cached request.user ----------------
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_cache(sender, instance, **kwargs):
+    invalidate_cached_user(instance.pk)
+
+
+# ---------------- Dashboard fragment cache ----------------
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def invalidate_patient_fragments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fragments.bump(fragments.user_scope(instance.uploaded_by_id), 'patients')
+
+
+@receiver(post_save, sender=PatientFile)
+@receiver(post_delete, sender=PatientFile)
+def invalidate_patient_file_fragments(sender, instance, raw=False, **kwargs):
+    if not raw:
+        fragments.bump(fragments.user_scope(instance.doctor_id))
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def invalidate_user_fragments(sender, instance, raw=False, **kwargs):
+    # the admin's staff tables show last_login, so every login counts
+    if not raw:
+        fragments.bump(fragments.user_scope(instance), 'staff')
+
+
+@receiver(post_migrate)
+def reset_fragments(sender, app_config, **kwargs):
+    if app_config.label == 'accounts':
+        fragments.reset()
+
+
+# ---------------- SQLite connection tuning ----------------
+@receiver(connection_created)
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """Apply SQLITE_PRAGMAS (busy_timeout ...) to every new SQLite connection, and
+    SQLITE_WAL_PRAGMAS as well when the database is in WAL mode."""
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        pragmas = dict(settings.SQLITE_PRAGMAS)
+        cursor.execute('PRAGMA journal_mode')  # reading it changes nothing
+        if cursor.fetchone()[0] == 'wal':
+            pragmas.update(settings.SQLITE_WAL_PRAGMAS)
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name} = {value}')
+
+
+def set_journal_mode(connection, mode):
+    """Switch the SQLite database to journal ``mode``, which the database file keeps.
+
+    Returns ``(previous mode, current mode)``; the file is only written when
+    the mode changes.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute('PRAGMA journal_mode')
+        previous = current = cursor.fetchone()[0]
+        if previous != mode.lower():
+            cursor.execute(f'PRAGMA journal_mode = {mode}')
+            current = cursor.fetchone()[0]
+    return previous, current
+
+
+# ---------------- Full-text search index ----------------
+SEARCH_MIGRATION = ('accounts', '0018_encrypt_patient_phi')
+
+
+@receiver(post_save, sender=Patient)
+def index_patient(sender, instance, update_fields=None, **kwargs):
+    # pdf_status / access_email updates leave the indexed text alone
+    if update_fields is None or set(update_fields) & set(SEARCH_FIELDS + ('uploaded_by',)):
+        index_patients([instance])
+
+
+@receiver(post_delete, sender=Patient)
+def unindex_patient(sender, instance, **kwargs):
+    unindex_patients([instance.pk])
+
+
+@receiver(post_migrate)
+def restore_search_index(sender, app_config, using, **kwargs):
+    """Create (and fill) the search index if the database lacks it or still has the plaintext one."""
+    if app_config.label != 'accounts':
+        return
+    conn = connections[using]
+    if SEARCH_MIGRATION in MigrationRecorder(conn).applied_migrations():
+        install_search_index(conn)
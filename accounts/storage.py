@@ -0,0 +1,140 @@
+"""
+Encrypted, content-addressed storage for patient files.
+
+``EncryptedFileSystemStorage`` encrypts every file as it is written, chunk by
+chunk (accounts/streamcrypto.py), and ``open()`` returns a seekable file that
+decrypts on the fly, so neither side ever holds the whole file or writes
+plaintext to disk. ``size()`` is the plaintext size. Files stored before
+encryption are read as they are until ``manage.py encrypt_stored_files``
+rewrites them. ``path()`` points at ciphertext: such files cannot be handed
+to the web server (see accounts/downloads.py).
+
+Uploaded patient files are also stored once under ``blobs/<aa>/<bb>/<sha256>``
+(the digest of the plaintext, with no extension: the same bytes uploaded under
+two names are one blob); saving bytes that are already stored writes nothing
+and returns the existing name. Which rows use a blob is tracked by
+``FileBlob.ref_count`` (see accounts.models); the name a file was uploaded as
+is kept on its row.
+"""
+import hashlib
+import os
+import re
+
+from django.core.files import File
+from django.core.files.storage import FileSystemStorage
+
+from .streamcrypto import EncryptedWriter, is_encrypted, open_stored
+
+BLOB_PREFIX = 'blobs'
+HASH_BLOCK_SIZE = 64 * 1024
+_BLOB_NAME_RE = re.compile(rf'^{BLOB_PREFIX}/[0-9a-f]{{2}}/[0-9a-f]{{2}}/([0-9a-f]{{64}})(\.[\w.-]*)?$')
+
+
+def blob_name(sha256):
+    return f'{BLOB_PREFIX}/{sha256[:2]}/{sha256[2:4]}/{sha256}'
+
+
+def blob_sha(name):
+    """Return the SHA-256 encoded in a blob name (with or without the extension
+    blobs were once stored with), or ``None`` for legacy names."""
+    match = _BLOB_NAME_RE.match(name or '')
+    return match.group(1) if match else None
+
+
+def content_sha256(content):
+    """The digest attached by the hashing upload handlers, or one computed now."""
+    digest = getattr(content, 'sha256', None)
+    if digest:
+        return digest
+    hasher = hashlib.sha256()
+    for chunk in content.chunks(HASH_BLOCK_SIZE):  # chunks() rewinds first
+        hasher.update(chunk)
+    content.seek(0)
+    content.sha256 = hasher.hexdigest()
+    return content.sha256
+
+
+class EncryptedFileSystemStorage(FileSystemStorage):
+    encrypted = True
+
+    def _open(self, name, mode='rb'):
+        if mode not in ('r', 'rb'):
+            raise ValueError("Encrypted files are opened read-only; save() writes them.")
+        return File(open_stored(open(self.path(name), 'rb')), name)
+
+    def _save(self, name, content):
+        # FileSystemStorage._save() without its move of temporary uploads: every byte goes through the cipher
+        while True:
+            full_path = self.path(name)
+            os.makedirs(os.path.dirname(full_path), mode=self.directory_permissions_mode or 0o777, exist_ok=True)
+            try:
+                fd = os.open(full_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0), 0o666)
+            except FileExistsError:
+                name = self.get_available_name(name)
+                continue
+            try:
+                with os.fdopen(fd, 'wb') as raw, EncryptedWriter(raw) as writer:
+                    for chunk in content.chunks():
+                        writer.write(chunk)
+            except BaseException:
+                os.remove(full_path)
+                raise
+            break
+        if self.file_permissions_mode is not None:
+            os.chmod(full_path, self.file_permissions_mode)
+        return str(name).replace('\\', '/')
+
+    def size(self, name):
+        with self.open(name) as fh:
+            return fh.size
+
+    def stored_encrypted(self, name):
+        with open(self.path(name), 'rb') as raw:
+            return is_encrypted(raw)
+
+    def encrypt_in_place(self, name):
+        """Encrypt a file stored before encryption; returns False if it already was."""
+        full_path = self.path(name)
+        with open(full_path, 'rb') as source:
+            if is_encrypted(source):
+                return False
+            staging = f'{full_path}.encrypting'
+            try:
+                with open(staging, 'wb') as raw, EncryptedWriter(raw) as writer:
+                    for chunk in File(source).chunks():
+                        writer.write(chunk)
+                if self.file_permissions_mode is not None:
+                    os.chmod(staging, self.file_permissions_mode)
+                os.replace(staging, full_path)
+            except BaseException:
+                if os.path.exists(staging):
+                    os.remove(staging)
+                raise
+        return True
+
+
+class ContentAddressedStorage(EncryptedFileSystemStorage):
+    def get_available_name(self, name, max_length=None):
+        # Blob names are decided in _save() from the content and are never suffixed.
+        # FileSystemStorage._save() asks for a new name when it loses a creation
+        # race; for a blob that means the same bytes are already there.
+        if blob_sha(name) and self.exists(name):
+            raise FileExistsError(name)
+        return name
+
+    def _save(self, name, content):
+        target = blob_name(content_sha256(content))
+        if self.exists(target):
+            return target  # same bytes already stored: no write at all
+        try:
+            return super()._save(target, content)
+        except FileExistsError:
+            return target
+
+
+def patient_file_storage():
+    return ContentAddressedStorage()
+
+
+def patient_pdf_storage():
+    return EncryptedFileSystemStorage()
@@ -0,0 +1,230 @@
+"""
+Chunked authenticated encryption of file contents (AES-256-GCM).
+
+An encrypted stream is a header followed by sealed chunks::
+
+    header  b'PHF1' | key id (8 ASCII) | chunk size (uint32) | file id (8 random bytes)
+    chunk   nonce (12 random bytes) | ciphertext of chunk-size plaintext bytes | 16-byte tag
+
+Chunk ``i`` is sealed with the header, ``i`` and a final flag as associated
+data. Its nonce is drawn at random each time it is sealed, never derived from
+its position: a resumed upload seals its last chunk again, and one key and
+nonce must never seal two different plaintexts. Every chunk but the last
+holds exactly chunk-size bytes and the last one fewer (possibly none), so the
+plaintext size follows from the stored size, and a stream that was cut short,
+reordered or spliced from two files does not decrypt.
+
+``EncryptedWriter`` encrypts while it is written to, holding at most one
+chunk of plaintext. ``EncryptedReader`` is a seekable file object that
+decrypts only the chunk under the read position: a ranged read costs the
+chunks it covers, whatever the size of the file. Keys come from
+``crypto.keyring('patient-file')`` (PHI_ENCRYPTION_KEYS), or from
+``ephemeral_keys()`` for data that must not outlive the process.
+"""
+import io
+import os
+import secrets
+import struct
+
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from django.conf import settings
+
+from . import crypto
+from .crypto import DecryptionError
+
+MAGIC = b'PHF1'
+HEADER_SIZE = 24
+NONCE_SIZE = 12
+TAG_SIZE = 16
+OVERHEAD = NONCE_SIZE + TAG_SIZE  # stored bytes per chunk beyond its plaintext
+MAX_CHUNKS = 2 ** 32
+
+
+def file_keys():
+    return crypto.keyring('patient-file')
+
+
+def ephemeral_keys():
+    """A random key held only in memory, in the shape of ``file_keys()``."""
+    key_id = secrets.token_hex(4)
+    return key_id, {key_id: AESGCM(AESGCM.generate_key(bit_length=256))}
+
+
+def _aad(header, index, final):
+    return header + struct.pack('>I?', index, final)
+
+
+def _parse_header(header, ciphers):
+    """``(cipher, chunk size)`` of a stream header."""
+    if len(header) != HEADER_SIZE or not header.startswith(MAGIC):
+        raise DecryptionError("Not an encrypted file.")
+    key_id = header[4:12].decode('ascii', 'replace')
+    cipher = ciphers.get(key_id)
+    if cipher is None:
+        raise DecryptionError(f"No key with id {key_id} in PHI_ENCRYPTION_KEYS.")
+    return cipher, struct.unpack('>I', header[12:16])[0]
+
+
+def _seal(cipher, header, index, final, data):
+    nonce = os.urandom(NONCE_SIZE)
+    return nonce + cipher.encrypt(nonce, data, _aad(header, index, final))
+
+
+def _unseal(cipher, header, index, final, sealed):
+    try:
+        return cipher.decrypt(sealed[:NONCE_SIZE], sealed[NONCE_SIZE:], _aad(header, index, final))
+    except InvalidTag:
+        raise DecryptionError(f"Chunk {index} does not decrypt (wrong key, altered or truncated).")
+
+
+def is_encrypted(raw):
+    """Whether the binary file ``raw`` starts with a stream header (it is rewound)."""
+    raw.seek(0)
+    magic = raw.read(len(MAGIC))
+    raw.seek(0)
+    return magic == MAGIC
+
+
+def open_stored(raw, keys=None):
+    """``raw`` decrypted if it holds a stream, else as it is (stored before encryption)."""
+    return EncryptedReader(raw, keys) if is_encrypted(raw) else raw
+
+
+class EncryptedWriter:
+    """Encrypt what is written into the binary file ``raw``.
+
+    ``close()`` seals the last chunk but leaves ``raw`` open. Leaving the
+    ``with`` block on an exception does not seal it, so a partial stream
+    never reads back as a complete one.
+    """
+
+    def __init__(self, raw, keys=None, chunk_size=None):
+        key_id, ciphers = keys or file_keys()
+        chunk_size = chunk_size or settings.ENCRYPTED_FILE_CHUNK_SIZE
+        header = MAGIC + key_id.encode('ascii') + struct.pack('>I', chunk_size) + os.urandom(8)
+        raw.write(header)
+        self._start(raw, ciphers[key_id], header, 0)
+
+    @classmethod
+    def resume(cls, raw, offset, keys=None):
+        """A writer that appends to the stream in ``raw`` (open 'r+b') after its
+        first ``offset`` plaintext bytes; anything stored past them is dropped."""
+        raw.seek(0)
+        header = raw.read(HEADER_SIZE)
+        cipher, chunk_size = _parse_header(header, (keys or file_keys())[1])
+        index, kept = divmod(offset, chunk_size)
+        position = HEADER_SIZE + index * (chunk_size + OVERHEAD)
+        carried = b''
+        if kept:
+            raw.seek(position)
+            sealed = raw.read(chunk_size + OVERHEAD)
+            # the last chunk of the close() that acknowledged ``offset``, or a
+            # full chunk of a later write that was interrupted; either way it is
+            # sealed again below under a fresh nonce
+            try:
+                carried = _unseal(cipher, header, index, True, sealed[:kept + OVERHEAD])
+            except DecryptionError:
+                carried = _unseal(cipher, header, index, False, sealed)[:kept]
+        raw.seek(position)
+        raw.truncate()
+        writer = cls.__new__(cls)
+        writer._start(raw, cipher, header, index)
+        writer._buffer += carried
+        return writer
+
+    def _start(self, raw, cipher, header, index):
+        self._raw = raw
+        self._cipher = cipher
+        self._header = header
+        self._chunk_size = struct.unpack('>I', header[12:16])[0]
+        self._index = index
+        self._buffer = bytearray()
+        self.closed = False
+
+    def _seal(self, data, final):
+        if self._index >= MAX_CHUNKS:
+            raise ValueError("File is too large for its chunk size.")
+        self._raw.write(_seal(self._cipher, self._header, self._index, final, data))
+        self._index += 1
+
+    def write(self, data):
+        self._buffer += data
+        # a full chunk is never the last one: the last one holds fewer bytes
+        while len(self._buffer) >= self._chunk_size:
+            self._seal(bytes(self._buffer[:self._chunk_size]), False)
+            del self._buffer[:self._chunk_size]
+        return len(data)
+
+    def close(self):
+        if not self.closed:
+            self._seal(bytes(self._buffer), True)
+            self._buffer = bytearray()
+            self.closed = True
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+
+
+class EncryptedReader(io.RawIOBase):
+    """Read-only, seekable plaintext view of the stream in ``raw`` (closed with it)."""
+
+    def __init__(self, raw, keys=None):
+        super().__init__()
+        self._raw = raw
+        raw.seek(0)
+        self._header = raw.read(HEADER_SIZE)
+        self._cipher, self._chunk_size = _parse_header(self._header, (keys or file_keys())[1])
+        body = raw.seek(0, io.SEEK_END) - HEADER_SIZE
+        full, last = divmod(body - OVERHEAD, self._chunk_size + OVERHEAD)
+        if body < OVERHEAD or last >= self._chunk_size:
+            raise DecryptionError("Encrypted file is truncated.")
+        self._chunks = full + 1
+        self.size = full * self._chunk_size + last
+        self._position = 0
+        self._loaded, self._plain = None, b''
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._position
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        base = {io.SEEK_SET: 0, io.SEEK_CUR: self._position, io.SEEK_END: self.size}[whence]
+        if base + offset < 0:
+            raise ValueError("Negative seek position.")
+        self._position = base + offset
+        return self._position
+
+    def _chunk(self, index):
+        if index != self._loaded:
+            final = index == self._chunks - 1
+            length = self.size - index * self._chunk_size if final else self._chunk_size
+            self._raw.seek(HEADER_SIZE + index * (self._chunk_size + OVERHEAD))
+            sealed = self._raw.read(length + OVERHEAD)
+            self._plain = _unseal(self._cipher, self._header, index, final, sealed)
+            self._loaded = index
+        return self._plain
+
+    def readinto(self, buffer):
+        view, filled = memoryview(buffer).cast('B'), 0
+        while filled < len(view) and self._position < self.size:
+            index, offset = divmod(self._position, self._chunk_size)
+            data = self._chunk(index)[offset:offset + len(view) - filled]
+            view[filled:filled + len(data)] = data
+            filled += len(data)
+            self._position += len(data)
+        return filled
+
+    def close(self):
+        if not self.closed:
+            self._raw.close()
+        super().close()
@@ -1,3 +1,1098 @@
-from django.test import TestCase
+import io
+import itertools
+import json
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from concurrent.futures import Future
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import closing
+from datetime import timedelta
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.filebased import FileBasedCache
+from django.core import mail
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection
+from django.db.models import Count, Q
+from django.db.models.query import QuerySet
+from django.test import RequestFactory, SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from . import chunked_upload, counters, crypto, emails, fragments, locks, metrics, otp, outbox, ratelimit, streamcrypto
+from .bundles import bundle_entries, iter_zip
+from .downloads import parse_range, serve_file
+from .exports import iter_rows
+from .fields import Ciphertext
+from .forms import PatientFileFilterForm, PatientFilterForm
+from .render_jobs import claim_render_jobs, run_render_batch
+from .models import (
+    CustomUser, DashboardCounter, EmailOutbox, FileBlob, Patient, PatientFile, PatientImport, UploadSession,
+    search_key,
+)
+from .search import search_patients
+from .signals import apply_sqlite_pragmas
+from .storage import EncryptedFileSystemStorage
+
+# PHI_ENCRYPTION_KEYS has no default; every test class gets a throwaway key, and
+# in-memory caches instead of the file caches next to the project
+test_settings = override_settings(
+    PHI_ENCRYPTION_KEYS=['test-only-phi-key'],
+    CACHES={
+        alias: {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': f'test-{alias}'}
+        for alias in settings.CACHES
+    },
+)
+
+
+@test_settings
+class QueryPlanTests(TestCase):
+    """EXPLAIN the dashboard and worker hot queries and fail if one of them
+    falls back to a full table scan or sorts its rows in a temporary B-tree.
+
+    Runs on SQLite (EXPLAIN QUERY PLAN) and PostgreSQL (EXPLAIN (FORMAT JSON)
+    with sequential scans and explicit sorts disabled, so a tiny test table
+    still shows whether an index *can* serve the query).
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = CustomUser.objects.create_user('plan_doctor', 'doctor@example.com', 'x', role='doctor')
+        cls.manager = CustomUser.objects.create_user('plan_manager', 'manager@example.com', 'x', role='management')
+
+    def assertUsesIndex(self, queryset):
+        if connection.vendor == 'sqlite':
+            plan = queryset.explain()
+            problems = [
+                line for line in plan.splitlines()
+                if 'USE TEMP B-TREE' in line
+                or ('SCAN ' in line and ' USING ' not in line and 'CONSTANT ROW' not in line)
+            ]
+        elif connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+                cursor.execute('SET LOCAL enable_sort = off')
+            plan = queryset.explain(format='json')
+            problems = [node for node in _plan_nodes(json.loads(plan)[0]['Plan'])
+                        if node in ('Seq Scan', 'Sort')]
+        else:
+            self.skipTest(f'no plan checks for {connection.vendor}')
+        self.assertFalse(problems, f'\n{queryset.query}\n{plan}')
+
+    # ---------------- doctor dashboard ----------------
+    def test_doctor_files_newest_first(self):
+        self.assertUsesIndex(PatientFile.objects.filter(doctor=self.doctor).order_by('-uploaded_at', '-pk')[:26])
+
+    def test_doctor_files_prefix(self):
+        for data in ({'name': 'Zoë Ann'}, {'patient_id': 'MRN-12'}):
+            with self.subTest(data=data):
+                qs = PatientFileFilterForm(data).filter(PatientFile.objects.filter(doctor=self.doctor))
+                self.assertUsesIndex(qs.values('id'))
+
+    def test_doctor_files_disease(self):
+        qs = PatientFileFilterForm({'disease': 'Asthma'}).filter(PatientFile.objects.filter(doctor=self.doctor))
+        self.assertUsesIndex(qs.order_by('-uploaded_at', '-pk')[:26])
+
+    def test_doctor_disease_facets(self):
+        qs = PatientFile.objects.filter(doctor=self.doctor).values_list('disease').annotate(n=Count('id'))
+        self.assertUsesIndex(qs.order_by('disease'))
+
+    def test_search_keys(self):
+        self.assertEqual(search_key('  ZOË   Ann '), 'zoe ann')
+        patient_file = PatientFile(doctor=self.doctor, patient_name='Łukasz Ström', patient_id='MRN-7', disease='Flu')
+        patient_file.save()
+        self.assertEqual((patient_file.patient_name_key, patient_file.patient_id_key), ('łukasz strom', 'mrn-7'))
+        qs = PatientFileFilterForm({'name': 'lukasz'}).filter(PatientFile.objects.all())
+        self.assertFalse(qs.exists())  # no transliteration beyond combining marks
+        qs = PatientFileFilterForm({'name': 'ŁUKASZ ST'}).filter(PatientFile.objects.all())
+        self.assertEqual(list(qs), [patient_file])
+
+    # ---------------- management dashboard ----------------
+    def test_patients_first_page(self):
+        own = Patient.objects.filter(uploaded_by=self.manager)
+        self.assertUsesIndex(own.order_by('-uploaded_at', '-pk')[:26])
+
+    def test_patients_after_cursor(self):
+        stamp = timezone.now()
+        own = Patient.objects.filter(uploaded_by=self.manager)
+        older = own.filter(Q(uploaded_at__lt=stamp) | Q(uploaded_at=stamp, pk__lt=10))
+        self.assertUsesIndex(older.order_by('-uploaded_at', '-pk')[:26])
+
+    def test_patients_date_range(self):
+        form = PatientFilterForm({'date_from': '2024-01-01', 'date_to': '2024-12-31'})
+        qs = form.filter(Patient.objects.filter(uploaded_by=self.manager))
+        self.assertUsesIndex(qs.order_by('-uploaded_at', '-pk')[:26])
+
+    def test_patients_without_pdf(self):
+        form = PatientFilterForm({'has_pdf': 'no'})
+        qs = form.filter(Patient.objects.filter(uploaded_by=self.manager))
+        self.assertUsesIndex(qs.order_by('-uploaded_at', '-pk')[:26])
+
+    def test_patients_shared(self):
+        qs = Patient.objects.filter(uploaded_by=self.manager, access_email__isnull=False)
+        self.assertUsesIndex(qs.order_by('-uploaded_at', '-pk')[:26])
+
+    def test_patient_stats(self):
+        qs = Patient.objects.filter(uploaded_by=self.manager).values('uploaded_by').annotate(
+            n=Count('id'), shared=Count('id', filter=Q(access_email__isnull=False)),
+        ).order_by()
+        self.assertUsesIndex(qs)
+
+    # ---------------- admin dashboard ----------------
+    def test_staff_by_role(self):
+        for role in ('doctor', 'management'):
+            with self.subTest(role=role):
+                self.assertUsesIndex(CustomUser.objects.filter(role=role).order_by('-date_joined')[:50])
+
+    # ---------------- render_pdfs queue ----------------
+    def test_render_queue(self):
+        stale = timezone.now() - timedelta(minutes=5)
+        for lane in (Q(pdf_status='rendering', pdf_claimed_at__lt=stale), Q(pdf_status='queued')):
+            with self.subTest(lane=lane):
+                queue = Patient.objects.filter(lane).order_by('uploaded_at', 'id')
+                self.assertUsesIndex(queue.values('id')[:20])
+
+
+@test_settings
+class PatientSearchTests(TestCase):
+    """Full-text search: prefix matching, ranking, per-uploader scope and index sync."""
+
+    @classmethod
+    def setUpTestData(cls):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            return
+        cls.manager = CustomUser.objects.create_user('search_manager', 'search@example.com', 'x', role='management')
+        cls.other = CustomUser.objects.create_user('search_other', 'other@example.com', 'x', role='management')
+        cls.strong = Patient.objects.create(
+            full_name='Strong Match', email='a@example.com', uploaded_by=cls.manager,
+            diagnosis='Type 2 diabetes mellitus', prescriptions='Insulin glargine',
+        )
+        cls.weak = Patient.objects.create(
+            full_name='Weak Match', email='b@example.com', uploaded_by=cls.manager,
+            medical_history='Family history of diabetes; ' + 'routine checkup notes. ' * 20 + 'insulin mentioned once.',
+        )
+        Patient.objects.create(full_name='No Match', email='c@example.com', uploaded_by=cls.manager, diagnosis='Asthma')
+        Patient.objects.create(
+            full_name='Someone Else', email='d@example.com', uploaded_by=cls.other, diagnosis='Diabetes', prescriptions='Insulin',
+        )
+
+    def setUp(self):
+        if connection.vendor not in ('sqlite', 'postgresql'):
+            self.skipTest(f'no full-text search on {connection.vendor}')
+
+    def names(self, text):
+        return [patient.full_name for patient in search_patients(self.manager, text)]
+
+    def test_prefix_terms_ranked_and_scoped(self):
+        self.assertEqual(self.names('diab insul'), ['Strong Match', 'Weak Match'])
+
+    def test_punctuation_is_not_query_syntax(self):
+        self.assertEqual(self.names('"diabetes" OR -asthma*'), [])
+        self.assertEqual(self.names('  ()  '), [])
+
+    def test_owner_id_is_not_a_search_term(self):
+        self.assertEqual(self.names(str(self.manager.pk)), [])
+
+    def test_index_follows_updates_and_deletes(self):
+        self.weak.medical_history = 'Seasonal allergies'
+        self.weak.save()
+        self.assertEqual(self.names('diab'), ['Strong Match'])
+        self.assertEqual(self.names('allerg'), ['Weak Match'])
+        self.strong.delete()
+        self.assertEqual(self.names('diab'), [])
+
+
+@test_settings
+class EncryptedFieldTests(TestCase):
+    """PHI columns hold ciphertext and are decrypted only when an attribute is read."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = CustomUser.objects.create_user('phi_manager', 'manager@example.com', 'x', role='management')
+        cls.patient = Patient.objects.create(
+            full_name='Ada Phi', email='ada@example.com', uploaded_by=cls.manager,
+            diagnosis='Hypertension', bank_account='DE44 5001 0517', national_id='',
+        )
+
+    def stored(self, name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT {name} FROM accounts_patient WHERE id = %s', [self.patient.pk])
+            return cursor.fetchone()[0]
+
+    def test_stored_encrypted_read_decrypted(self):
+        self.assertTrue(self.stored('diagnosis').startswith(crypto.PREFIX))
+        self.assertNotIn('DE44', self.stored('bank_account'))
+        self.assertEqual(self.stored('national_id'), '')
+        patient = Patient.objects.get(pk=self.patient.pk)
+        self.assertIsInstance(patient.__dict__['diagnosis'], Ciphertext)
+        self.assertEqual(patient.diagnosis, 'Hypertension')
+        self.assertEqual(patient.__dict__['diagnosis'], 'Hypertension')
+
+    def test_save_keeps_unread_ciphertext(self):
+        token = self.stored('diagnosis')
+        patient = Patient.objects.get(pk=self.patient.pk)
+        patient.full_name = 'Ada Renamed'
+        patient.save()
+        self.assertEqual(self.stored('diagnosis'), token)
+
+    def test_tampered_value_does_not_decrypt(self):
+        token = self.stored('diagnosis')
+        with connection.cursor() as cursor:
+            cursor.execute('UPDATE accounts_patient SET bank_account = %s WHERE id = %s', [token, self.patient.pk])
+        with self.assertRaises(crypto.DecryptionError):
+            Patient.objects.get(pk=self.patient.pk).bank_account
+
+    def test_export_rows_decrypted(self):
+        rows = list(iter_rows(Patient.objects.filter(pk=self.patient.pk), ['full_name', 'diagnosis', 'bank_account']))
+        self.assertEqual(rows, [('Ada Phi', 'Hypertension', 'DE44 5001 0517')])
+
+
+@test_settings
+class RangeTests(SimpleTestCase):
+    def test_parse_range(self):
+        cases = [
+            ('bytes=0-99', 1000, (0, 99)),
+            ('bytes=900-', 1000, (900, 999)),
+            ('bytes=-100', 1000, (900, 999)),
+            ('bytes=-5000', 1000, (0, 999)),
+            ('bytes=990-2000', 1000, (990, 999)),
+            ('bytes=1000-', 1000, False),
+            ('bytes=-0', 1000, False),
+            ('bytes=-100', 0, False),  # nothing to take the last bytes of
+            ('bytes=0-', 0, False),
+            ('bytes=0-1,5-6', 1000, None),
+            (None, 1000, None),
+        ]
+        for header, size, expected in cases:
+            with self.subTest(header=header, size=size):
+                self.assertEqual(parse_range(header, size), expected)
+
+
+@test_settings
+@override_settings(ENCRYPTED_FILE_CHUNK_SIZE=100)
+class EncryptedStorageTests(SimpleTestCase):
+    """Stored files are AES-GCM chunk streams, decrypted on the fly and chunk by chunk."""
+
+    data = bytes(range(256)) * 5
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.storage = EncryptedFileSystemStorage(location=location)
+        self.name = self.storage.save('patient_pdfs/record.pdf', ContentFile(self.data))
+
+    def raw(self):
+        with open(self.storage.path(self.name), 'rb') as fh:
+            return fh.read()
+
+    def test_stored_encrypted_read_decrypted(self):
+        self.assertNotIn(self.data[:32], self.raw())
+        self.assertEqual(self.storage.size(self.name), len(self.data))
+        with self.storage.open(self.name) as fh:
+            self.assertEqual(fh.read(), self.data)
+            fh.seek(250)
+            self.assertEqual(fh.read(300), self.data[250:550])
+
+    @override_settings(SECURE_FILE_DELIVERY='x-sendfile')
+    def test_range_decrypts_covering_chunks_only(self):
+        request = RequestFactory().get('/', HTTP_RANGE='bytes=250-549')
+        with mock.patch.object(streamcrypto, '_unseal', wraps=streamcrypto._unseal) as unseal:
+            response = serve_file(request, SimpleNamespace(storage=self.storage, name=self.name))
+            body = b''.join(response.streaming_content)
+        self.assertEqual(response.status_code, 206)
+        self.assertNotIn('X-Sendfile', response)  # the web server would send ciphertext
+        self.assertEqual(body, self.data[250:550])
+        self.assertEqual([call.args[2] for call in unseal.call_args_list], [2, 3, 4, 5])
+
+    def test_altered_or_truncated_file_does_not_decrypt(self):
+        stored = self.raw()
+        for damaged in (stored[:300] + bytes([stored[300] ^ 1]) + stored[301:], stored[:-96]):  # last chunk dropped
+            with open(self.storage.path(self.name), 'wb') as fh:
+                fh.write(damaged)
+            with self.assertRaises(crypto.DecryptionError), self.storage.open(self.name) as fh:
+                fh.read()
+
+    def test_resume_after_interrupted_write(self):
+        raw = io.BytesIO()
+        with streamcrypto.EncryptedWriter(raw) as writer:
+            writer.write(self.data[:150])
+        streamcrypto.EncryptedWriter.resume(raw, 150).write(self.data[150:420])  # never closed
+        with streamcrypto.EncryptedWriter.resume(raw, 150) as writer:
+            writer.write(self.data[150:])
+        self.assertEqual(streamcrypto.EncryptedReader(raw).read(), self.data)
+
+    def test_resume_never_reuses_a_nonce(self):
+        key_id, ciphers = streamcrypto.file_keys()
+        nonces = []
+
+        class Recording:
+            def encrypt(self, nonce, data, aad):
+                nonces.append(nonce)
+                return ciphers[key_id].encrypt(nonce, data, aad)
+
+            def decrypt(self, nonce, data, aad):
+                return ciphers[key_id].decrypt(nonce, data, aad)
+
+        keys, raw = (key_id, {key_id: Recording()}), io.BytesIO()
+        with streamcrypto.EncryptedWriter(raw, keys) as writer:
+            writer.write(self.data[:150])
+        streamcrypto.EncryptedWriter.resume(raw, 150, keys).write(self.data[150:420])  # never closed
+        for start, end in ((150, 430), (430, 1000), (1000, None)):
+            with streamcrypto.EncryptedWriter.resume(raw, start, keys) as writer:
+                writer.write(self.data[start:end])
+        self.assertGreater(len(nonces), 13)  # the 13 chunks of the file, some sealed more than once
+        self.assertEqual(len(set(nonces)), len(nonces))
+        self.assertEqual(streamcrypto.EncryptedReader(raw).read(), self.data)
+
+    def test_files_stored_before_encryption(self):
+        with open(self.storage.path('patient_pdfs/old.pdf'), 'wb') as fh:
+            fh.write(self.data)
+        self.assertFalse(self.storage.stored_encrypted('patient_pdfs/old.pdf'))
+        self.assertTrue(self.storage.encrypt_in_place('patient_pdfs/old.pdf'))
+        self.assertTrue(self.storage.stored_encrypted('patient_pdfs/old.pdf'))
+        with self.storage.open('patient_pdfs/old.pdf') as fh:
+            self.assertEqual(fh.read(), self.data)
+        self.assertEqual(sorted(os.listdir(self.storage.path('patient_pdfs'))), ['old.pdf', 'record.pdf'])
+
+
+@test_settings
+class RenderJobTests(TestCase):
+    """A queued render is claimed by one worker, and again only once its lease runs out."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.manager = CustomUser.objects.create_user('render_manager', 'render@example.com', 'x', role='management')
+        cls.patient = Patient.objects.create(full_name='Ada Render', email='ada@example.com', uploaded_by=cls.manager)
+
+    def test_claimed_once(self):
+        self.assertEqual([p.pk for p in claim_render_jobs()], [self.patient.pk])
+        self.assertEqual(claim_render_jobs(), [])
+        Patient.objects.filter(pk=self.patient.pk).update(pdf_claimed_at=timezone.now() - timedelta(seconds=301))
+        self.assertEqual([p.pk for p in claim_render_jobs()], [self.patient.pk])
+
+    def test_lost_race_skipped(self):
+        claim = Patient.objects.filter(pk=self.patient.pk).values_list('id', flat=True)
+
+        def claimed_meanwhile(*args, **kwargs):
+            # another worker's UPDATE lands between this worker's read and its own
+            Patient.objects.filter(pk=self.patient.pk).update(pdf_status='rendering', pdf_claimed_at=timezone.now())
+            return claim
+
+        with mock.patch('django.db.models.query.QuerySet.values_list', autospec=True, side_effect=claimed_meanwhile):
+            self.assertEqual(claim_render_jobs(), [])
+
+    def expire_lease(self):
+        Patient.objects.filter(pk=self.patient.pk).update(pdf_claimed_at=timezone.now() - timedelta(seconds=301))
+
+    @override_settings(PDF_RENDER_MAX_ATTEMPTS=2)
+    def test_lost_lease_counts_as_attempt(self):
+        claim_render_jobs()
+        self.expire_lease()
+        self.assertEqual([p.pdf_attempts for p in claim_render_jobs()], [1])
+        self.expire_lease()
+        self.assertEqual(claim_render_jobs(), [])
+        self.patient.refresh_from_db()
+        self.assertEqual((self.patient.pdf_status, self.patient.pdf_attempts), ('failed', 2))
+        self.assertIn('Lease expired', self.patient.pdf_error)
+
+    def test_broken_pool_releases_jobs(self):
+        broken = Future()
+        broken.set_exception(BrokenProcessPool('a worker process died'))
+        executor = mock.Mock(**{'submit.return_value': broken})
+        with self.assertRaises(BrokenProcessPool):
+            run_render_batch(executor)
+        self.patient.refresh_from_db()
+        self.assertEqual((self.patient.pdf_status, self.patient.pdf_attempts), ('queued', 1))
+        self.assertIsNone(self.patient.pdf_claimed_at)
+
+        executor.submit.side_effect = BrokenProcessPool('pool already broken')
+        with self.assertRaises(BrokenProcessPool):
+            run_render_batch(executor)
+        self.patient.refresh_from_db()
+        self.assertEqual((self.patient.pdf_status, self.patient.pdf_attempts), ('queued', 2))
+
+    def test_command_replaces_broken_pool(self):
+        command = 'accounts.management.commands.render_pdfs'
+        first, second = mock.Mock(), mock.Mock()
+        with mock.patch(f'{command}.ProcessPoolExecutor', side_effect=[first, second]), \
+                mock.patch(f'{command}.run_render_batch', side_effect=[BrokenProcessPool(), 1, 0]) as batch:
+            call_command('render_pdfs', '--once', stdout=io.StringIO(), stderr=io.StringIO())
+        self.assertEqual([args[0] for args, _ in batch.call_args_list], [first, second, second])
+        first.shutdown.assert_called_once_with(wait=False)
+        second.shutdown.assert_called_once_with()
+
+
+@test_settings
+class FileBlobTests(TestCase):
+    """Identical uploads share one stored blob, deleted with its last row."""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.doctor = CustomUser.objects.create_user('blob_doctor', 'blob@example.com', 'x', role='doctor')
+
+    def upload(self, name, data):
+        return PatientFile.objects.create(doctor=self.doctor, patient_name='Ada Blob', file=ContentFile(data, name=name))
+
+    def test_refcounted(self):
+        first, second = self.upload('a.pdf', b'same bytes'), self.upload('b.pdf', b'same bytes')
+        other = self.upload('c.pdf', b'other bytes')
+        self.assertEqual(first.file.name, second.file.name)
+        self.assertEqual(FileBlob.objects.get(pk=first.blob_id).ref_count, 2)
+        self.assertEqual(FileBlob.objects.get(pk=other.blob_id).ref_count, 1)
+        storage, name = first.file.storage, first.file.name
+
+        with self.captureOnCommitCallbacks(execute=True):
+            first.delete()
+        self.assertEqual(FileBlob.objects.get(pk=second.blob_id).ref_count, 1)
+        self.assertTrue(storage.exists(name))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            second.delete()
+        self.assertFalse(FileBlob.objects.filter(pk=second.blob_id).exists())
+        self.assertFalse(storage.exists(name))
+        self.assertTrue(storage.exists(other.file.name))
+
+    def test_same_bytes_under_other_extensions(self):
+        files = [self.upload('scan.pdf', b'scan bytes'), self.upload('scan.PDF.bin', b'scan bytes')]
+        self.assertEqual(files[0].file.name, files[1].file.name)
+        self.assertEqual([f.display_name for f in files], ['scan.pdf', 'scan.PDF.bin'])
+        blobs = os.path.join(files[0].file.storage.location, 'blobs')
+        self.assertEqual(sum(len(found) for _, _, found in os.walk(blobs)), 1)  # written once
+        for patient_file in files:
+            with self.captureOnCommitCallbacks(execute=True):
+                patient_file.delete()
+        self.assertEqual(sum(len(found) for _, _, found in os.walk(blobs)), 0)
+
+
+@test_settings
+@override_settings(ENCRYPTED_FILE_CHUNK_SIZE=100, RATELIMIT_ENABLED=False)
+class ChunkedUploadTests(TestCase):
+    """The resumable upload protocol: init, offset checks, resume and finalize."""
+
+    data = bytes(range(256)) * 2
+
+    def setUp(self):
+        media, temp = tempfile.mkdtemp(), tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        self.addCleanup(shutil.rmtree, temp)
+        dirs = override_settings(MEDIA_ROOT=media, CHUNKED_UPLOAD_TEMP_DIR=temp)
+        dirs.enable()
+        self.addCleanup(dirs.disable)
+        self.doctor = CustomUser.objects.create_user('upload_doctor', 'upload@example.com', 'x', role='doctor')
+        self.client.force_login(self.doctor)
+
+    def init(self):
+        response = self.client.post('/uploads/', {
+            'patient_name': 'Ada Upload', 'patient_id': 'P-1', 'disease': 'Flu',
+            'filename': 'C:\\scans\\scan.pdf', 'total_size': len(self.data),
+        })
+        self.assertEqual(response.status_code, 201)
+        return response.json()['upload_id']
+
+    def put(self, upload_id, start, end, body=None):
+        body = self.data[start:end + 1] if body is None else body
+        return self.client.put(f'/uploads/{upload_id}/', body, content_type='application/octet-stream',
+                               HTTP_CONTENT_RANGE=f'bytes {start}-{end}/{len(self.data)}')
+
+    def test_init(self):
+        upload_id = self.init()
+        session = UploadSession.objects.get(id=upload_id)
+        self.assertEqual((session.doctor, session.filename, session.received), (self.doctor, 'scan.pdf', 0))
+        self.assertEqual(self.client.get(f'/uploads/{upload_id}/').json()['offset'], 0)
+
+    def test_offset_mismatch(self):
+        upload_id = self.init()
+        self.assertEqual(self.put(upload_id, 0, 149).status_code, 200)
+        response = self.put(upload_id, 100, 249)  # overlaps the acknowledged bytes
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(response.json()['offset'], 150)
+
+    def test_resume_after_interrupted_put(self):
+        upload_id = self.init()
+        self.assertEqual(self.put(upload_id, 0, 149).status_code, 200)
+        # the connection drops after 130 of 200 bytes: they reach the temp file
+        # but are not acknowledged
+        self.assertEqual(self.put(upload_id, 150, 349, body=self.data[150:280]).status_code, 400)
+        self.assertEqual(self.client.get(f'/uploads/{upload_id}/').json()['offset'], 150)
+        self.assertEqual(self.put(upload_id, 150, 349).status_code, 200)
+        self.assertEqual(self.put(upload_id, 350, len(self.data) - 1).json()['offset'], len(self.data))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(f'/uploads/{upload_id}/finalize/')
+        self.assertEqual(response.status_code, 201)
+        patient_file = PatientFile.objects.get(id=response.json()['file_id'])
+        self.assertEqual((patient_file.doctor, patient_file.original_name), (self.doctor, 'scan.pdf'))
+        self.assertEqual(FileBlob.objects.get(pk=patient_file.blob_id).ref_count, 1)
+        with patient_file.file.open('rb') as fh:
+            self.assertEqual(fh.read(), self.data)
+        self.assertFalse(UploadSession.objects.filter(id=upload_id).exists())
+        self.assertEqual(os.listdir(settings.CHUNKED_UPLOAD_TEMP_DIR), [])
+
+    def test_finalize_incomplete(self):
+        upload_id = self.init()
+        self.put(upload_id, 0, 99)
+        self.assertEqual(self.client.post(f'/uploads/{upload_id}/finalize/').status_code, 409)
+        self.assertFalse(PatientFile.objects.exists())
+
+    def test_concurrent_put_same_offset(self):
+        session = UploadSession.objects.get(id=self.init())
+        outcome = []
+
+        class Racing(io.BytesIO):
+            def read(stream, size=-1):
+                if not outcome:
+                    # a second PUT for offset 0 arrives while this one is writing
+                    rival = UploadSession.objects.get(id=session.id)
+                    with self.assertRaises(chunked_upload.UploadError) as raised:
+                        chunked_upload.write_chunk(rival, io.BytesIO(self.data[:100]), 0, 100)
+                    outcome.append(raised.exception.status)
+                return super().read(size)
+
+        self.assertEqual(chunked_upload.write_chunk(session, Racing(self.data[:100]), 0, 100), 100)
+        self.assertEqual(outcome, [409])
+        session.refresh_from_db()
+        self.assertEqual((session.received, session.writing_since), (100, None))
+        with chunked_upload.EncryptedReader(open(chunked_upload.temp_path(session), 'rb')) as fh:
+            self.assertEqual(fh.read(), self.data[:100])
+
+
+@test_settings
+@override_settings(ENCRYPTED_FILE_CHUNK_SIZE=100, SECURE_FILE_CHUNK_SIZE=64, RATELIMIT_ENABLED=False)
+class DownloadViewTests(TestCase):
+    """Downloads need an OTP grant, then honour Range, If-Range and If-None-Match."""
+
+    data = bytes(range(256)) * 2
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        doctor = CustomUser.objects.create_user('download_doctor', 'download@example.com', 'x', role='doctor')
+        self.file = PatientFile.objects.create(
+            doctor=doctor, patient_name='Ada Download', access_email='reader@example.com',
+            file=ContentFile(self.data, name='scan.bin'),
+        )
+        self.url = f'/download-file/{self.file.id}/'
+        self.client.force_login(doctor)
+
+    def grant(self):
+        otp = self.file.generate_otp()
+        response = self.client.post(f'/access-file/{self.file.id}/', {'email': 'reader@example.com', 'otp': otp})
+        self.assertRedirects(response, self.url, fetch_redirect_response=False)
+
+    def test_refused_without_grant(self):
+        response = self.client.get(self.url)
+        self.assertRedirects(response, f'/access-file/{self.file.id}/', fetch_redirect_response=False)
+
+    def test_full_file(self):
+        self.grant()
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+        self.assertEqual(response['Content-Length'], str(len(self.data)))
+
+    def test_single_range(self):
+        self.grant()
+        response = self.client.get(self.url, HTTP_RANGE='bytes=90-209')
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response['Content-Range'], f'bytes 90-209/{len(self.data)}')
+        self.assertEqual(b''.join(response.streaming_content), self.data[90:210])
+
+    def test_unsatisfiable_range(self):
+        self.grant()
+        response = self.client.get(self.url, HTTP_RANGE=f'bytes={len(self.data)}-')
+        self.assertEqual(response.status_code, 416)
+        self.assertEqual(response['Content-Range'], f'bytes */{len(self.data)}')
+
+    def test_if_none_match(self):
+        self.grant()
+        etag = self.client.get(self.url)['ETag']
+        response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response['ETag'], etag)
+
+    def test_stale_if_range_sends_whole_file(self):
+        self.grant()
+        etag = self.client.get(self.url)['ETag']
+        self.assertEqual(self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE=etag).status_code, 206)
+        response = self.client.get(self.url, HTTP_RANGE='bytes=0-9', HTTP_IF_RANGE='"stale"')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(b''.join(response.streaming_content), self.data)
+
+    def test_encrypted_files_never_handed_to_web_server(self):
+        self.grant()
+        for mode in ('x-accel-redirect', 'x-sendfile'):
+            with self.subTest(mode=mode), override_settings(SECURE_FILE_DELIVERY=mode):
+                response = self.client.get(self.url)
+                self.assertNotIn('X-Accel-Redirect', response)
+                self.assertNotIn('X-Sendfile', response)
+                self.assertEqual(b''.join(response.streaming_content), self.data)
+
+
+@test_settings
+class BundleZipTests(TestCase):
+    """Streamed bundles are valid ZIPs with unique names, compressing only what shrinks."""
+
+    def setUp(self):
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media)
+        media_root = override_settings(MEDIA_ROOT=media)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+        self.doctor = CustomUser.objects.create_user('bundle_doctor', 'bundle@example.com', 'x', role='doctor')
+
+    def upload(self, name, data):
+        return PatientFile.objects.create(
+            doctor=self.doctor, patient_name='Ada Bundle', patient_id='P-7', file=ContentFile(data, name=name),
+        )
+
+    def test_iter_zip(self):
+        contents = {
+            'Ada Bundle (P-7)/scan.pdf': os.urandom(5000),
+            'Ada Bundle (P-7)/notes.txt': b'blood pressure normal\n' * 400,
+            'Ada Bundle (P-7)/notes (2).txt': b'follow up in two weeks\n' * 400,
+        }
+        files = [self.upload(name.split('/')[1].replace(' (2)', ''), data) for name, data in contents.items()]
+        pieces = list(iter_zip(bundle_entries(files), chunk_size=1000))
+        self.assertGreater(len(pieces), len(files))  # streamed, not built whole
+
+        with zipfile.ZipFile(io.BytesIO(b''.join(pieces))) as archive:
+            self.assertIsNone(archive.testzip())
+            infos = {info.filename: info for info in archive.infolist()}
+            self.assertEqual(list(infos), list(contents))
+            for name, data in contents.items():
+                self.assertEqual(archive.read(name), data)
+                self.assertEqual((infos[name].CRC, infos[name].file_size), (zlib.crc32(data), len(data)))
+        self.assertEqual(infos['Ada Bundle (P-7)/scan.pdf'].compress_type, zipfile.ZIP_STORED)
+        self.assertEqual(infos['Ada Bundle (P-7)/notes.txt'].compress_type, zipfile.ZIP_DEFLATED)
+        self.assertLess(infos['Ada Bundle (P-7)/notes.txt'].compress_size, 1000)
+
+
+@test_settings
+class EmailTemplateTests(SimpleTestCase):
+    """Layouts compile once; per-message values are escaped for HTML only."""
+
+    def setUp(self):
+        emails.get_layout.cache_clear()
+        self.addCleanup(emails.get_layout.cache_clear)
+
+    def test_values_escaped_in_html_only(self):
+        subject, text, html = emails.render_email('login_otp', username='<b>Tom & Jerry</b>', otp='123456')
+        self.assertIn('&lt;b&gt;Tom &amp; Jerry&lt;/b&gt;', html)
+        self.assertNotIn('<b>Tom', html)
+        self.assertIn('<b>Tom & Jerry</b>', text)
+        self.assertIn('123456', html)
+        self.assertIn('123456', text)
+
+    def test_css_inlined(self):
+        html = emails.inline_css(
+            '<html><head><style>p { color: red } .note { font-weight: bold } a:hover { color: blue }</style></head>'
+            '<body><p class="note" style="margin: 0">x</p><p>y</p><span class="other">z</span></body></html>'
+        )
+        self.assertIn('<p class="note" style="color: red; font-weight: bold; margin: 0;">x</p>', html)
+        self.assertIn('<p style="color: red;">y</p>', html)
+        self.assertIn('<span class="other">z</span>', html)
+        self.assertIn('<style>\na:hover { color: blue }\n</style>', html)  # not inlinable, kept
+
+    def test_layout_compiled_once(self):
+        with mock.patch.object(emails, 'render_to_string', wraps=emails.render_to_string) as render:
+            for code in ('111111', '222222', '333333'):
+                emails.render_email('login_otp', username='ada', otp=code)
+            emails.render_email('registration', username='ada', otp='444444')
+        self.assertEqual(render.call_count, 4)  # .html and .txt per layout
+
+
+@test_settings
+class ImportPatientsTests(TestCase):
+    """import_patients inserts in batches, rejects invalid rows and resumes from its checkpoint."""
+
+    def setUp(self):
+        folder = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, folder)
+        self.path = os.path.join(folder, 'patients.csv')
+        with open(self.path, 'w', newline='') as fh:
+            fh.write('full_name,email,gender\n')
+            for n in range(1, 8):
+                email = 'not-an-email' if n in (3, 6) else f'p{n}@example.com'
+                fh.write(f'Patient {n},{email},F\n')
+        CustomUser.objects.create_user('import_manager', 'import@example.com', 'x', role='management')
+
+    def run_import(self):
+        call_command('import_patients', self.path, owner='import_manager', batch_size=2, stdout=io.StringIO())
+
+    def bulk_create(self, **kwargs):
+        return mock.patch.object(QuerySet, 'bulk_create', autospec=True, **kwargs)
+
+    def test_batches_and_rejects(self):
+        with self.bulk_create(side_effect=QuerySet.bulk_create) as bulk_create:
+            self.run_import()
+        batches = [len(objs) for (queryset, objs), _ in bulk_create.call_args_list if queryset.model is Patient]
+        self.assertEqual(batches, [2, 1, 1, 1])
+        self.assertEqual(Patient.objects.count(), 5)
+        job = PatientImport.objects.get()
+        self.assertEqual((job.rows_done, job.imported, job.rejected), (7, 5, 2))
+        with open(f'{self.path}.rejects.jsonl') as fh:
+            rejects = [json.loads(line) for line in fh]
+        self.assertEqual([reject['row'] for reject in rejects], [3, 6])
+        self.assertIn('email', rejects[0]['errors'])
+
+    def test_resume_after_failed_batch(self):
+        calls, bulk_create = itertools.count(), QuerySet.bulk_create
+
+        def fail_third_batch(queryset, objs, *args, **kwargs):
+            if queryset.model is Patient and next(calls) == 2:
+                raise RuntimeError('worker killed')
+            return bulk_create(queryset, objs, *args, **kwargs)
+
+        with self.bulk_create(side_effect=fail_third_batch), self.assertRaises(RuntimeError):
+            self.run_import()
+        job = PatientImport.objects.get()
+        self.assertEqual((job.rows_done, job.imported, job.finished_at), (4, 3, None))
+
+        self.run_import()
+        names = list(Patient.objects.order_by('full_name').values_list('full_name', flat=True))
+        self.assertEqual(names, [f'Patient {n}' for n in (1, 2, 4, 5, 7)])
+        job.refresh_from_db()
+        self.assertEqual((job.rows_done, job.imported, job.rejected), (7, 5, 2))
+        self.assertIsNotNone(job.finished_at)
+
+
+@test_settings
+@override_settings(RATELIMIT_ENABLED=False)
+class MetricsTests(TestCase):
+    """Requests are recorded under their URL name; /metrics is served to trusted clients only."""
+
+    def samples(self):
+        requests = dict(metrics.REQUESTS._values)
+        latencies = {key: sum(counts) for key, (counts, total) in metrics.REQUEST_SECONDS._values.items()}
+        return requests, latencies
+
+    def test_recorded_by_route_name(self):
+        requests, latencies = self.samples()
+        for file_id in (101, 202):
+            self.assertEqual(self.client.get(f'/download-file/{file_id}/').status_code, 302)  # to the login page
+        after, after_latencies = self.samples()
+        key = ('download_patient_file', 'GET', '302')
+        self.assertEqual(after[key] - requests.get(key, 0), 2)
+        self.assertEqual(after_latencies[key[:2]] - latencies.get(key[:2], 0), 2)
+        self.assertFalse([labels for labels in after if any('/' in value for value in labels)])
+
+    def test_refused_to_untrusted_clients(self):
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.9').status_code, 404)
+        response = self.client.get('/metrics')  # the test client's 127.0.0.1
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'# TYPE http_requests_total counter', response.content)
+        with override_settings(METRICS_TOKEN='scrape-token'):
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+            self.assertEqual(self.client.get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 404)
+            response = self.client.get('/metrics', REMOTE_ADDR='203.0.113.9', HTTP_AUTHORIZATION='Bearer scrape-token')
+            self.assertEqual(response.status_code, 200)
+        self.assertFalse([labels for labels in metrics.REQUESTS._values if labels[0] == 'metrics'])
+
+
+@test_settings
+class DashboardCacheTests(TestCase):
+    """Repeat dashboard views come from the fragment cache until a save is committed."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.doctor = CustomUser.objects.create_user('cache_doctor', 'doctor@example.com', 'x', role='doctor')
+        cls.manager = CustomUser.objects.create_user('cache_manager', 'manager@example.com', 'x', role='management')
+        cls.admin = CustomUser.objects.create_user('cache_admin', 'admin@example.com', 'x', role='admin')
+        PatientFile.objects.create(doctor=cls.doctor, patient_name='Ada File', patient_id='A1', disease='Flu')
+        Patient.objects.create(full_name='Ada Record', email='ada@example.com', uploaded_by=cls.manager)
+
+    def setUp(self):
+        fragments.reset()  # ids repeat across tests; so would the cache keys
+
+    def test_repeat_view_needs_no_queries(self):
+        for user, url in ((self.doctor, '/doctor-dashboard/'), (self.manager, '/management-dashboard/'),
+                          (self.admin, '/admin-dashboard/')):
+            with self.subTest(url=url):
+                self.client.force_login(user)
+                self.client.get(url)
+                with self.assertNumQueries(0):  # session and request.user come from the cache too
+                    response = self.client.get(url)
+                self.assertContains(response, 'csrfmiddlewaretoken')
+                self.assertNotContains(response, fragments.CSRF_PLACEHOLDER)
+
+    def test_committed_save_invalidates(self):
+        self.client.force_login(self.doctor)
+        self.assertNotContains(self.client.get('/doctor-dashboard/'), 'Bea File')
+        with self.captureOnCommitCallbacks(execute=True):
+            PatientFile.objects.create(doctor=self.doctor, patient_name='Bea File', patient_id='B2', disease='Flu')
+        self.assertContains(self.client.get('/doctor-dashboard/'), 'Bea File')
+
+
+@test_settings
+class DashboardCounterTests(TestCase):
+    """The admin dashboard counters follow creates, deletes and role changes."""
+
+    names = ('users.doctor', 'users.management', 'patients')
+
+    def assertCounts(self, doctors, managers, patients):
+        self.assertEqual(DashboardCounter.read(*self.names), dict(zip(self.names, (doctors, managers, patients))))
+        self.assertEqual(counters.reconcile(), {})  # and they agree with the tables
+
+    def test_counts_follow_changes(self):
+        self.assertCounts(0, 0, 0)
+        user = CustomUser.objects.create_user('counted', 'counted@example.com', 'x', role='doctor')
+        self.assertCounts(1, 0, 0)
+        user.role = 'management'
+        user.save()
+        self.assertCounts(0, 1, 0)
+        user.save()  # unchanged role
+        self.assertCounts(0, 1, 0)
+        patient = Patient.objects.create(full_name='Ada Count', email='ada@example.com', uploaded_by=user)
+        self.assertCounts(0, 1, 1)
+        patient.delete()
+        self.assertCounts(0, 1, 0)
+        Patient.objects.create(full_name='Bea Count', email='bea@example.com', uploaded_by=user)
+        user.delete()  # and the patient with it
+        self.assertCounts(0, 0, 0)
+
+
+@test_settings
+@override_settings(OUTBOX_MAX_ATTEMPTS=3, OUTBOX_RETRY_BACKOFF=30, OUTBOX_LEASE_SECONDS=300)
+class OutboxTests(TestCase):
+    """Queued mail is retried with backoff and dead-lettered after OUTBOX_MAX_ATTEMPTS."""
+
+    def setUp(self):
+        self.message = outbox.enqueue_mail('Subject', 'Your OTP is 123456', None, ['to@example.com'], '<p>123456</p>')
+
+    def refreshed(self):
+        self.message.refresh_from_db()
+        return self.message
+
+    def make_due(self):
+        EmailOutbox.objects.filter(pk=self.message.pk).update(next_attempt_at=timezone.now())
+
+    def test_sent(self):
+        self.assertEqual(outbox.deliver_batch(), (1, 0))
+        self.assertEqual(mail.outbox[0].body, 'Your OTP is 123456')
+        self.assertEqual([m.to for m in mail.outbox], [['to@example.com']])
+        message = self.refreshed()
+        self.assertEqual((message.status, message.body, message.html_body), ('sent', '', ''))  # no OTP kept
+
+    def test_retried_with_backoff_then_dead(self):
+        with mock.patch.object(outbox.EmailMultiAlternatives, 'send', side_effect=OSError('refused')):
+            for attempt, delay in ((1, 30), (2, 60)):
+                before = timezone.now()
+                self.assertEqual(outbox.deliver_batch(), (0, 1))
+                message = self.refreshed()
+                self.assertEqual((message.status, message.attempts), ('pending', attempt))
+                self.assertEqual(message.body, 'Your OTP is 123456')  # kept for the retry
+                self.assertGreaterEqual(message.next_attempt_at, before + timedelta(seconds=delay))
+                self.assertEqual(outbox.deliver_batch(), (0, 0))  # not due yet
+                self.make_due()
+            self.assertEqual(outbox.deliver_batch(), (0, 1))
+        message = self.refreshed()
+        self.assertEqual((message.status, message.attempts, message.body, message.html_body), ('dead', 3, '', ''))
+        self.make_due()
+        self.assertEqual(outbox.deliver_batch(), (0, 0))
+
+    def test_expired_lease_counts_as_attempt(self):
+        stale = timezone.now() - timedelta(seconds=301)
+        EmailOutbox.objects.filter(pk=self.message.pk).update(status='sending', locked_at=stale, attempts=1)
+        self.assertEqual([m.pk for m in outbox.claim_batch()], [self.message.pk])
+        self.assertEqual((self.refreshed().status, self.message.attempts), ('sending', 2))
+        EmailOutbox.objects.filter(pk=self.message.pk).update(locked_at=stale)  # its worker died again
+        self.assertEqual(outbox.claim_batch(), [])
+        message = self.refreshed()
+        self.assertEqual((message.status, message.attempts, message.body), ('dead', 3, ''))
+
+
+@test_settings
+class CachedUserTests(TestCase):
+    """request.user comes from the cache until the user is saved."""
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user('cached_user', 'cached@example.com', 'secret', role='doctor')
+        self.client.force_login(self.user)
+        self.assertRedirects(self.client.get('/dashboard/'), '/doctor-dashboard/', fetch_redirect_response=False)
+        with self.assertNumQueries(0):
+            self.client.get('/dashboard/')  # the user is cached
+
+    def saved(self, **changes):
+        user = CustomUser.objects.get(pk=self.user.pk)  # another worker's copy
+        for name, value in changes.items():
+            setattr(user, name, value)
+        user.save()
+
+    def test_role_change(self):
+        self.saved(role='management')
+        self.assertRedirects(self.client.get('/dashboard/'), '/management-dashboard/', fetch_redirect_response=False)
+
+    def test_deactivation(self):
+        self.saved(is_active=False)
+        response = self.client.get('/dashboard/')
+        self.assertRedirects(response, f'{settings.LOGIN_URL}?next=/dashboard/', fetch_redirect_response=False)
+
+    def test_password_change(self):
+        user = CustomUser.objects.get(pk=self.user.pk)
+        user.set_password('changed')
+        user.save()
+        response = self.client.get('/dashboard/')  # the session hash no longer matches
+        self.assertRedirects(response, f'{settings.LOGIN_URL}?next=/dashboard/', fetch_redirect_response=False)
+
+
+@test_settings
+@override_settings(OTP_MAX_ATTEMPTS=5, OTP_TTL_SECONDS={'login': 600})
+class OtpTests(SimpleTestCase):
+    """Codes expire, work once, and are revoked after OTP_MAX_ATTEMPTS wrong guesses."""
+
+    def setUp(self):
+        caches[settings.OTP_CACHE].clear()
+        self.code = otp.issue_otp('login', 1)
+        self.wrong = f'{(int(self.code) + 1) % 10 ** 6:06d}'
+
+    def test_single_use(self):
+        self.assertFalse(otp.verify_otp('login', 1, self.wrong))
+        self.assertFalse(otp.verify_otp('login', 2, self.code))
+        self.assertTrue(otp.verify_otp('login', 1, self.code))
+        self.assertFalse(otp.verify_otp('login', 1, self.code))
+
+    def test_reissue_replaces(self):
+        code = otp.issue_otp('login', 1)
+        if code != self.code:  # the same code again: one chance in a million
+            self.assertFalse(otp.verify_otp('login', 1, self.code))
+        self.assertTrue(otp.verify_otp('login', 1, code))
+
+    def test_expires(self):
+        with mock.patch('time.time', return_value=time.time() + 601):
+            self.assertFalse(otp.verify_otp('login', 1, self.code))
+
+    def test_revoked_after_max_failures(self):
+        for _ in range(4):
+            self.assertFalse(otp.verify_otp('login', 1, self.wrong))
+        self.assertTrue(otp.verify_otp('login', 1, self.code))  # four wrong guesses are tolerated
+
+        code = otp.issue_otp('login', 1)
+        wrong = f'{(int(code) + 1) % 10 ** 6:06d}'
+        for _ in range(5):
+            self.assertFalse(otp.verify_otp('login', 1, wrong))
+        self.assertFalse(otp.verify_otp('login', 1, code))
+
+    def test_busy_counter_revokes(self):
+        caches[settings.OTP_CACHE].add('otp:login:1:lock', 1)  # parallel guesses hold the counter
+        with mock.patch.object(otp, '_LOCK_WAIT', 0):
+            self.assertFalse(otp.verify_otp('login', 1, self.wrong))
+        self.assertFalse(otp.verify_otp('login', 1, self.code))
+
+
+@test_settings
+class CacheLockTests(SimpleTestCase):
+    """A lock in the file cache is held by one client at a time, whatever the process."""
+
+    def setUp(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        self.first, self.second = FileBasedCache(location, {}), FileBasedCache(location, {})
+
+    def test_one_holder(self):
+        self.assertTrue(locks.acquire(self.first, 'bucket:lock', 1, 0))
+        self.assertFalse(locks.acquire(self.second, 'bucket:lock', 3, 0))
+        locks.release(self.first, 'bucket:lock')
+        self.assertTrue(locks.acquire(self.second, 'bucket:lock', 1, 0))
+
+    def test_lock_of_dead_holder_expires(self):
+        self.assertTrue(locks.acquire(self.first, 'bucket:lock', 1, 0, timeout=2))
+        lock_file = locks._lock_file(self.first, 'bucket:lock')
+        os.utime(lock_file, (time.time() - 3, time.time() - 3))
+        self.assertTrue(locks.acquire(self.second, 'bucket:lock', 2, 0, timeout=2))
+
+    def test_racing_clients(self):
+        start, taken = threading.Barrier(8), []
+
+        def take(cache):
+            start.wait()
+            taken.append(locks.acquire(cache, 'bucket:lock', 1, 0))
+
+        workers = [threading.Thread(target=take, args=(FileBasedCache(self.first._dir, {}),)) for _ in range(8)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        self.assertEqual(taken.count(True), 1)
+
+
+@test_settings
+@override_settings(RATELIMIT_ENABLED=True)
+class RateLimitTests(TestCase):
+    """Token buckets refill over time, are shared by every worker and end in a 429."""
+
+    def setUp(self):
+        caches[settings.RATELIMIT_CACHE].clear()
+
+    def test_bucket_refills(self):
+        self.assertEqual(ratelimit.take_token('bucket', 2, 10, now=0), 0)
+        self.assertEqual(ratelimit.take_token('bucket', 2, 10, now=0), 0)
+        self.assertEqual(ratelimit.take_token('bucket', 2, 10, now=0), 5)  # one token every 5 seconds
+        self.assertEqual(ratelimit.take_token('bucket', 2, 10, now=5), 0)
+        self.assertEqual(ratelimit.take_token('bucket', 2, 10, now=6), 4)
+
+    def test_workers_share_buckets(self):
+        location = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, location)
+        # two cache clients on one location, as two worker processes would have
+        workers = itertools.cycle([FileBasedCache(location, {}), FileBasedCache(location, {})])
+        with mock.patch.object(ratelimit, '_cache', side_effect=lambda: next(workers)):
+            spent = [ratelimit.take_token('bucket', 3, 60, now=0) for _ in range(4)]
+        self.assertEqual(spent[:3], [0, 0, 0])
+        self.assertGreater(spent[3], 0)
+
+    def test_rejected_with_429(self):
+        for _ in range(5):
+            self.assertEqual(self.client.post('/login/', {'username': 'nobody', 'otp': '123456'}).status_code, 200)
+        response = self.client.post('/login/', {'username': 'nobody', 'otp': '123456'})
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response['Retry-After'], '60')  # 5 tokens per 300 seconds
+        self.assertEqual(ratelimit.rejection_counts()[('login', 'username')], 1)
+
+
+@test_settings
+class SqlitePragmaTests(SimpleTestCase):
+    """Connection PRAGMAs are applied to every connection; synchronous only under WAL."""
+
+    def pragmas(self, journal_mode):
+        path = os.path.join(tempfile.mkdtemp(), 'db.sqlite3')
+        self.addCleanup(shutil.rmtree, os.path.dirname(path))
+        raw = sqlite3.connect(path)
+        self.addCleanup(raw.close)
+        raw.execute(f'PRAGMA journal_mode = {journal_mode}')
+        apply_sqlite_pragmas(None, SimpleNamespace(vendor='sqlite', cursor=lambda: closing(raw.cursor())))
+        return {name: raw.execute(f'PRAGMA {name}').fetchone()[0]
+                for name in ('synchronous', 'mmap_size', 'temp_store', 'cache_size')}
+
+    def test_wal(self):
+        pragmas = self.pragmas('wal')
+        self.assertEqual(pragmas['synchronous'], 1)  # NORMAL
+        self.assertEqual(pragmas['mmap_size'], settings.SQLITE_PRAGMAS['mmap_size'])
+        self.assertEqual(pragmas['temp_store'], 2)  # MEMORY
+        self.assertEqual(pragmas['cache_size'], settings.SQLITE_PRAGMAS['cache_size'])
+
+    def test_rollback_journal_keeps_full_sync(self):
+        pragmas = self.pragmas('delete')
+        self.assertEqual(pragmas['synchronous'], 2)  # FULL, SQLite's default
+        self.assertEqual(pragmas['temp_store'], 2)
+
+
+def _plan_nodes(node):
+    yield node['Node Type']
+    for child in node.get('Plans', []):
+        yield from _plan_nodes(child)
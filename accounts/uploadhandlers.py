@@ -0,0 +1,79 @@
+"""
+Upload handlers that compute the SHA-256 of each uploaded file while the
+request body streams in, so ContentAddressedStorage never re-reads it.
+
+Uploads too large for memory go to an anonymous temp file, encrypted
+(accounts/streamcrypto.py) under a key that exists only in the uploaded file
+object: the plaintext never reaches the disk, and the temp file is unreadable
+once the request is over.
+"""
+import hashlib
+import tempfile
+
+from django.conf import settings
+from django.core.files.uploadedfile import UploadedFile
+from django.core.files.uploadhandler import FileUploadHandler, MemoryFileUploadHandler
+
+from .streamcrypto import EncryptedReader, EncryptedWriter, ephemeral_keys
+
+
+class EncryptedTemporaryUploadedFile(UploadedFile):
+    """Written to while the upload streams in, then read back decrypted after ``complete()``."""
+
+    def __init__(self, name, content_type, size, charset, content_type_extra=None):
+        self._raw = tempfile.TemporaryFile(suffix='.upload', dir=settings.FILE_UPLOAD_TEMP_DIR)
+        self._keys = ephemeral_keys()
+        super().__init__(EncryptedWriter(self._raw, self._keys), name, content_type, size, charset, content_type_extra)
+
+    def complete(self, size):
+        self.file.close()  # seals the last chunk
+        self.file = EncryptedReader(self._raw, self._keys)
+        self.size = size
+
+    def close(self):
+        self._raw.close()
+
+
+class EncryptedTemporaryFileUploadHandler(FileUploadHandler):
+    """TemporaryFileUploadHandler, with the temp file encrypted."""
+
+    def new_file(self, *args, **kwargs):
+        super().new_file(*args, **kwargs)
+        self.file = EncryptedTemporaryUploadedFile(
+            self.file_name, self.content_type, 0, self.charset, self.content_type_extra,
+        )
+
+    def receive_data_chunk(self, raw_data, start):
+        self.file.write(raw_data)
+
+    def file_complete(self, file_size):
+        self.file.complete(file_size)
+        return self.file
+
+    def upload_interrupted(self):
+        if hasattr(self, 'file'):
+            self.file.close()
+
+
+class HashingMixin:
+    def new_file(self, *args, **kwargs):
+        self._hasher = hashlib.sha256()
+        return super().new_file(*args, **kwargs)
+
+    def receive_data_chunk(self, raw_data, start):
+        self._hasher.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        uploaded = super().file_complete(file_size)
+        if uploaded is not None:
+            uploaded.sha256 = self._hasher.hexdigest()
+        return uploaded
+
+
+class HashingMemoryFileUploadHandler(HashingMixin, MemoryFileUploadHandler):
+    pass
+
+
+class HashingTemporaryFileUploadHandler(HashingMixin, EncryptedTemporaryFileUploadHandler):
+    pass
@@ -14,8 +14,14 @@ urlpatterns = [
     path('dashboard/', views.dashboard_view, name='dashboard'),
     path('admin-dashboard/', views.admin_dashboard_view, name='admin_dashboard'),
     path('doctor-dashboard/', views.doctor_dashboard_view, name='doctor_dashboard'),
+    path('doctor-dashboard/files/', views.doctor_files_view, name='doctor_files'),
     path('management-dashboard/', views.management_dashboard_view, name='management_dashboard'),
     
+    # ---------------- Resumable chunked uploads ----------------
+    path('uploads/', views.upload_init_view, name='upload_init'),
+    path('uploads/<uuid:upload_id>/', views.upload_chunk_view, name='upload_chunk'),
+    path('uploads/<uuid:upload_id>/finalize/', views.upload_finalize_view, name='upload_finalize'),
+    
     # ---------------- Admin Management Routes ----------------
     path('admin/manage-doctors/', views.manage_doctors_view, name='manage_doctors'),
     path('admin/manage-management/', views.manage_management_view, name='manage_management'),
@@ -24,4 +30,13 @@ urlpatterns = [
     # ---------------- File and Patient Management ----------------
     path('access-file/<int:file_id>/', views.access_patient_file_view, name='access_patient_file'),  # Changed name
     path('access-patient-pdf/<int:patient_id>/', views.access_patient_pdf_view, name='access_patient_pdf'),
+    path('download-file/<int:file_id>/', views.download_patient_file_view, name='download_patient_file'),
+    path('bundles/<uuid:bundle_id>/', views.access_bundle_view, name='access_bundle'),
+    path('bundles/<uuid:bundle_id>/download/', views.download_bundle_view, name='download_bundle'),
+    path('download-patient-pdf/<int:patient_id>/', views.download_patient_pdf_view, name='download_patient_pdf'),
+    path('export/<str:kind>/', views.export_view, name='export'),
+    path('search/patients/', views.search_patients_view, name='search_patients'),
+
+    # ---------------- Monitoring ----------------
+    path('metrics', views.metrics_view, name='metrics'),
 ]
\ No newline at end of file
@@ -1,5 +1,7 @@
 
 
+import os
+
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
@@ -10,6 +12,10 @@ urlpatterns = [
     path('', include('accounts.urls')),  # replace with your app
 ]
 
-# Serve media files during development
+# Media files are not served publicly: patient files and PDFs are delivered by the
+# OTP-protected download views in accounts (see accounts/downloads.py). Only profile
+# images are public; serve them during development (the web server's job in production).
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
+    urlpatterns += static(
+        settings.MEDIA_URL + 'profiles/', document_root=os.path.join(settings.MEDIA_ROOT, 'profiles'),
+    )